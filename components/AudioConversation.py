@@ -1,18 +1,35 @@
 import json
 import random
 import numpy as np
-from pydub import AudioSegment
+import librosa
 import os
-from typing import List
+from typing import List, Optional, Tuple
 from components.Dataloaders import Dataloader
+from components.AudioTools import AUDIO_DTYPE, TRIM_MARGIN, AudioTools
+from components.DecodeCache import LRUCache
+from components.UsageTracker import UsageTracker
+
+# Speech trim offsets computed in this process, keyed by (row, top_db); used when
+# the dataloader has no clip statistics index. Holds the offsets of at most 64k rows.
+_TRIM_CACHE = LRUCache(1 << 16)
 
 
 class AudioConversation:
-    def __init__(self,  data: Dataloader, num_speakers, sample_rate: int = 48000, languages: List[str] = ["DE", "EN"]):
+    def __init__(self,  data: Dataloader, num_speakers, sample_rate: int = 48000, languages: List[str] = ["DE", "EN"],
+                 trim_silence: bool = False, trim_margin: float = TRIM_MARGIN, trim_top_db: float = 30.0):
+        """
+        Args:
+            trim_silence (bool): Cut leading and trailing silence from every utterance
+            trim_margin (float): Silence in seconds kept before and after the speech
+            trim_top_db (float): Silence threshold when offsets are not indexed
+        """
         self.LANGUAGES = languages
         self.SAMPLE_RATE = sample_rate
         self.data = data
         self.num_speakers = num_speakers
+        self.trim_silence = trim_silence
+        self.trim_margin = trim_margin
+        self.trim_top_db = trim_top_db
 
     def pickSpeakers(self,dict, num_speakers):
         available_keys = []
@@ -30,6 +47,46 @@ class AudioConversation:
     def getSegmentsForSpeaker(self, speaker: str):
         return self.data.get_segementsForSpeaker(speaker)
 
+    def trim_offsets(self, row: int, audio: np.ndarray, sr: int) -> Tuple[int, int]:
+        """
+        Sample range of the speech in an utterance, without leading/trailing silence.
+
+        Offsets come from the speech table of the clip statistics index if there
+        is one; otherwise they are computed per row and kept in a bounded LRU
+        cache of the process.
+
+        Args:
+            row (int): Row of the utterance in the speech dataset
+            audio (np.ndarray): Decoded utterance
+            sr (int): Sample rate of the utterance
+
+        Returns:
+            Tuple[int, int]: (start, end) sample offsets including the trim margin
+        """
+        indexed = self.indexed_trim_offsets(row, len(audio), sr)
+        if indexed is not None:
+            return indexed
+        key = (row, self.trim_top_db)
+        bounds = _TRIM_CACHE.get(key)
+        if bounds is None:
+            bounds = AudioTools.silence_bounds(audio, sr, top_db=self.trim_top_db)
+            _TRIM_CACHE.put(key, bounds)
+        start, end = bounds
+        return AudioTools.trim_range(len(audio), start, end, sr, self.trim_margin)
+
+    def indexed_trim_offsets(self, row: int, num_samples: int, sr: int) -> Optional[Tuple[int, int]]:
+        """
+        `trim_offsets` from the clip statistics index alone, without the audio;
+        None if the speech corpus is not indexed.
+        """
+        stats = getattr(self.data, "stats", None)
+        if stats is None or "speech" not in stats:
+            return None
+        record = stats.table("speech")[row]
+        start = int(round(float(record["lead_silence"]) * sr))
+        end = num_samples - int(round(float(record["trail_silence"]) * sr))
+        return AudioTools.trim_range(num_samples, start, end, sr, self.trim_margin)
+
     # def arrangeSegments(self, speakers, num_segments):
     #     segments = [] # {"language": str, "id": str, "segment": str, "start": float, "end": float}
     #     for i in range(num_segments):
@@ -66,7 +123,163 @@ class AudioConversation:
     #         speaker['counter'] += 1
 
     #     return segments
-    def arrangeSegments(self, speakers, num_segments):
+    def plan_conversation(self, num_segments, min_length: Optional[float] = None,
+                          languages: Optional[List[str]] = None, weight: Optional[str] = None,
+                          max_attempts: int = 20, usage: Optional[UsageTracker] = None,
+                          rng: Optional[np.random.Generator] = None):
+        """
+        Draw the speakers and the dataset row of every segment from the speaker
+        table of the dataloader, before any audio is decoded.
+
+        A draw is rejected if it cannot fill `num_segments` segments with every
+        speaker speaking at least once, or if the planned speech is shorter than
+        `min_length` seconds. After `max_attempts` rejections the best plan is
+        used: preferably one in which every speaker speaks, then the longest.
+        Speakers it gives no turn (all of their utterances used up, or fewer
+        segments than speakers) are dropped, so every returned speaker speaks.
+
+        With a usage tracker every speaker gets their least used utterances
+        (ties broken at random) instead of random ones, and utterances used
+        `usage.max_reuse` times (see UsageTracker.available) are not planned at
+        all. Recording the uses of the plan is left to the caller.
+
+        Args:
+            num_segments (int): Number of segments
+            min_length (float, optional): Smallest total speech duration in seconds
+            languages (List[str], optional): Allowed speaker languages
+            weight (str, optional): Speaker weighting, see Dataloader.get_random_speakers
+            max_attempts (int): Number of draws before giving up, at least 1
+            usage (UsageTracker, optional): Shared use counts of the speech rows
+            rng (np.random.Generator, optional): Random generator; the global one if not given
+
+        Returns:
+            Tuple[List[dict], List[Tuple[dict, int]]]: Speakers and (speaker, dataset row) per segment
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        rng = np.random if rng is None else rng
+        index = self.data.speaker_index
+        best, best_score = None, None
+        for _ in range(max_attempts):
+            speakers = self.data.get_random_speakers(
+                self.num_speakers, languages=languages, min_utterances=1, weight=weight, rng=rng
+            )
+            plan, length = self._plan_rows(index, speakers, num_segments, usage, rng)
+            silent = len(speakers) - len({speaker['key'] for speaker, _ in plan})
+            if not silent and len(plan) == num_segments and (min_length is None or length >= min_length):
+                best = speakers, plan
+                break
+            score = (-silent, len(plan), length)
+            if best_score is None or score > best_score:
+                best, best_score = (speakers, plan), score
+        speakers, plan = best
+        if usage is not None and not plan:
+            raise RuntimeError(f"Every utterance of the drawn speakers was already placed {usage.max_reuse} times")
+        speaking = {speaker['key'] for speaker, _ in plan}
+        return [speaker for speaker in speakers if speaker['key'] in speaking], plan
+
+    @staticmethod
+    def _plan_rows(index, speakers, num_segments, usage=None, rng=None):
+        rng = np.random if rng is None else rng
+        if not speakers:
+            return [], 0.0
+        rows = [index.speaker_rows(sp['key']) for sp in speakers]
+        uses = [usage.uses(speaker_rows) for speaker_rows in rows] if usage is not None else None
+        available = [usage.available(speaker_rows) for speaker_rows in rows] if usage is not None else None
+        if available is not None and usage.max_reuse is not None:
+            capacity = np.array([int(mask.sum()) for mask in available])
+        else:
+            capacity = np.array([sp['utterances'] for sp in speakers])
+        # Every speaker speaks once, the remaining turns go to random speakers with utterances left
+        counts = np.zeros(len(speakers), dtype=int)
+        counts[:min(len(speakers), num_segments)] = 1
+        counts = np.minimum(counts, capacity)
+        for _ in range(num_segments - counts.sum()):
+            avail = np.flatnonzero(counts < capacity)
+            if len(avail) == 0:
+                break
+            counts[rng.choice(avail)] += 1
+        order = rng.permutation(np.repeat(np.arange(len(speakers)), counts))
+        # Random (or least used) utterances of each speaker, without repetition
+        picks = {}
+        for pos, (speaker, count) in enumerate(zip(speakers, counts)):
+            if uses is None:
+                choice = rng.choice(speaker['utterances'], size=count, replace=False)
+            else:
+                # Available utterances first, least used first, ties at random
+                choice = np.lexsort((rng.random(len(uses[pos])), uses[pos], ~available[pos]))[:count]
+            picks[pos] = list(zip(rows[pos][choice], index.speaker_durations(speaker['key'])[choice]))
+        plan, length = [], 0.0
+        for pos in order:
+            row, duration = picks[pos].pop()
+            plan.append((speakers[pos], int(row)))
+            length += float(duration)
+        return plan, length
+
+    def arrangeSegments(self, speakers, num_segments, plan=None, keep_audio=True, on_decode=None):
+        """
+        Decode the utterances of a conversation and lay them out back to back.
+
+        Args:
+            speakers (List[dict]): Speakers of the conversation
+            num_segments (int): Number of segments
+            plan (List[Tuple[dict, int]], optional): (speaker, dataset row) per segment from
+                `plan_conversation`; only these rows are decoded. Without a plan every
+                utterance of the speakers is decoded and turns are drawn at random.
+            keep_audio (bool): Keep the decoded audio in the segments; if False every
+                utterance is dropped once laid out and the segment records its
+                `num_samples` instead, so one utterance is held at a time
+            on_decode (Callable[[dict], None], optional): Called with every segment
+                while its audio is decoded
+        """
+        if plan is None:
+            plan = self._draw_turns(speakers, num_segments)
+        result = []
+        for speaker, seg in plan:
+            entry = {}
+            if not isinstance(seg, dict):
+                trim = None
+                if self.trim_silence:
+                    frames = self.data.speech_frames(seg)
+                    trim = self.indexed_trim_offsets(seg, *frames) if frames is not None else None
+                if trim is not None:
+                    # Only the trimmed frames are read from backends that read ranges
+                    seg = self.data.get_speech(seg, *trim)
+                    entry["trim"] = list(trim)
+                else:
+                    seg = self.data.get_speech(seg)
+            key      = speaker['key']
+            clip     = self.data.speech_audio(seg)
+            audio    = clip['array']
+            sr       = clip['sampling_rate']
+            duration = seg['json']['duration'] if "trim" not in entry else len(audio) / sr
+            if self.trim_silence and "trim" not in entry:
+                # Slicing is a view, the decoded utterance is not copied
+                trim_start, trim_end = self.trim_offsets(seg['__index__'], audio, sr)
+                audio    = audio[trim_start:trim_end]
+                duration = len(audio) / sr
+                entry["trim"] = [trim_start, trim_end]
+            result.append({
+                "language": speaker['language'],
+                "id":       key,
+                "segment":  seg['json']['text'],
+                "file_name":clip['path'],
+                "audio":     audio,         # avoid copying if possible
+                "sampling_rate": sr,
+                "row":      seg['__index__'],
+                **entry,
+                "start": result[-1]["end"] if result else 0,
+                "end":   (result[-1]["end"] if result else 0) + duration
+            })
+            if on_decode is not None:
+                on_decode(result[-1])
+            if not keep_audio:
+                result[-1]["audio"] = None
+                result[-1]["num_samples"] = len(audio)
+
+        return result
+
+    def _draw_turns(self, speakers, num_segments):
         # 1) Build a dict of full segment lists once
         segments_by_key = {
             sp['key']: self.getSegmentsForSpeaker(sp['key'])
@@ -75,7 +288,7 @@ class AudioConversation:
         # 2) Initialize counters in a separate dict
         counters = {sp['key']: 0 for sp in speakers}
 
-        result = []
+        turns = []
         for _ in range(num_segments):
             # 3) Filter speakers who still have segments left
             avail = [
@@ -88,39 +301,89 @@ class AudioConversation:
             # 4) Pick one at random
             speaker = random.choice(avail)
             key     = speaker['key']
-            seglist = segments_by_key[key]
-            idx     = counters[key]
-
-            seg = seglist[idx]
-            result.append({
-                "language": speaker['language'],
-                "id":       key,
-                "segment":  seg['json']['text'],
-                "file_name":seg['mp3']['path'],
-                "audio":     seg['mp3']['array'],         # avoid copying if possible
-                "sampling_rate": seg['mp3']['sampling_rate'],
-                "start": result[-1]["end"] if result else 0,
-                "end":   (result[-1]["end"] if result else 0) + seg['json']['duration']
-            })
+            turns.append((speaker, segments_by_key[key][counters[key]]))
             counters[key] += 1
 
-        return result
+        return turns
 
     # Apply Gap between segments using Gaussian Distribution
-    def applyGaussianGap(self, segments, mean, std):
+    def applyGaussianGap(self, segments, mean, std, rng=None):
+        rng = np.random if rng is None else rng
         for i in range(1, len(segments)):
-            gap = np.random.normal(mean, std)
+            gap = rng.normal(mean, std)
             # If same speaker, ensure gap is positive
             if segments[i]["id"] == segments[i-1]["id"]:
                 gap = abs(gap)
             # if gap < 0:
             #     print("Gap is negative: ", gap)
-            segments[i]["start"] = 0 + gap if i == 0 else segments[i-1]["end"] + gap
-            segments[i]["end"] = segments[i]["end"] - segments[i]["start"] + gap if i == 0 else segments[i-1]["end"] + gap + segments[i]["end"] - segments[i]["start"]
+            duration = segments[i]["end"] - segments[i]["start"]
+            segments[i]["start"] = max(0, segments[i-1]["end"] + gap)
+            segments[i]["end"] = segments[i]["start"] + duration
         return segments
 
+    # Render segments into per-speaker float32 stems
+    def render_stems(self, segments, sample_rate: Optional[int] = None) -> Tuple[List[str], np.ndarray]:
+        """
+        Render the segments into one track per speaker at a common sample rate.
+
+        The final sample offsets of every segment are stored in the segment as
+        `start_sample` and `end_sample`.
+
+        Args:
+            segments (list): Arranged segments with audio and start/end times
+            sample_rate (int, optional): Output sample rate, defaults to SAMPLE_RATE
+
+        Returns:
+            Tuple[List[str], np.ndarray]: Speaker ids in order of first appearance and
+                their stems as a (num_speakers, num_samples) float32 array
+        """
+        sample_rate = sample_rate or self.SAMPLE_RATE
+        speaker_ids = list(dict.fromkeys(segment["id"] for segment in segments))
+        rows = {speaker_id: row for row, speaker_id in enumerate(speaker_ids)}
+        length = int(np.ceil(max(segment["end"] for segment in segments) * sample_rate))
+        stems = np.zeros((len(speaker_ids), length), dtype=AUDIO_DTYPE)
+        for segment in segments:
+            audio = np.asarray(segment["audio"], dtype=AUDIO_DTYPE)
+            if segment["sampling_rate"] != sample_rate:
+                audio = librosa.resample(audio, orig_sr=segment["sampling_rate"], target_sr=sample_rate)
+            start = min(max(0, int(round(segment["start"] * sample_rate))), length)
+            end = min(start + len(audio), length)
+            stems[rows[segment["id"]], start:end] += audio[:end - start]
+            segment["start_sample"] = start
+            segment["end_sample"] = end
+        return speaker_ids, stems
+
+    def place_segments(self, segments, sample_rate: Optional[int] = None) -> Tuple[List[str], int]:
+        """
+        Compute the sample offsets `render_stems` would give the segments, without
+        rendering them.
+
+        `start_sample` and `end_sample` are stored in every segment; the length of
+        a resampled segment is that of librosa.resample.
+
+        Args:
+            segments (list): Arranged segments with audio (or `num_samples`) and start/end times
+            sample_rate (int, optional): Output sample rate, defaults to SAMPLE_RATE
+
+        Returns:
+            Tuple[List[str], int]: Speaker ids in order of first appearance and the
+                length of the conversation in samples
+        """
+        sample_rate = sample_rate or self.SAMPLE_RATE
+        speaker_ids = list(dict.fromkeys(segment["id"] for segment in segments))
+        length = int(np.ceil(max(segment["end"] for segment in segments) * sample_rate))
+        for segment in segments:
+            num_samples = len(segment["audio"]) if segment["audio"] is not None else segment["num_samples"]
+            if segment["sampling_rate"] != sample_rate:
+                num_samples = int(np.ceil(num_samples * sample_rate / segment["sampling_rate"]))
+            start = min(max(0, int(round(segment["start"] * sample_rate))), length)
+            segment["start_sample"] = start
+            segment["end_sample"] = min(start + num_samples, length)
+        return speaker_ids, length
+
     # Create Audio from segments
     def createAudio(self, segments, output_path):
+        from pydub import AudioSegment
         # Create empty audio segment
         # Get total duration from last segment's end time
         total_duration_ms = segments[-1]['end'] * 1000  # Convert to milliseconds
@@ -154,10 +417,14 @@ class AudioConversation:
         return stems
 
 
-    def augmentAudio(self, segmentDict, num_speakers, num_segments, output_dir, audio_root, mean=0, std=0.75):
-        selected_segments = self.data.get_random_speakers(num_speakers)
-        # Arrange Segments
-        segments = self.arrangeSegments(selected_segments, segmentDict, num_segments)
+    def augmentAudio(self, num_segments, output_dir, mean=0, std=0.75):
+        """
+        Render one conversation of the dataloader's speech to `output_dir`/output.wav
+        and its segments to `output_dir`/segments.json.
+        """
+        # Plan and arrange segments
+        speakers, plan = self.plan_conversation(num_segments, languages=self.LANGUAGES)
+        segments = self.arrangeSegments(speakers, num_segments, plan=plan)
 
         # Apply Gaussian Gap
         segments = self.applyGaussianGap(segments, mean, std) # Mean, Std
@@ -1,9 +1,10 @@
 import numpy as np
 import librosa
-import random
-from typing import Tuple, List, Optional
+from typing import Callable, Tuple, List, Optional
 import os
 from components.Dataloaders import Dataloader
+from components.DecodeCache import decode_cache
+from components.AudioTools import AUDIO_DTYPE, AudioTools
 
 class AudioEffects:
     def __init__(self, dataloader: Dataloader, sample_rate: int = 48000, max_sound_effect_length: float = 2.0, effect_gain: float = 0.5):
@@ -23,6 +24,9 @@ class AudioEffects:
     def apply_fade(self, audio: np.ndarray, fade_duration: float = 0.1) -> np.ndarray:
         """
         Apply fade-in and fade-out to an audio segment.
+
+        The input is not modified (it may be a read-only cached clip); the
+        faded signal is a new float32 array.
         
         Args:
             audio (np.ndarray): Audio signal to process
@@ -35,32 +39,34 @@ class AudioEffects:
         # Limit fade_length to at most half the audio length to avoid broadcast errors
         fade_length = min(fade_length, len(audio) // 2)
         
-        # Create fade-in and fade-out curves
-        fade_in = np.linspace(0, 1, fade_length)
-        fade_out = np.linspace(1, 0, fade_length)
+        # Fade-in and fade-out curves, cached per length
+        fade_in = AudioTools.ramp(fade_length)
+        fade_out = fade_in[::-1]
         
-        # Apply fades
-        audio[:fade_length] *= fade_in
-        audio[-fade_length:] *= fade_out
+        # Apply fades to a copy
+        faded = np.array(audio, dtype=AUDIO_DTYPE)
+        if fade_length > 0:
+            faded[:fade_length] *= fade_in
+            faded[-fade_length:] *= fade_out
         
-        return audio
+        return faded
     
-    def load_sound_effect(self) -> Tuple[np.ndarray, int]:
+    def load_sound_effect(self, index: Optional[int] = None) -> Tuple[np.ndarray, int]:
         """
         Load and preprocess a sound effect.
         
         Args:
-            effect_path (str): Path to the sound effect file
+            index (int, optional): Row of the sound effect dataset, random if not given
             
         Returns:
             Tuple[np.ndarray, int]: Processed sound effect and its sample rate
         """
-        # Load sound effect
-        effect = self.dataloader.get_random_sound_effect()
-        # Resample if necessary
-        # if sr != self.sample_rate:
-        #     effect = librosa.resample(effect, orig_sr=sr, target_sr=self.sample_rate)
-        
+        # Load sound effect at the output sample rate through the decode cache of the process (read-only)
+        if index is None:
+            index = self.dataloader.get_random_sound_effect_index()
+        index = int(index)
+        effect = decode_cache().get_or_decode(("sfx", index, self.sample_rate), lambda: self._decode(index))
+
         # Trim to maximum length
         max_samples = int(self.max_sound_effect_length * self.sample_rate)
         if len(effect) > max_samples:
@@ -68,11 +74,19 @@ class AudioEffects:
             
         # Apply fades
         effect = self.apply_fade(effect)
-        # Adjust effect loudness
-        effect = effect * self.effect_gain
+        # Adjust effect loudness in place, the faded effect is already a copy
+        effect *= np.asarray(self.effect_gain, dtype=AUDIO_DTYPE)
         
         return effect, self.sample_rate
     
+    def _decode(self, index: int) -> np.ndarray:
+        # Resample if necessary
+        effect, sr = self.dataloader.get_audio("sfx", index)
+        effect = np.asarray(effect, dtype=AUDIO_DTYPE)
+        if sr != self.sample_rate:
+            effect = librosa.resample(effect, orig_sr=sr, target_sr=self.sample_rate)
+        return np.asarray(effect, dtype=AUDIO_DTYPE)
+
     def overlay_audio(self, base_audio: np.ndarray, effect: np.ndarray, position: int) -> np.ndarray:
         """
         Overlay a sound effect on the base audio at a specific position.
@@ -100,40 +114,54 @@ class AudioEffects:
         
         return result
     
-    def apply_sound_effects(
+    def schedule_sound_effects(
         self,
-        audio: np.ndarray,
+        length: int,
         coverage: float = 0.3,
-        min_gap: float = 1.0
-    ) -> np.ndarray:
+        min_gap: float = 1.0,
+        rng: Optional[np.random.Generator] = None,
+        keep_audio: bool = True,
+        on_decode: Optional[Callable[[np.ndarray, int], None]] = None
+    ) -> List[Tuple[int, np.ndarray, int]]:
         """
-        Apply random sound effects to the audio with specified coverage.
+        Draw and load the sound effects for an audio signal of a given length
+        without touching the audio itself.
         
         Args:
-            audio (np.ndarray): Base audio signal
-            sound_effects_dir (str): Directory containing sound effect files
+            length (int): Length of the base audio in samples
             coverage (float): Probability of adding a sound effect at each position
             min_gap (float): Minimum gap between sound effects in seconds
+            rng (np.random.Generator, optional): Random generator; the global one if not given
+            keep_audio (bool): Keep the loaded effects; if False only their lengths
+                are returned, so a long schedule holds no audio
+            on_decode (Callable[[np.ndarray, int], None], optional): Called with every
+                placed effect and its row while it is loaded
             
         Returns:
-            np.ndarray: Audio with sound effects applied
+            List[Tuple[int, np.ndarray, int]]: (position, effect, dataset row) triples to overlay;
+                (position, length, dataset row) without `keep_audio`
         """
+        rng = np.random if rng is None else rng
         # Calculate minimum gap in samples
         min_gap_samples = int(min_gap * self.sample_rate)
         
         # Initialize position
         position = 0
+        schedule = []
         
         # Process audio in chunks
-        while position < len(audio):
+        while position < length:
             # Decide whether to add sound effect
-            if random.random() < coverage:
+            if rng.random() < coverage:
                 # Load and process effect
-                effect, _ = self.load_sound_effect()
+                row = self.dataloader.get_random_sound_effect_index(rng)
+                effect, _ = self.load_sound_effect(row)
                 
-                # Apply effect if there's enough space
-                if position + len(effect) <= len(audio):
-                    audio = self.overlay_audio(audio, effect, position)
+                # Keep effect if there's enough space
+                if position + len(effect) <= length:
+                    if on_decode is not None:
+                        on_decode(effect, row)
+                    schedule.append((position, effect if keep_audio else len(effect), row))
                     
                 # Move position forward
                 position += len(effect) + min_gap_samples
@@ -141,4 +169,45 @@ class AudioEffects:
                 # Move to next potential position
                 position += min_gap_samples
                 
-        return audio 
\ No newline at end of file
+        return schedule
+    
+    def apply_scheduled_effects(self, audio: np.ndarray, schedule: List[Tuple[int, np.ndarray, int]]) -> np.ndarray:
+        """
+        Overlay sound effects drawn by schedule_sound_effects.
+
+        The audio is copied once and every effect is added to the copy in place.
+        
+        Args:
+            audio (np.ndarray): Base audio signal
+            schedule (List[Tuple[int, np.ndarray, int]]): (position, effect, row) triples
+            
+        Returns:
+            np.ndarray: Audio with sound effects applied
+        """
+        result = np.array(audio, dtype=AUDIO_DTYPE)
+        for position, effect, _ in schedule:
+            position = max(0, position)
+            end = min(position + len(effect), len(result))
+            if end > position:
+                result[position:end] += effect[:end - position]
+        return result
+    
+    def apply_sound_effects(
+        self,
+        audio: np.ndarray,
+        coverage: float = 0.3,
+        min_gap: float = 1.0
+    ) -> np.ndarray:
+        """
+        Apply random sound effects to the audio with specified coverage.
+        
+        Args:
+            audio (np.ndarray): Base audio signal
+            coverage (float): Probability of adding a sound effect at each position
+            min_gap (float): Minimum gap between sound effects in seconds
+            
+        Returns:
+            np.ndarray: Audio with sound effects applied
+        """
+        schedule = self.schedule_sound_effects(len(audio), coverage, min_gap)
+        return self.apply_scheduled_effects(audio, schedule)
@@ -2,10 +2,28 @@
 # Date: 28/03/2025
 # Description: AudioTools
 
+import os
 import librosa as lr
 import numpy as np
-from typing import Optional, List
-import pyloudnorm as pyln
+from functools import lru_cache
+from typing import Callable, Optional, List
+
+# Sample type of every buffer the pipeline mixes. Measurements (loudness, filter
+# design) may accumulate in float64, but audio handed from stage to stage is float32.
+AUDIO_DTYPE = np.float32
+
+# Verify every mixing stage of DataGen (see AudioTools.stage); set DAP_CHECK_STAGES=1
+# in the environment, which worker processes inherit, or call AudioTools.check_stages
+_CHECK_STAGES = os.environ.get("DAP_CHECK_STAGES", "") not in ("", "0")
+
+# Silence in seconds kept before and after trimmed speech, see AudioTools.trim_range
+TRIM_MARGIN = 0.05
+
+# Allocations below this size never count as a buffer copy in stage checks
+_STAGE_SLACK = 4 << 20
+
+# Stages checked in this process; the first allocating run of a stage only has its dtypes checked
+_CHECKED_STAGES = set()
 
 class AudioTools:
     """
@@ -14,6 +32,121 @@ class AudioTools:
     def __init__(self):
         pass
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_meter(sr: int) -> "pyloudnorm.Meter":
+        """
+        Get the BS.1770 loudness meter for a sample rate, created once per process.
+        
+        Args:
+            sr (int): Sample rate of the audio
+        
+        Returns:
+            pyln.Meter: Cached loudness meter
+        """
+        import pyloudnorm as pyln
+        return pyln.Meter(sr)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def k_weighting_sos(sr: int) -> np.ndarray:
+        """
+        Get the K-weighting filter of the loudness meter as second-order sections.
+        
+        Args:
+            sr (int): Sample rate of the audio
+        
+        Returns:
+            np.ndarray: (2, 6) SOS array (high shelf, high pass); shared, do not modify
+        """
+        meter = AudioTools.get_meter(sr)
+        sos = np.array([
+            np.concatenate([f.b / f.a[0], f.a / f.a[0]])
+            for f in meter._filters.values()
+        ])
+        return sos
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def ramp(length: int) -> np.ndarray:
+        """
+        Get a linear ramp from 0 to 1 for fades and crossfades, created once per length.
+        
+        Args:
+            length (int): Number of samples
+        
+        Returns:
+            np.ndarray: Read-only AUDIO_DTYPE ramp; `ramp[::-1]` is the matching fade-out
+        """
+        ramp = np.linspace(0, 1, length, dtype=AUDIO_DTYPE)
+        ramp.flags.writeable = False
+        return ramp
+
+    @staticmethod
+    def check_stages(enabled: bool = True) -> None:
+        """
+        Turn the stage checks of `stage` on or off in this process.
+        """
+        global _CHECK_STAGES
+        _CHECK_STAGES = enabled
+
+    @staticmethod
+    def checking_stages() -> bool:
+        """
+        Whether `stage` checks the stages in this process. Its allocation
+        accounting covers every thread, so callers must not run other work
+        (such as decode threads) alongside a checked stage.
+        """
+        return _CHECK_STAGES
+
+    @staticmethod
+    def stage(name: str, copies: float, fn: Callable, *args, **kwargs):
+        """
+        Run one mixing stage, `fn(*args, **kwargs)`.
+        
+        With stage checks enabled, every array the stage returns must be
+        AUDIO_DTYPE, and the memory it allocates (traced with tracemalloc) must
+        not exceed `copies` buffers the size of its largest output. A stage that
+        promotes its buffer to float64 or copies it more often than declared fails
+        with an AssertionError naming the stage. The first run of each stage in a
+        process that allocates is exempt from the copy budget, since it also pays
+        for lazy imports and cached filters or ramps. Without checks the stage just runs.
+
+        tracemalloc is started with the first checked stage and keeps tracing for
+        the life of the process. It counts the allocations of all threads, so
+        nothing else may run while a stage is checked (see `checking_stages`).
+        
+        Args:
+            name (str): Stage name for error messages
+            copies (float): Full-size buffers the stage may allocate, its output included
+            fn (Callable): The stage
+        
+        Returns:
+            The result of the stage
+        """
+        if not _CHECK_STAGES:
+            return fn(*args, **kwargs)
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        result = fn(*args, **kwargs)
+        allocated = tracemalloc.get_traced_memory()[1] - base
+        arrays = [item for item in (result if isinstance(result, tuple) else (result,)) if isinstance(item, np.ndarray)]
+        for array in arrays:
+            assert array.dtype == AUDIO_DTYPE, f"Stage {name} returned {array.dtype} audio instead of {np.dtype(AUDIO_DTYPE)}"
+        if name not in _CHECKED_STAGES:
+            # A stage that passed its input through has not warmed up yet
+            if allocated > _STAGE_SLACK:
+                _CHECKED_STAGES.add(name)
+            return result
+        size = max((array.nbytes for array in arrays), default=0)
+        assert allocated <= copies * size + _STAGE_SLACK, (
+            f"Stage {name} allocated {allocated / max(size, 1):.1f} buffer copies, {copies} expected"
+        )
+        return result
+
     def load_audio(self, file_path: str, sr: int = 16000, mono: bool = True) -> tuple:
         """
         Load an audio file and resample it to the specified sample rate.
@@ -53,6 +186,73 @@ class AudioTools:
         """
         return lr.resample(audio, orig_sr=orig_sr, target_sr=target_sr)
     
+    @staticmethod
+    def limit_peak(audio: np.ndarray, ceiling: float = 1.0) -> np.ndarray:
+        """
+        Scale an audio signal down so its peak does not exceed a ceiling.
+        
+        Args:
+            audio (np.ndarray): Audio signal
+            ceiling (float): Largest allowed absolute sample value
+        
+        Returns:
+            np.ndarray: The signal, scaled in place if it exceeded the ceiling
+        """
+        # max/min instead of abs, which would allocate a copy of the buffer
+        peak = max(audio.max(), -audio.min()) if len(audio) else 0.0
+        if peak > ceiling:
+            audio *= np.asarray(ceiling / peak, dtype=audio.dtype)
+        return audio
+
+    @staticmethod
+    def silence_bounds(audio: np.ndarray, sr: int, top_db: float = 30.0, frame_duration: float = 0.01) -> tuple:
+        """
+        Find the leading and trailing silence of an audio signal from frame energies.
+        
+        A frame is silent if its RMS is more than `top_db` below the loudest frame.
+        
+        Args:
+            audio (np.ndarray): Audio signal
+            sr (int): Sample rate of the audio
+            top_db (float): Threshold below the loudest frame in dB
+            frame_duration (float): Frame length in seconds
+        
+        Returns:
+            tuple: (start, end) sample offsets of the non-silent part; (0, 0) if silent
+        """
+        frame = max(1, int(frame_duration * sr))
+        num_frames = -(-len(audio) // frame)
+        if num_frames == 0:
+            return 0, 0
+        padded = np.zeros(num_frames * frame, dtype=AUDIO_DTYPE)
+        padded[:len(audio)] = audio
+        energy = np.mean(np.square(padded.reshape(num_frames, frame)), axis=1, dtype=np.float64)
+        peak = energy.max()
+        if peak <= 0:
+            return 0, 0
+        active = np.flatnonzero(energy > peak * 10.0 ** (-top_db / 10.0))
+        return int(active[0] * frame), int(min(len(audio), (active[-1] + 1) * frame))
+
+    @staticmethod
+    def trim_range(num_samples: int, start: int, end: int, sr: int, margin: float = TRIM_MARGIN) -> tuple:
+        """
+        Sample range kept when silence is trimmed from a clip.
+
+        Args:
+            num_samples (int): Length of the clip
+            start (int): First speech sample, see `silence_bounds`
+            end (int): End of the speech, see `silence_bounds`
+            sr (int): Sample rate of the clip
+            margin (float): Silence in seconds kept before and after the speech
+
+        Returns:
+            tuple: (start, end) sample offsets; the whole clip if it has no speech
+        """
+        if end <= start:
+            return 0, num_samples
+        margin = int(margin * sr)
+        return max(0, start - margin), min(num_samples, end + margin)
+
     def trim_audio(self, audio: np.ndarray, top_db: int = 20) -> np.ndarray:
         """
         Trim silence from the beginning and end of an audio signal.
@@ -79,13 +279,14 @@ class AudioTools:
             np.ndarray: Loudness-adjusted audio signal.
         """
 
-        meter = pyln.Meter(sr)
+        meter = self.get_meter(sr)
         loudness = meter.integrated_loudness(audio)
         if allow_variance:
             # Calculate the variance in loudness
             loudness_variance = np.std(audio)
             # Adjust the target loudness based on variance
             target_loudness += loudness_variance
+        import pyloudnorm as pyln
         return pyln.normalize.loudness(audio, loudness, target_loudness)
        
     
\ No newline at end of file
@@ -0,0 +1,309 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from math import gcd
+from typing import List, Optional, Sequence, Tuple
+
+from components.AudioTools import AUDIO_DTYPE
+
+
+class AugmentationStage(ABC):
+    """
+    One step of an AugmentationChain.
+
+    A stage runs with `probability` per sample. Its random parameters are drawn
+    by `draw` from the per-sample generator and passed to `process`, which works
+    on the whole float32 buffer at once. The drawn parameters are JSON-friendly
+    and end up in the sample metadata.
+    """
+    name = "stage"
+
+    def __init__(self, probability: float = 1.0):
+        """
+        Args:
+            probability (float): Probability that the stage runs for a sample
+        """
+        self.probability = probability
+
+    def draw(self, rng: np.random.Generator, sample_rate: int) -> dict:
+        """
+        Draw the parameters of the stage for one sample.
+        """
+        return {}
+
+    @abstractmethod
+    def process(self, audio: np.ndarray, params: dict, rng: np.random.Generator, sample_rate: int) -> np.ndarray:
+        """
+        Apply the stage with drawn parameters. Must not modify `audio` in place.
+        """
+
+
+class NoiseStage(AugmentationStage):
+    """
+    Stationary white, pink or brown noise at a signal-to-noise ratio drawn from a range.
+
+    The SNR refers to the mean power of the whole signal.
+    """
+    name = "noise"
+    # Power spectral density exponent of each noise colour
+    COLORS = {"white": 0.0, "pink": 1.0, "brown": 2.0}
+
+    def __init__(self, probability: float = 1.0, snr_range: Tuple[float, float] = (5.0, 30.0),
+                 colors: Sequence[str] = ("white", "pink", "brown")):
+        """
+        Args:
+            probability (float): Probability that the stage runs for a sample
+            snr_range (Tuple[float, float]): Range of SNRs in dB
+            colors (Sequence[str]): Noise colours to choose from
+        """
+        super().__init__(probability)
+        unknown = set(colors) - set(self.COLORS)
+        if unknown:
+            raise ValueError(f"Unknown noise colors: {sorted(unknown)}")
+        self.snr_range = tuple(snr_range)
+        self.colors = list(colors)
+
+    def draw(self, rng, sample_rate):
+        return {
+            "snr": round(float(rng.uniform(*self.snr_range)), 2),
+            "color": self.colors[rng.integers(len(self.colors))],
+        }
+
+    def process(self, audio, params, rng, sample_rate):
+        # Accumulated in float64 without a float64 copy of the signal
+        power = np.einsum("i,i->", audio, audio, dtype=np.float64) / len(audio) if len(audio) else 0.0
+        if power <= 0.0:
+            return audio
+        noise = self.noise(len(audio), params["color"], rng)
+        noise *= np.asarray(np.sqrt(power / 10.0 ** (params["snr"] / 10.0)), dtype=AUDIO_DTYPE)
+        noise += audio
+        return noise
+
+    def noise(self, length: int, color: str, rng: np.random.Generator) -> np.ndarray:
+        """
+        Unit-power noise of a colour, shaped in the frequency domain.
+
+        Args:
+            length (int): Number of samples
+            color (str): One of COLORS
+            rng (np.random.Generator): Random generator
+
+        Returns:
+            np.ndarray: float32 noise
+        """
+        white = rng.standard_normal(length, dtype=AUDIO_DTYPE)
+        exponent = self.COLORS[color]
+        if exponent == 0.0 or length < 2:
+            return white
+        # scipy.fft keeps single precision: complex64 spectrum, float32 result
+        from scipy import fft
+        spectrum = fft.rfft(white)
+        del white
+        freqs = np.arange(len(spectrum), dtype=AUDIO_DTYPE)
+        freqs[0] = 1.0
+        spectrum *= freqs ** AUDIO_DTYPE(-exponent / 2.0)
+        spectrum[0] = 0.0
+        shaped = fft.irfft(spectrum, n=length)
+        del spectrum
+        rms = np.sqrt(np.einsum("i,i->", shaped, shaped, dtype=np.float64) / length)
+        if rms > 0:
+            shaped /= AUDIO_DTYPE(rms)
+        return shaped
+
+
+@lru_cache(maxsize=None)
+def _band_sos(low: Optional[float], high: Optional[float], order: int, sample_rate: int) -> np.ndarray:
+    from scipy import signal
+    nyquist = sample_rate / 2.0
+    high = None if high is None or high >= nyquist else high
+    if low and high:
+        return signal.butter(order, [low, high], btype="bandpass", output="sos", fs=sample_rate)
+    if low:
+        return signal.butter(order, low, btype="highpass", output="sos", fs=sample_rate)
+    if high:
+        return signal.butter(order, high, btype="lowpass", output="sos", fs=sample_rate)
+    return np.zeros((0, 6))
+
+
+class BandPassStage(AugmentationStage):
+    """
+    Band limiting with one of a fixed set of Butterworth band-passes.
+
+    The second-order sections of every band are designed once per sample rate and
+    process; None as an edge makes the band a low- or high-pass.
+    """
+    name = "bandpass"
+    # Narrowband telephony, wideband telephony and a cheap loudspeaker
+    DEFAULT_BANDS = ((300.0, 3400.0), (50.0, 7000.0), (200.0, 8000.0))
+
+    def __init__(self, probability: float = 1.0,
+                 bands: Sequence[Tuple[Optional[float], Optional[float]]] = DEFAULT_BANDS, order: int = 4):
+        """
+        Args:
+            probability (float): Probability that the stage runs for a sample
+            bands (Sequence[Tuple[float, float]]): (low, high) edges in Hz to choose from
+            order (int): Butterworth order of each edge
+        """
+        super().__init__(probability)
+        self.bands = [tuple(band) for band in bands]
+        self.order = order
+
+    def draw(self, rng, sample_rate):
+        low, high = self.bands[rng.integers(len(self.bands))]
+        return {"low": low, "high": high}
+
+    def process(self, audio, params, rng, sample_rate):
+        sos = _band_sos(params["low"], params["high"], self.order, sample_rate)
+        if len(sos) == 0:
+            return audio
+        from scipy import signal
+        # Single-precision sections filter in float32 instead of promoting the signal
+        return signal.sosfilt(sos.astype(AUDIO_DTYPE), audio)
+
+
+class CodecStage(AugmentationStage):
+    """
+    Low-bitrate telephony codec simulation.
+
+    The signal is resampled to the codec rate, degraded, and resampled back:
+    "mulaw" is G.711 8-bit mu-law companding, "gsm" is a GSM full-rate style
+    coder that keeps 3 bits per sample with one scale per 5 ms sub-block
+    (the APCM quantizer of RPE-LTP, without the predictor).
+    """
+    name = "codec"
+    CODECS = ("mulaw", "gsm")
+    MU = 255.0
+
+    def __init__(self, probability: float = 1.0, codecs: Sequence[str] = CODECS, codec_rate: int = 8000):
+        """
+        Args:
+            probability (float): Probability that the stage runs for a sample
+            codecs (Sequence[str]): Codecs to choose from
+            codec_rate (int): Sample rate of the simulated codec
+        """
+        super().__init__(probability)
+        unknown = set(codecs) - set(self.CODECS)
+        if unknown:
+            raise ValueError(f"Unknown codecs: {sorted(unknown)}")
+        self.codecs = list(codecs)
+        self.codec_rate = codec_rate
+
+    def draw(self, rng, sample_rate):
+        return {"codec": self.codecs[rng.integers(len(self.codecs))]}
+
+    def process(self, audio, params, rng, sample_rate):
+        if len(audio) == 0:
+            return audio
+        from scipy import signal
+        factor = gcd(self.codec_rate, sample_rate)
+        narrow = signal.resample_poly(audio, self.codec_rate // factor, sample_rate // factor)
+        if params["codec"] == "mulaw":
+            narrow = self.mulaw(narrow)
+        else:
+            narrow = self.gsm(narrow, self.codec_rate)
+        wide = signal.resample_poly(narrow.astype(AUDIO_DTYPE, copy=False), sample_rate // factor, self.codec_rate // factor)
+        if len(wide) == len(audio):
+            return wide
+        out = np.zeros(len(audio), dtype=AUDIO_DTYPE)
+        out[:min(len(wide), len(audio))] = wide[:len(audio)]
+        return out
+
+    @classmethod
+    def mulaw(cls, audio: np.ndarray) -> np.ndarray:
+        """
+        Round-trip a signal through 8-bit mu-law.
+        """
+        audio = np.clip(audio, -1.0, 1.0)
+        compressed = np.sign(audio) * np.log1p(cls.MU * np.abs(audio)) / np.log1p(cls.MU)
+        quantized = np.round((compressed + 1.0) * 127.5) / 127.5 - 1.0
+        return np.sign(quantized) * np.expm1(np.abs(quantized) * np.log1p(cls.MU)) / cls.MU
+
+    @staticmethod
+    def gsm(audio: np.ndarray, sample_rate: int, bits: int = 3, block: float = 0.005) -> np.ndarray:
+        """
+        Block-adaptive coarse quantization in the style of the GSM full-rate coder.
+        """
+        block = max(1, int(block * sample_rate))
+        num_blocks = -(-len(audio) // block)
+        padded = np.zeros(num_blocks * block, dtype=AUDIO_DTYPE)
+        padded[:len(audio)] = audio
+        blocks = padded.reshape(num_blocks, block)
+        # Scale per block, itself quantized to 6 bits on a log scale as in RPE-LTP
+        scale = np.max(np.abs(blocks), axis=1, keepdims=True)
+        scale = np.where(scale > 0, 2.0 ** (np.ceil(np.log2(np.maximum(scale, 1e-9)) * 4.0) / 4.0), 1.0)
+        levels = 2 ** (bits - 1)
+        quantized = (np.floor(blocks / scale * levels) + 0.5) / levels
+        return (np.clip(quantized, -1.0, 1.0) * scale).reshape(-1)[:len(audio)]
+
+
+class AugmentationChain:
+    """
+    Ordered list of augmentation stages applied to the final mix.
+
+    Stages with probability zero are dropped when the chain is built, so an
+    empty chain costs nothing per sample.
+    """
+    def __init__(self, stages: Sequence[AugmentationStage] = ()):
+        """
+        Args:
+            stages (Sequence[AugmentationStage]): Stages in the order they run
+        """
+        self.stages = [stage for stage in stages if stage.probability > 0.0]
+
+    def __len__(self) -> int:
+        return len(self.stages)
+
+    def then(self, stage: AugmentationStage) -> "AugmentationChain":
+        """
+        Append a stage and return the chain, e.g.
+        `AugmentationChain().then(NoiseStage()).then(CodecStage(0.2))`.
+        """
+        if stage.probability > 0.0:
+            self.stages.append(stage)
+        return self
+
+    def __call__(self, audio: np.ndarray, rng: np.random.Generator, sample_rate: int) -> Tuple[np.ndarray, List[dict]]:
+        """
+        Run the stages on one signal.
+
+        Args:
+            audio (np.ndarray): Mono float32 signal
+            rng (np.random.Generator): Per-sample random generator
+            sample_rate (int): Sample rate of the signal
+
+        Returns:
+            Tuple[np.ndarray, List[dict]]: Augmented signal and the stages that ran
+                with their parameters
+        """
+        applied = []
+        for stage in self.stages:
+            if stage.probability < 1.0 and rng.random() >= stage.probability:
+                continue
+            params = stage.draw(rng, sample_rate)
+            audio = stage.process(audio, params, rng, sample_rate)
+            applied.append({"stage": stage.name, **params})
+        return audio, applied
+
+
+# Stage classes by the name used in pipeline configs
+STAGES = {stage.name: stage for stage in (NoiseStage, BandPassStage, CodecStage)}
+
+
+def chain_from_config(stages: Sequence[dict]) -> AugmentationChain:
+    """
+    Build a chain from config entries of the form {"stage": name, **arguments}.
+
+    Args:
+        stages (Sequence[dict]): Stage entries in the order they run
+
+    Returns:
+        AugmentationChain: The compiled chain
+    """
+    chain = AugmentationChain()
+    for entry in stages:
+        entry = dict(entry)
+        name = entry.pop("stage", None)
+        if name not in STAGES:
+            raise ValueError(f"Unknown augmentation stage: {name}")
+        chain.then(STAGES[name](**entry))
+    return chain
@@ -0,0 +1,213 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Optional
+from tqdm import tqdm
+
+from components.AudioTools import AudioTools
+from components.Loudness import LoudnessNormalizer
+
+# One record per dataset row; the record of row i is at position i
+CLIP_STATS_DTYPE = np.dtype([
+    ("duration", "<f4"),
+    ("sample_rate", "<i4"),
+    ("rms", "<f4"),
+    ("peak", "<f4"),
+    ("lufs", "<f4"),
+    ("lead_silence", "<f4"),
+    ("trail_silence", "<f4"),
+    # Loudness of the range trim_silence keeps (AudioTools.trim_range with TRIM_MARGIN)
+    ("trim_lufs", "<f4"),
+])
+
+# Clips measured together are capped at this many samples to bound memory
+_LOUDNESS_BATCH_SAMPLES = 1 << 24
+
+_worker_dataloader = None
+
+
+def _init_worker(dataloader) -> None:
+    global _worker_dataloader
+    _worker_dataloader = dataloader
+
+
+def _compute_stats(corpus: str, start: int, stop: int, top_db: float) -> tuple:
+    """
+    Decode rows [start, stop) of a corpus and compute their statistics.
+    """
+    stats = np.zeros(stop - start, dtype=CLIP_STATS_DTYPE)
+    pending = {}
+    normalizer = LoudnessNormalizer()
+
+    def flush(sr):
+        batch = pending.pop(sr)
+        rows = [idx for idx, _, _ in batch]
+        stats["lufs"][rows] = normalizer.integrated_loudness([clip for _, clip, _ in batch], sr)
+        stats["trim_lufs"][rows] = normalizer.integrated_loudness([trimmed for _, _, trimmed in batch], sr)
+
+    for idx, row in enumerate(range(start, stop)):
+        audio, sr = _worker_dataloader.get_audio(corpus, row)
+        audio = np.asarray(audio, dtype=np.float32)
+        lead, trail = AudioTools.silence_bounds(audio, sr, top_db=top_db)
+        stats[idx]["duration"] = len(audio) / sr
+        stats[idx]["sample_rate"] = sr
+        stats[idx]["rms"] = np.sqrt(np.mean(np.square(audio, dtype=np.float64))) if len(audio) else 0.0
+        stats[idx]["peak"] = np.max(np.abs(audio)) if len(audio) else 0.0
+        stats[idx]["lead_silence"] = lead / sr
+        stats[idx]["trail_silence"] = (len(audio) - trail) / sr
+        # From the stored offsets, like AudioConversation.trim_offsets
+        trim_start, trim_end = AudioTools.trim_range(
+            len(audio),
+            int(round(float(stats[idx]["lead_silence"]) * sr)),
+            len(audio) - int(round(float(stats[idx]["trail_silence"]) * sr)),
+            sr,
+        )
+        batch = pending.setdefault(sr, [])
+        batch.append((idx, audio, audio[trim_start:trim_end]))
+        if sum(len(clip) for _, clip, _ in batch) >= _LOUDNESS_BATCH_SAMPLES:
+            flush(sr)
+    for sr in list(pending):
+        flush(sr)
+    return corpus, start, stats
+
+
+class ClipStatsIndex:
+    """
+    Precomputed per-row statistics of the speech, music and sound effect corpora.
+
+    Every corpus is stored as `{corpus}.npy`, a structured array of CLIP_STATS_DTYPE
+    with one record per dataset row, and opened memory-mapped so lookups need no
+    decoding. `index.json` records the dataset fingerprint each table was built
+    from; `build` only recomputes tables whose fingerprint changed.
+    """
+    META_NAME = "index.json"
+
+    def __init__(self, directory: str):
+        """
+        Open an existing index directory.
+
+        Args:
+            directory (str): Directory written by `build`
+        """
+        self.directory = directory
+        meta_path = os.path.join(directory, self.META_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {}
+        self._tables = {}
+
+    def __contains__(self, corpus: str) -> bool:
+        return corpus in self.meta
+
+    def table(self, corpus: str) -> np.ndarray:
+        """
+        Memory-mapped statistics table of a corpus, indexed by dataset row.
+        """
+        if corpus not in self._tables:
+            path = os.path.join(self.directory, f"{corpus}.npy")
+            self._tables[corpus] = np.load(path, mmap_mode="r")
+        return self._tables[corpus]
+
+    def lufs(self, corpus: str, row: int, start: Optional[int] = None, end: Optional[int] = None) -> Optional[float]:
+        """
+        Indexed loudness of a row, or of the sample range [start, end) of it.
+
+        Only the whole clip and the range trimmed with the default margin
+        (AudioTools.trim_range) are indexed; other ranges return None and have
+        to be measured.
+        """
+        record = self.table(corpus)[row]
+        if start is None:
+            return float(record["lufs"])
+        sr = int(record["sample_rate"])
+        length = int(round(float(record["duration"]) * sr))
+        if (start, end) == (0, length):
+            return float(record["lufs"])
+        trimmed = AudioTools.trim_range(
+            length,
+            int(round(float(record["lead_silence"]) * sr)),
+            length - int(round(float(record["trail_silence"]) * sr)),
+            sr,
+        )
+        if (start, end) == trimmed and "trim_lufs" in record.dtype.names:
+            return float(record["trim_lufs"])
+        return None
+
+    def __getstate__(self):
+        # Workers re-open the memory maps themselves
+        state = self.__dict__.copy()
+        state["_tables"] = {}
+        return state
+
+    @classmethod
+    def build(
+        cls,
+        dataloader,
+        directory: str,
+        corpora: Iterable[str] = ("speech", "music", "sfx"),
+        num_workers: int = 8,
+        chunk_size: int = 256,
+        top_db: float = 30.0,
+        force: bool = False,
+    ) -> "ClipStatsIndex":
+        """
+        Compute the statistics of every row in parallel and persist them.
+
+        Args:
+            dataloader (Dataloader): Loader providing `get_audio`, `get_dataset` and `fingerprint`
+            directory (str): Output directory
+            corpora (Iterable[str]): Corpora to index
+            num_workers (int): Number of worker processes
+            chunk_size (int): Rows per task
+            top_db (float): Silence threshold below the loudest frame in dB
+            force (bool): Rebuild tables even if their fingerprint is unchanged
+
+        Returns:
+            ClipStatsIndex: The opened index
+        """
+        os.makedirs(directory, exist_ok=True)
+        index = cls(directory)
+        todo = []
+        for corpus in corpora:
+            fingerprint = dataloader.fingerprint(corpus)
+            if (not force and index.meta.get(corpus, {}).get("fingerprint") == fingerprint
+                    and index.table(corpus).dtype == CLIP_STATS_DTYPE):
+                continue
+            todo.append((corpus, fingerprint, len(dataloader.get_dataset(corpus))))
+        if not todo:
+            return index
+
+        tables = {
+            corpus: np.lib.format.open_memmap(
+                os.path.join(directory, f"{corpus}.npy.tmp"), mode="w+", dtype=CLIP_STATS_DTYPE, shape=(length,)
+            )
+            for corpus, _, length in todo
+        }
+        tasks = [
+            (corpus, start, min(start + chunk_size, length), top_db)
+            for corpus, _, length in todo
+            for start in range(0, length, chunk_size)
+        ]
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(dataloader,)) as executor:
+            futures = [executor.submit(_compute_stats, *task) for task in tasks]
+            with tqdm(total=sum(length for _, _, length in todo), desc="Indexing clips") as progress:
+                for future in as_completed(futures):
+                    corpus, start, stats = future.result()
+                    tables[corpus][start:start + len(stats)] = stats
+                    progress.update(len(stats))
+
+        for corpus, fingerprint, length in todo:
+            tables[corpus].flush()
+            del tables[corpus]
+            path = os.path.join(directory, f"{corpus}.npy")
+            os.replace(path + ".tmp", path)
+            index.meta[corpus] = {"fingerprint": fingerprint, "rows": length, "top_db": top_db}
+        meta_path = os.path.join(directory, cls.META_NAME)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index.meta, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+        index._tables = {}
+        return index
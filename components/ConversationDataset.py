@@ -0,0 +1,159 @@
+import os
+import queue
+import threading
+from contextlib import closing
+from typing import Iterator, Optional
+
+from components.DecodeCache import decode_cache
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    # Without torch the dataset is a plain iterable
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+# Marks the end of a worker's sample stream in the prefetch queue
+_DONE = object()
+
+
+class ConversationDataset(IterableDataset):
+    """
+    Iterable dataset rendering conversations of a DataGen on the fly, as float32
+    arrays; a torch IterableDataset when torch is installed.
+
+    Sample indices are dealt round-robin over all (rank, dataloader worker) pairs.
+    """
+    def __init__(
+        self,
+        generator,
+        num_samples: Optional[int] = None,
+        start_index: int = 1,
+        prefetch: int = 4,
+        rank: Optional[int] = None,
+        world_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            generator (DataGen): Configured generator; only its mixing chain is used
+            num_samples (int, optional): Number of samples per epoch; endless if not given
+            start_index (int): Index of the first sample
+            prefetch (int): Rendered samples each worker keeps ready
+            rank (int, optional): Rank of this process; from torch.distributed or
+                $RANK if not given
+            world_size (int, optional): Number of ranks; from torch.distributed or
+                $WORLD_SIZE if not given
+        """
+        self.generator = generator
+        self.num_samples = num_samples
+        self.start_index = start_index
+        self.prefetch = prefetch
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Select the epoch; call before iterating, as with DistributedSampler.
+        """
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        if self.num_samples is None:
+            raise TypeError("An endless ConversationDataset has no length")
+        return self.num_samples
+
+    def _distributed(self):
+        if self.rank is not None and self.world_size is not None:
+            return self.rank, self.world_size
+        try:
+            import torch.distributed as dist
+            if dist.is_available() and dist.is_initialized():
+                return dist.get_rank(), dist.get_world_size()
+        except ImportError:
+            pass
+        return int(os.environ.get("RANK", 0)), int(os.environ.get("WORLD_SIZE", 1))
+
+    def shard(self):
+        """
+        Position and stride of this (rank, worker) in the sample index stream.
+
+        Returns:
+            Tuple[int, int]: (offset, stride)
+        """
+        rank, world_size = self._distributed()
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def _indices(self, offset: int, stride: int) -> Iterator[int]:
+        first = self.start_index + (self.epoch * self.num_samples if self.num_samples is not None else 0)
+        i = first + offset
+        stop = None if self.num_samples is None else first + self.num_samples
+        while stop is None or i < stop:
+            yield i
+            i += stride
+
+    def sample(self, i: int, fetched=None) -> dict:
+        """
+        Render one sample.
+
+        Returns:
+            dict: `index`, `mix` (num_samples,), `stems` (num_speakers, num_samples),
+                `activity` (num_speakers, num_frames), `speakers` and `segments`
+                (metadata without audio)
+        """
+        generator = self.generator
+        mixed = generator._mix_sample(i, fetched if fetched is not None else generator._fetch_sample(i))
+        return {
+            "index": i,
+            "mix": mixed["mix"],
+            "stems": mixed["stems"],
+            "activity": mixed["activity"],
+            "speakers": mixed["speaker_ids"],
+            "segments": [{k: v for k, v in seg.items() if k != "audio"} for seg in mixed["segments"]],
+        }
+
+    def _produce(self, indices: Iterator[int], out: queue.Queue, stop: threading.Event) -> None:
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        generator = self.generator
+        try:
+            with closing(generator.prefetched(indices, generator._fetch_sample)) as samples:
+                for i, fetched in samples:
+                    if stop.is_set() or not put(self.sample(i, fetched)):
+                        break
+        except BaseException as error:
+            put(error)
+            return
+        put(_DONE)
+
+    def __iter__(self) -> Iterator[dict]:
+        offset, stride = self.shard()
+        decode_cache(self.generator.decode_cache_bytes)
+        out = queue.Queue(maxsize=max(1, self.prefetch))
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(self._indices(offset, stride), out, stop), daemon=True
+        )
+        producer.start()
+        try:
+            while True:
+                item = out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
@@ -1,23 +1,61 @@
-from typing import Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
 from components.Dataloaders import Dataloader
 import os
-import tempfile
 import json
 import io
-import librosa
 import soundfile as sf
-import tarfile
 import numpy as np
-from pydub import AudioSegment
 from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
 import time
+import shutil
+import tempfile
+import hashlib
+import librosa
+from functools import partial
+from contextlib import closing, nullcontext
+from multiprocessing import resource_tracker
 
 from components.AudioConversation import AudioConversation
 from components.MusicHandler import MusicHandler
 from components.AudioEffects import AudioEffects
+from components.DiarizationLabels import DiarizationLabels
+from components.Loudness import LoudnessNormalizer
+from components.DecodeCache import decode_cache
+from components.RoomReverb import RoomReverb
+from components.Augmentation import AugmentationChain, chain_from_config
+from components.AudioTools import AudioTools
+from components.ShardWriter import ShardWriter
+from components.SharedPayload import SharedPayload, SpooledPayload
+from components.StreamingRenderer import StreamEncoder, StreamingRenderer, pcm16
+from components.UsageTracker import UsageTracker
+
+# Generator of a worker process, set once by _init_worker
+_worker_generator = None
+
+
+def _init_worker(generator) -> None:
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _generate_chunk(indices, share=None) -> tuple:
+    return _worker_generator._generate_chunk(indices, share)
+
 
 class DataGen:
+    # Member extension per output format
+    AUDIO_EXTENSIONS = {"mp3": "mp3", "flac": "flac", "pcm": "pcm"}
+    # How segments are stored, see __init__
+    SEGMENT_STORAGE = ("encode", "reference", "utterances")
+    # Random streams of one sample, see sample_rng: the plan is drawn while
+    # decoding, the loudness targets and reverb while mixing
+    PLAN_STREAM = 0
+    MIX_STREAM = 1
+    # Stages run on the summed stems, in their default order; see __init__
+    MIX_STAGES = ("music", "effects", "augmentation")
+
     def __init__(
         self,
         dataloader: Dataloader,
@@ -32,10 +70,97 @@ class DataGen:
         speakers: Optional[int] = 2,
         num_segments: Optional[int] = 10,
         num_processors: Optional[int] = 12,
+        decode_threads: int = 4,
+        prefetch: int = 2,
+        post_shard_callback: Optional[Callable[[str, dict], None]] = None,
+        output_format: str = "mp3",
+        label_hop: float = 0.01,
+        speech_lufs: Optional[float] = None,
+        speech_lufs_jitter: float = 3.0,
+        music_lufs: Optional[float] = None,
+        effect_lufs: Optional[float] = None,
+        music_snr: Optional[Tuple[float, float]] = None,
+        effect_snr: Optional[Tuple[float, float]] = None,
+        trim_silence: bool = False,
+        reverb_probability: float = 0.0,
+        rir_dir: Optional[str] = None,
+        augmentation: Optional[AugmentationChain] = None,
+        seed: Optional[int] = None,
+        music_volume: float = 0.2,
+        music_crossfade: float = 2.0,
+        languages: Optional[List[str]] = None,
+        speaker_weight: Optional[str] = None,
+        min_conversation_length: Optional[float] = None,
+        max_plan_attempts: int = 20,
+        decode_cache_mb: float = 512,
+        loop_music: bool = False,
+        stream_block: Optional[float] = None,
+        balance_usage: bool = False,
+        max_reuse: Optional[int] = None,
+        segment_storage: str = "encode",
+        mix_stages: Sequence[str] = MIX_STAGES,
     ):
         """
         Initialize DataGen with pipeline components and generation parameters.
+
+        Args:
+            dataloader (Dataloader): Loader of speech, music and sound effects
+            n_samples (int): Number of samples to generate
+            files_per_tar (int): Samples per shard
+            output_dir (str): Directory of the shards, manifest and usage counts
+            sample_rate (int): Output sample rate
+            max_sound_effect_length (float): Longest sound effect in seconds
+            coverage (float): Share of the conversation covered by sound effects
+            min_gap (float): Mean gap between segments and between effects in seconds
+            effect_gain (float): Fixed effect gain without loudness targets
+            speakers (int, optional): Speakers per conversation
+            num_segments (int, optional): Segments per conversation
+            num_processors (int, optional): Worker processes
+            decode_threads (int): Decode threads per worker; 0 fetches on the rendering thread
+            prefetch (int): Samples fetched ahead of the one being rendered
+            post_shard_callback (Callable, optional): Called with the path and manifest entry of every shard
+            output_format (str): "mp3", "flac" or "pcm" (raw int16)
+            label_hop (float): Frame hop of the speaker activity labels in seconds
+            speech_lufs (float, optional): Mean loudness target of every speaker
+            speech_lufs_jitter (float): Range in LU around `speech_lufs` of a speaker's target
+            music_lufs (float, optional): Loudness target of the music
+            effect_lufs (float, optional): Loudness target of every effect
+            music_snr (Tuple[float, float], optional): Range of speech to music SNRs in dB
+            effect_snr (Tuple[float, float], optional): Range of speech to effect SNRs in dB
+            trim_silence (bool): Cut leading and trailing silence from every utterance
+            reverb_probability (float): Share of samples placed in a simulated or recorded room
+            rir_dir (str, optional): Directory of recorded impulse responses
+            augmentation (AugmentationChain, optional): Stages run on the final mix
+            seed (int, optional): Seed of every per-sample generator (see sample_rng)
+            music_volume (float): Fixed music volume without loudness targets
+            music_crossfade (float): Crossfade of looped music in seconds
+            languages (List[str], optional): Only draw speakers of these languages
+            speaker_weight (str, optional): "utterances" or "duration"; uniform if not set
+            min_conversation_length (float, optional): Redraw plans with less speech than this
+            max_plan_attempts (int): Draws before the best plan is taken
+            decode_cache_mb (float): Per-worker LRU cache of decoded clips; 0 disables it
+            loop_music (bool): Loop music shorter than the conversation
+            stream_block (float, optional): Render block by block with blocks of this
+                many seconds; no reverb or augmentation
+            balance_usage (bool): Plan the least used utterances of every speaker;
+                reproducible for the same chunk layout (see generate_data)
+            max_reuse (int, optional): Uses after which an utterance is no longer planned
+            segment_storage (str): "encode", "reference" or "utterances"
+            mix_stages (Sequence[str]): Order of "music", "effects" and "augmentation"
         """
+        if output_format not in self.AUDIO_EXTENSIONS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        if segment_storage not in self.SEGMENT_STORAGE:
+            raise ValueError(f"Unknown segment storage: {segment_storage}")
+        if max_plan_attempts < 1:
+            raise ValueError("max_plan_attempts must be at least 1")
+        if sorted(mix_stages) != sorted(self.MIX_STAGES):
+            raise ValueError(f"mix_stages must list each of {', '.join(self.MIX_STAGES)} once")
+        if stream_block is not None:
+            if reverb_probability > 0 or (augmentation is not None and len(augmentation)):
+                raise ValueError("Streaming render does not support reverb or augmentation")
+            if not StreamEncoder.supports(output_format):
+                raise ValueError(f"Streaming {output_format} output needs libsndfile 1.1 or later")
         self.dataloader = dataloader
         self.n_samples = n_samples
         self.files_per_tar = files_per_tar
@@ -47,116 +172,790 @@ class DataGen:
         self.speakers = speakers
         self.num_segments = num_segments
         self.num_processors = num_processors
+        self.decode_threads = decode_threads
+        self.prefetch = prefetch
+        self.decode_cache_bytes = int(decode_cache_mb * (1 << 20))
+        self.post_shard_callback = post_shard_callback
+        self.output_format = output_format
+        self.speech_lufs = speech_lufs
+        self.speech_lufs_jitter = speech_lufs_jitter
+        self.music_lufs = music_lufs
+        self.effect_lufs = effect_lufs
+        self.music_snr = music_snr
+        self.effect_snr = effect_snr
+        self.reverb_probability = reverb_probability
+        self.languages = languages
+        self.speaker_weight = speaker_weight
+        self.min_conversation_length = min_conversation_length
+        self.max_plan_attempts = max_plan_attempts
+        self.extension = self.AUDIO_EXTENSIONS[output_format]
+        self.augmentation = augmentation if augmentation is not None and len(augmentation) else None
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.loop_music = loop_music
+        self.renderer = StreamingRenderer(int(stream_block * sample_rate)) if stream_block is not None else None
+        self.spool_dir = os.path.join(self.output_dir, ".spool")
+        self.balance_usage = balance_usage or max_reuse is not None
+        self.max_reuse = max_reuse
+        self.segment_storage = segment_storage
+        # Created by generate_data; workers receive it with the generator
+        self.usage = None
+        # Plans drawn ahead by _generate_chunk, per sample index
+        self._plans = {}
         os.makedirs(self.output_dir, exist_ok=True)
 
         # Initialize pipeline components
-        self.audio_conversation = AudioConversation(self.dataloader, self.speakers)
-        self.music_handler = MusicHandler(self.dataloader)
+        self.audio_conversation = AudioConversation(self.dataloader, self.speakers, trim_silence=trim_silence)
+        self.music_handler = MusicHandler(self.dataloader, sample_rate=self.sample_rate, crossfade_duration=music_crossfade)
+        # Gain-staged music gets its level from the loudness stage
+        self.music_volume = 1.0 if self.music_lufs is not None or self.music_snr is not None else music_volume
+        # Gain-staged effects get their level from the loudness stage
+        gain_staged_effects = self.effect_lufs is not None or self.effect_snr is not None
         self.audio_effects = AudioEffects(
             dataloader=self.dataloader,
             sample_rate=self.sample_rate,
             max_sound_effect_length=self.max_sound_effect_length,
-            effect_gain=effect_gain
+            effect_gain=1.0 if gain_staged_effects else effect_gain
         )
+        self.labels = DiarizationLabels(sample_rate=self.sample_rate, hop=label_hop)
+        self.loudness = LoudnessNormalizer(sample_rate=self.sample_rate, stats=getattr(self.dataloader, "stats", None))
+        self.reverb = RoomReverb(sample_rate=self.sample_rate, ir_dir=rir_dir) if reverb_probability > 0 else None
+        # An empty augmentation chain is left out of the order
+        stages = {"music": self._mix_music, "effects": self._mix_effects, "augmentation": self._mix_augmentation}
+        self.mix_stages = [
+            stages[name] for name in mix_stages if name != "augmentation" or self.augmentation is not None
+        ]
 
-    def _generate_sample(self, i):
+    def __getstate__(self):
+        # Workers only render samples; the shard callback stays in the main process
+        state = self.__dict__.copy()
+        state["post_shard_callback"] = None
+        return state
+
+    @classmethod
+    def from_config(cls, config: dict, dataloader: Dataloader,
+                    post_shard_callback: Optional[Callable[[str, dict], None]] = None) -> "DataGen":
+        """
+        Compile a pipeline config (see PipelineConfig.load_config) into a generator.
+
+        Args:
+            config (dict): Complete pipeline config
+            dataloader (Dataloader): Loader of the configured sources
+            post_shard_callback (Callable, optional): Called for every completed shard
+
+        Returns:
+            DataGen: The configured generator
+        """
+        output, resources = config["output"], config["resources"]
+        conversation, loudness = config["conversation"], config["loudness"]
+        return cls(
+            dataloader=dataloader,
+            n_samples=output["n_samples"],
+            files_per_tar=output["files_per_tar"],
+            output_dir=output["dir"],
+            sample_rate=config["sample_rate"],
+            max_sound_effect_length=config["effects"]["max_length"],
+            coverage=config["effects"]["coverage"],
+            min_gap=conversation["min_gap"],
+            effect_gain=config["effects"]["gain"],
+            speakers=conversation["speakers"],
+            num_segments=conversation["num_segments"],
+            num_processors=resources["num_processors"],
+            decode_threads=resources["decode_threads"],
+            prefetch=resources["prefetch"],
+            post_shard_callback=post_shard_callback,
+            output_format=output["format"],
+            label_hop=config["labels"]["hop"],
+            speech_lufs=loudness["speech_lufs"],
+            speech_lufs_jitter=loudness["speech_lufs_jitter"],
+            music_lufs=loudness["music_lufs"],
+            effect_lufs=loudness["effect_lufs"],
+            music_snr=loudness["music_snr"],
+            effect_snr=loudness["effect_snr"],
+            trim_silence=conversation["trim_silence"],
+            reverb_probability=config["reverb"]["probability"],
+            rir_dir=config["reverb"]["rir_dir"],
+            augmentation=chain_from_config(config["augmentation"]),
+            seed=config["seed"],
+            music_volume=config["music"]["volume"],
+            music_crossfade=config["music"]["crossfade_duration"],
+            languages=conversation["languages"],
+            speaker_weight=conversation["speaker_weight"],
+            min_conversation_length=conversation["min_length"],
+            max_plan_attempts=conversation["max_plan_attempts"],
+            decode_cache_mb=resources["decode_cache_mb"],
+            loop_music=config["music"]["loop"],
+            stream_block=output["stream_block"],
+            balance_usage=conversation["balance_usage"],
+            max_reuse=conversation["max_reuse"],
+            segment_storage=output["segments"],
+            mix_stages=config["mix_stages"],
+        )
+
+    def _fetch_sample(self, i, keep_audio=True, on_segment=None, on_effect=None):
+        """
+        Decode-bound half of a sample: pick speakers and decode their utterances,
+        the background music and the sound effects.
+
+        Without `keep_audio` the utterances and effects are decoded one at a time
+        and dropped once laid out (see AudioConversation.arrangeSegments and
+        AudioEffects.schedule_sound_effects); `on_segment` and `on_effect` see
+        each of them while it is decoded.
+        """
+        planned = self._plans.pop(i, None)
+        rng, speakers, plan = planned if planned is not None else self._plan_sample(i)
         # Generate segments and apply gaps
-        speakers = self.dataloader.get_random_speakers(self.speakers)
-        segments = self.audio_conversation.arrangeSegments(speakers, self.num_segments)
-        segments = self.audio_conversation.applyGaussianGap(segments, 0, self.min_gap)
-        # Render to a temporary WAV and process
-        with tempfile.TemporaryDirectory() as tmpdir:
-            raw_wav = os.path.join(tmpdir, f"sample_{i}.wav")
-            stems = self.audio_conversation.createAudio(segments, raw_wav)
-            audio, sr = librosa.load(raw_wav, sr=self.sample_rate)
-            audio = self.music_handler.add_background_music(audio)
-            processed_audio = self.audio_effects.apply_sound_effects(
-                audio=audio,
-                coverage=self.coverage,
-                min_gap=self.min_gap
+        segments = self.audio_conversation.arrangeSegments(
+            speakers, self.num_segments, plan=plan, keep_audio=keep_audio, on_decode=on_segment
+        )
+        segments = self.audio_conversation.applyGaussianGap(segments, 0, self.min_gap, rng=rng)
+        duration = max(seg['end'] for seg in segments)
+        music_row = self.dataloader.get_random_music_index(min_duration=duration, rng=rng)
+        music, _ = self.music_handler.load_music(music_row)
+        length = int(np.ceil(duration * self.sample_rate))
+        effects = self.audio_effects.schedule_sound_effects(
+            length=length,
+            coverage=self.coverage,
+            min_gap=self.min_gap,
+            rng=rng,
+            keep_audio=keep_audio,
+            on_decode=on_effect
+        )
+        return segments, music, music_row, effects
+
+    def _plan_sample(self, i):
+        """
+        Draw the speakers and utterances of sample `i` and record their uses.
+
+        A balanced plan is drawn and recorded under the usage lock, so plans
+        sharing the tracker see each other's uses.
+
+        Returns:
+            Tuple: Plan stream of the sample, its speakers and its plan
+        """
+        rng = self.sample_rng(i, self.PLAN_STREAM)
+        balanced = self.usage is not None and self.balance_usage
+        with self.usage.locked() if balanced else nullcontext():
+            speakers, plan = self.audio_conversation.plan_conversation(
+                self.num_segments,
+                min_length=self.min_conversation_length,
+                languages=self.languages,
+                weight=self.speaker_weight,
+                max_attempts=self.max_plan_attempts,
+                usage=self.usage if balanced else None,
+                rng=rng
             )
+            if self.usage is not None:
+                self.usage.record([row for _, row in plan])
+        return rng, speakers, plan
+
+    def _loudness_gains(self, segments, music, music_row, effects, rng, measured=None):
+        """
+        Linear gains that bring speech segments, music and effects to their loudness
+        or SNR targets.
+
+        The speech gains are also recorded in the segments as `gain_db`, but no
+        audio is scaled. `measured` is the (speech, effect) loudness taken while
+        the clips were decoded (see `_fetch_stream_sample`); the segments and
+        effects are then not read and may carry no audio.
+
+        Returns:
+            Tuple: Gain of every segment, of the music and of every effect; None
+                for each part without a target
+        """
+        speech_loudness, effect_loudness = measured if measured is not None else (None, None)
+        if speech_loudness is None and (
+            self.speech_lufs is not None or self.music_snr is not None or self.effect_snr is not None
+        ):
+            speech_loudness = self.loudness.segment_loudness(segments)
+        speech_gains = None
+        if self.speech_lufs is not None:
+            targets = {
+                speaker_id: self.speech_lufs + rng.uniform(-self.speech_lufs_jitter, self.speech_lufs_jitter)
+                for speaker_id in dict.fromkeys(seg["id"] for seg in segments)
+            }
+            speech_gains = self.loudness.gains(speech_loudness, np.array([targets[seg["id"]] for seg in segments]))
+            self.loudness.apply_gains(segments, speech_gains, scale_audio=False)
+            if self.segment_storage != "encode":
+                # Referenced segments are rebuilt with the exact gain, gain_db is rounded
+                for seg, gain in zip(segments, speech_gains):
+                    seg["gain"] = float(np.float32(gain))
+        speech_level = None
+        if self.music_snr is not None or self.effect_snr is not None:
+            if speech_gains is not None:
+                speech_loudness = speech_loudness + 20.0 * np.log10(speech_gains)
+            speech_level = self.loudness.level(
+                speech_loudness,
+                weights=[seg["end"] - seg["start"] for seg in segments],
+            )
+            if not np.isfinite(speech_level):
+                speech_level = self.speech_lufs if self.speech_lufs is not None else -23.0
+
+        music_gain = None
+        music_target = self.music_lufs
+        if self.music_snr is not None:
+            music_target = speech_level - rng.uniform(*self.music_snr)
+        if music_target is not None:
+            loudness = self.loudness.cached_loudness([("music", music_row)], [music])
+            music_gain = self.loudness.gains(loudness, np.array([music_target]))[0]
+
+        if self.effect_snr is not None:
+            effect_targets = speech_level - rng.uniform(*self.effect_snr, size=len(effects))
+        elif self.effect_lufs is not None:
+            effect_targets = np.full(len(effects), self.effect_lufs)
+        else:
+            effect_targets = None
+        effect_gains = None
+        if effect_targets is not None and effects:
+            if effect_loudness is None:
+                effect_loudness = self.loudness.cached_loudness(
+                    [("sfx", row) for _, _, row in effects],
+                    [effect for _, effect, _ in effects],
+                )
+            effect_gains = self.loudness.gains(effect_loudness, effect_targets)
+        return speech_gains, music_gain, effect_gains
+
+    def _apply_loudness(self, segments, music, music_row, effects, rng):
+        """
+        Gain-stage speech segments, music and effects to their loudness or SNR targets.
+        """
+        speech_gains, music_gain, effect_gains = self._loudness_gains(segments, music, music_row, effects, rng)
+        if speech_gains is not None:
+            for seg, gain in zip(segments, speech_gains):
+                seg["audio"] = seg["audio"] * np.float32(gain)
+        if music_gain is not None:
+            music = music * np.float32(music_gain)
+        if effect_gains is not None:
+            effects = [
+                (position, effect * np.float32(gain), row)
+                for (position, effect, row), gain in zip(effects, effect_gains)
+            ]
+        return segments, music, effects
+
+    def _generate_sample(self, i):
+        return self._render_sample(i, self._fetch_sample(i))
+
+    def _mix_sample(self, i, fetched):
+        """
+        Mix the decoded audio of a sample into float32 stems, mix and labels.
+
+        Returns a dict with `segments`, `speaker_ids`, `stems` (num_speakers,
+        num_samples), `mix` (num_samples,), `activity` (num_speakers, num_frames),
+        `augmentation` (the stages that ran, or None), `music_row` and `effects`
+        ((start, duration, row) of every placed effect, in seconds).
+        """
+        segments, music, music_row, effects = fetched
+        rng = self.sample_rng(i, self.MIX_STREAM)
+        segments, music, effects = self._apply_loudness(segments, music, music_row, effects, rng)
+        # Every stage runs through AudioTools.stage, which checks its dtype and
+        # copies when DAP_CHECK_STAGES is set; the budgets count full-size float32
+        # buffers (the music stage also holds the looped track, reverb its FFT blocks)
+        speaker_ids, stems = AudioTools.stage(
+            "stems", 1, self.audio_conversation.render_stems, segments, self.sample_rate
+        )
+        if self.reverb is not None:
+            stems = AudioTools.stage("reverb", 3, self.reverb.apply, stems, self.reverb_probability, rng)
+        processed_audio = AudioTools.stage("sum", 1, stems.sum, axis=0)
+        sample = {"index": i, "music": music, "effects": effects, "augmentation": None}
+        for stage in self.mix_stages:
+            processed_audio = stage(processed_audio, sample)
+        applied = sample["augmentation"]
+        # Limit the peak once for the whole chain, in place
+        processed_audio = AudioTools.stage("limit", 0, AudioTools.limit_peak, processed_audio)
+        return {
+            "segments": segments,
+            "speaker_ids": speaker_ids,
+            "stems": stems,
+            "mix": processed_audio,
+            "activity": self.labels.activity(segments, speaker_ids, len(processed_audio)),
+            "augmentation": applied,
+            "music_row": int(music_row),
+            "effects": [
+                (position / self.sample_rate, len(effect) / self.sample_rate, int(row))
+                for position, effect, row in effects
+            ],
+        }
+
+    def _mix_music(self, audio, sample):
+        return AudioTools.stage(
+            "music", 2, self.music_handler.add_background_music,
+            audio,
+            music_volume=self.music_volume,
+            loop_music=self.loop_music,
+            music=sample["music"],
+            normalize=False
+        )
+
+    def _mix_effects(self, audio, sample):
+        return AudioTools.stage("effects", 1, self.audio_effects.apply_scheduled_effects, audio, sample["effects"])
+
+    def _mix_augmentation(self, audio, sample):
+        # Drawn from its own generator, so the order of the stages does not change the draws
+        rng = np.random.default_rng([self.seed, sample["index"]])
+        audio, sample["augmentation"] = AudioTools.stage(
+            "augmentation", 4, self.augmentation, audio, rng, self.sample_rate
+        )
+        return audio
+
+    def _render_sample(self, i, fetched):
+        """
+        CPU-bound half of a sample: mix the decoded audio and encode the outputs.
+
+        Returns the sample key and its tar members as (name, data) pairs.
+        """
+        mixed = self._mix_sample(i, fetched)
+        segments, speaker_ids, stems = mixed["segments"], mixed["speaker_ids"], mixed["stems"]
+        processed_audio, activity = mixed["mix"], mixed["activity"]
         # Define a zero-padded key
         key = f"{i-1:06d}"
-        # Prepare metadata JSON bytes
+        ext = self.extension
+        # Prepare segments bytes: encoded segments, source copies or nothing
+        if self.segment_storage == "encode":
+            segment_members = [
+                (f"{key}.s_{idx}.{ext}", self._encode_audio(seg['audio'], seg["sampling_rate"]))
+                for idx, seg in enumerate(segments)
+            ]
+            utterances = None
+        elif self.segment_storage == "utterances":
+            segment_members, utterances = self._utterance_members(key, segments)
+        else:
+            segment_members, utterances = [], None
+        sample_meta = self._sample_meta(
+            key, segments, speaker_ids, activity, len(processed_audio),
+            mixed["augmentation"], mixed["music_row"], mixed["effects"], utterances,
+        )
+        # Prepare stem audio
+        stem_members = [
+            (f"{key}.stem_{idx}.{ext}", self._encode_audio(stem, self.sample_rate))
+            for idx, stem in enumerate(stems)
+        ]
+        # Prepare final mix bytes
+        final_member = (f"{key}.{ext}", self._encode_audio(processed_audio, self.sample_rate))
+        meta_bytes = json.dumps(sample_meta, ensure_ascii=False).encode("utf-8")
+        members = [(f"{key}.json", meta_bytes)]
+        members.extend(segment_members)
+        members.extend(stem_members)
+        members.append(final_member)
+        members.extend(self._label_members(key, segments, activity))
+        return key, members
+
+    def _sample_meta(self, key, segments, speaker_ids, activity, num_samples, applied, music_row, effects,
+                     utterances=None) -> dict:
+        """
+        Sample JSON: segment metadata, augmentation, music, effects, labels and audio layout.
+
+        `utterances` maps the source row of every segment to its copy member
+        (see `_utterance_members`) when segments are stored as utterances.
+        """
+        ext = self.extension
         meta = []
         for idx, seg in enumerate(segments):
             entry = seg.copy()
             entry.pop('audio', None)
-            entry['stem_path'] = f"{key}_s_{idx}.mp3"
+            if self.segment_storage == "encode":
+                entry['stem_path'] = f"{key}.s_{idx}.{ext}"
+            elif utterances is not None:
+                entry['utterance'] = utterances[seg['row']]
             meta.append(entry)
-        meta_bytes = json.dumps({"segments": meta}, ensure_ascii=False).encode("utf-8")
-        # Prepare segments bytes
-        stem_bytes_list = []
-        for idx, seg in enumerate(segments):
-            pcm = (seg['audio'] * np.iinfo(np.int16).max).astype(np.int16).tobytes()
-            stem_seg = AudioSegment(pcm, frame_rate=seg["sampling_rate"], sample_width=2, channels=1)
-            buf = io.BytesIO()
-            stem_seg.export(buf, format="mp3")
-            stem_bytes_list.append(buf.getvalue())
-        # Prepare stem audio segments
-        for idx, (key_stem, stem_audioseg) in enumerate(stems.items()):
-            stem_buf = io.BytesIO()
-            stem_audioseg.export(stem_buf, format="mp3")
-            stem_data = stem_buf.getvalue()
-            stems[key_stem] = stem_data
-        # Prepare final mix bytes
-        final_pcm = (processed_audio * np.iinfo(np.int16).max).astype(np.int16).tobytes()
-        final_seg = AudioSegment(final_pcm, frame_rate=self.sample_rate, sample_width=2, channels=1)
-        final_buf = io.BytesIO()
-        final_seg.export(final_buf, format="mp3")
-        # Assemble stems list
-        segments = [(f"{key}.s_{idx}.mp3", data) for idx, data in enumerate(stem_bytes_list)]
-        return key, meta_bytes, segments,stems, final_buf.getvalue()
+        sample_meta = {"segments": meta}
+        if self.segment_storage != "encode":
+            sample_meta["speech"] = {"fingerprint": self.dataloader.fingerprint("speech")}
+        if applied is not None:
+            sample_meta["augmentation"] = applied
+        sample_meta["music"] = {"row": music_row}
+        sample_meta["effects"] = [
+            {"row": row, "start": round(start, 4), "duration": round(duration, 4)}
+            for start, duration, row in effects
+        ]
+        sample_meta["labels"] = {
+            "hop": self.labels.hop,
+            "speakers": speaker_ids,
+            "num_frames": activity.shape[1],
+        }
+        if self.output_format != "mp3":
+            sample_meta["audio"] = {
+                "format": self.output_format,
+                "sample_rate": self.sample_rate,
+                "num_samples": num_samples,
+                "stems": speaker_ids,
+            }
+        return sample_meta
+
+    def _label_members(self, key, segments, activity) -> List[Tuple[str, bytes]]:
+        # Diarization labels: packed activity matrix and RTTM
+        return [
+            (f"{key}.labels.bits", self.labels.pack(activity)),
+            (f"{key}.rttm", self.labels.rttm(segments, key).encode("utf-8")),
+        ]
+
+    def _utterance_members(self, key, segments) -> Tuple[List[Tuple[str, bytes]], dict]:
+        """
+        One lossless copy of every source row of a sample's segments.
+
+        The member is named after a digest of its bytes, so the ShardWriter can
+        keep a single copy of an utterance per shard (ShardWriter.SHARED_PREFIX).
+
+        Returns:
+            Tuple[List[Tuple[str, bytes]], dict]: (member name, data) of every copy,
+                and the member name of every source row
+        """
+        ext = "pcm" if self.output_format == "pcm" else "flac"
+        members, names = [], {}
+        for seg in segments:
+            row = seg['row']
+            if row in names:
+                continue
+            audio = self.dataloader.speech_audio(self.dataloader.get_speech(row))["array"]
+            pcm = pcm16(np.asarray(audio, dtype=np.float32))
+            if ext == "pcm":
+                data = pcm.tobytes()
+            else:
+                buf = io.BytesIO()
+                sf.write(buf, pcm, seg["sampling_rate"], format="FLAC", subtype="PCM_16")
+                data = buf.getvalue()
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            names[row] = f"{key}.{ShardWriter.SHARED_PREFIX}{digest}.{ext}"
+            members.append((names[row], data))
+        return members, names
+
+    def _encode_audio(self, audio: np.ndarray, sample_rate: int) -> bytes:
+        """
+        Encode a mono float signal in the configured output format.
+        """
+        pcm = pcm16(audio)
+        if self.output_format == "pcm":
+            return pcm.tobytes()
+        buf = io.BytesIO()
+        if self.output_format == "flac":
+            sf.write(buf, pcm, sample_rate, format="FLAC", subtype="PCM_16")
+        else:
+            from pydub import AudioSegment
+            segment = AudioSegment(pcm.tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
+            segment.export(buf, format="mp3")
+        return buf.getvalue()
+
+    def _fetch_stream_sample(self, i):
+        """
+        Decode-bound half of a streamed sample: plan it like `_fetch_sample`, keeping
+        only the length and loudness of every utterance and effect.
+        """
+        measure_speech = self.speech_lufs is not None or self.music_snr is not None or self.effect_snr is not None
+        measure_effects = self.effect_lufs is not None or self.effect_snr is not None
+        speech, effect = [], []
+
+        def on_segment(seg):
+            speech.append(self.loudness.segment_loudness([seg])[0])
+
+        def on_effect(audio, row):
+            effect.append(self.loudness.cached_loudness([("sfx", row)], [audio])[0])
+
+        segments, music, music_row, effects = self._fetch_sample(
+            i,
+            keep_audio=False,
+            on_segment=on_segment if measure_speech else None,
+            on_effect=on_effect if measure_effects else None,
+        )
+        speaker_ids, length = self.audio_conversation.place_segments(segments, self.sample_rate)
+        for seg in segments:
+            del seg["num_samples"]
+        measured = (np.array(speech) if measure_speech else None, np.array(effect) if measure_effects else None)
+        return segments, speaker_ids, length, music, music_row, effects, measured
+
+    def _stream_sample(self, i, fetched):
+        """
+        CPU-bound half of a streamed sample: render it block by block into spool files.
+
+        Returns the sample key and a SpooledPayload of its members, in the member
+        order of `_render_sample`.
+        """
+        segments, speaker_ids, length, music, music_row, effects, measured = fetched
+        speech_gains, music_gain, effect_gains = self._loudness_gains(
+            segments, music, music_row, effects, self.sample_rng(i, self.MIX_STREAM), measured
+        )
+        if speech_gains is None:
+            speech_gains = np.ones(len(segments))
+        if effect_gains is None:
+            effect_gains = np.ones(len(effects))
+        key = f"{i-1:06d}"
+        ext = self.extension
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spool = tempfile.mkdtemp(prefix=f"{key}.", dir=self.spool_dir)
+        try:
+            rows = {speaker_id: row for row, speaker_id in enumerate(speaker_ids)}
+            clips = [
+                (seg["start_sample"], seg["end_sample"] - seg["start_sample"], rows[seg["id"]],
+                 partial(self._stream_segment, seg, gain,
+                         os.path.join(spool, f"{key}.s_{idx}.{ext}") if self.segment_storage == "encode" else None))
+                for idx, (seg, gain) in enumerate(zip(segments, speech_gains))
+            ]
+            clips.extend(
+                (position, size, None, partial(self._stream_effect, row, gain))
+                for (position, size, row), gain in zip(effects, effect_gains)
+            )
+            loop = self.loop_music and len(music) < length
+
+            def background(start, stop):
+                block = self.music_handler.music_block(music, start, stop, loop=loop)
+                if music_gain is not None:
+                    block *= np.float32(music_gain)
+                return block * self.music_volume
+
+            mix_spool = os.path.join(spool, "mix.f32")
+            stems = [
+                StreamEncoder(os.path.join(spool, f"{key}.stem_{idx}.{ext}"), self.output_format, self.sample_rate)
+                for idx in range(len(speaker_ids))
+            ]
+            peak = 0.0
+            with open(mix_spool, "wb") as f:
+                for _, stem_block, mix_block in self.renderer.render(clips, len(speaker_ids), length, background):
+                    for encoder, block in zip(stems, stem_block):
+                        encoder.write(block)
+                    peak = max(peak, float(np.max(np.abs(mix_block))))
+                    mix_block.tofile(f)
+            for encoder in stems:
+                encoder.close()
+            # Limit the peak once for the whole mix, as AudioTools.limit_peak does
+            scale = np.float32(1.0 / peak) if peak > 1.0 else None
+            with open(mix_spool, "rb") as f, \
+                    StreamEncoder(os.path.join(spool, f"{key}.{ext}"), self.output_format, self.sample_rate) as encoder:
+                while True:
+                    block = np.fromfile(f, dtype=np.float32, count=self.renderer.block_size)
+                    if len(block) == 0:
+                        break
+                    encoder.write(block * scale if scale is not None else block)
+            os.remove(mix_spool)
+
+            utterance_members, utterances = [], None
+            if self.segment_storage == "utterances":
+                utterance_members, utterances = self._utterance_members(key, segments)
+            activity = self.labels.activity(segments, speaker_ids, length)
+            sample_meta = self._sample_meta(
+                key, segments, speaker_ids, activity, length, None, int(music_row),
+                [(position / self.sample_rate, size / self.sample_rate, int(row)) for position, size, row in effects],
+                utterances,
+            )
+            small = [(f"{key}.json", json.dumps(sample_meta, ensure_ascii=False).encode("utf-8"))]
+            small.extend(utterance_members)
+            small.extend(self._label_members(key, segments, activity))
+            for name, data in small:
+                with open(os.path.join(spool, name), "wb") as f:
+                    f.write(data)
+        except BaseException:
+            shutil.rmtree(spool, ignore_errors=True)
+            raise
+        names = [f"{key}.json"]
+        if self.segment_storage == "encode":
+            names.extend(f"{key}.s_{idx}.{ext}" for idx in range(len(segments)))
+        names.extend(name for name, _ in utterance_members)
+        names.extend(f"{key}.stem_{idx}.{ext}" for idx in range(len(speaker_ids)))
+        names.append(f"{key}.{ext}")
+        names.extend(name for name, _ in small[1 + len(utterance_members):])
+        return key, SpooledPayload(spool, [(name, name) for name in names])
+
+    def _stream_segment(self, segment, gain, path):
+        """
+        Load one segment for the streaming renderer: read it again, apply its gain,
+        write its segment member (unless `path` is None) and return it at the
+        output sample rate.
+        """
+        row = self.dataloader.get_speech(segment["row"], *segment.get("trim", (0, None)))
+        audio = self.dataloader.speech_audio(row)["array"]
+        audio = np.asarray(audio, dtype=np.float32) * np.float32(gain)
+        sr = segment["sampling_rate"]
+        if path is not None:
+            with StreamEncoder(path, self.output_format, sr) as encoder:
+                encoder.write(audio)
+        if sr != self.sample_rate:
+            audio = librosa.resample(audio, orig_sr=sr, target_sr=self.sample_rate)
+        return audio
+
+    def _stream_effect(self, row, gain):
+        effect, _ = self.audio_effects.load_sound_effect(row)
+        return effect * np.float32(gain)
+
+    def sample_rng(self, i: int, stream: int) -> np.random.Generator:
+        """
+        Generator of one random stream of sample `i`, seeded with (`seed`, i, stream).
+
+        Args:
+            i (int): Sample index
+            stream (int): PLAN_STREAM or MIX_STREAM
+
+        Returns:
+            np.random.Generator: Fresh generator of the stream
+        """
+        return np.random.default_rng([self.seed, i, stream])
+
+    def _generate_chunk(self, indices, share=None):
+        """
+        Render a contiguous run of samples inside one worker.
+
+        With `share`, a (slot, number of slots) pair, the chunk plans against
+        `self.usage.share(*share)`: every sample is planned up front in index
+        order, so the plans do not depend on decode thread timing.
+
+        Returns:
+            Tuple: (key, SharedPayload) or, when streaming, (key, SpooledPayload)
+                per sample, and the rows placed by the share (None without one)
+        """
+        decode_cache(self.decode_cache_bytes)
+        fetch = self._fetch_stream_sample if self.renderer is not None else self._fetch_sample
+        results = []
+        usage = self.usage
+        try:
+            if share is not None:
+                self.usage = usage.share(*share)
+                self._plans = {i: self._plan_sample(i) for i in indices}
+            with closing(self.prefetched(indices, fetch)) as samples:
+                for i, fetched in samples:
+                    if self.renderer is not None:
+                        results.append(self._stream_sample(i, fetched))
+                    else:
+                        key, members = self._render_sample(i, fetched)
+                        results.append((key, SharedPayload.pack(members)))
+        except BaseException:
+            # The parent never sees the payloads of a failed chunk
+            self.discard_payloads(results)
+            raise
+        finally:
+            planned_usage, self.usage = self.usage, usage
+            self._plans = {}
+        return results, planned_usage.placed if share is not None else None
+
+    def prefetched(self, indices: Iterable[int], fetch: Callable) -> Iterator[tuple]:
+        """
+        Yield (i, fetch(i)) for every index, with the next `prefetch` fetches running
+        on `decode_threads` threads; inline without threads or while stage checks run.
+        """
+        indices = iter(indices)
+        threads = 0 if AudioTools.checking_stages() else self.decode_threads
+        if threads <= 0:
+            for i in indices:
+                yield i, fetch(i)
+            return
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            pending = deque()
+            try:
+                for i in indices:
+                    pending.append((i, pool.submit(fetch, i)))
+                    if len(pending) >= self.prefetch:
+                        break
+                while pending:
+                    i, fetched = pending.popleft()
+                    fetched = fetched.result()
+                    next_i = next(indices, None)
+                    if next_i is not None:
+                        pending.append((next_i, pool.submit(fetch, next_i)))
+                    yield i, fetched
+            finally:
+                for _, fetched in pending:
+                    fetched.cancel()
+
+    @staticmethod
+    def discard_payloads(results) -> None:
+        """
+        Release the shared-memory blocks or spool files of (key, payload) pairs
+        that will not be written.
+        """
+        for _, payload in results:
+            try:
+                payload.discard()
+            except OSError:
+                pass
+
+    @staticmethod
+    def plan_chunks(n_samples: int, files_per_tar: int, num_processors: int) -> List[range]:
+        """
+        Split the sample indices 1..n_samples into contiguous chunks, one worker task each.
+
+        Args:
+            n_samples (int): Number of samples
+            files_per_tar (int): Samples per shard; no chunk is larger
+            num_processors (int): Number of worker processes
+
+        Returns:
+            List[range]: Sample indices of every chunk
+        """
+        chunk_size = max(1, min(files_per_tar, -(-n_samples // num_processors)))
+        return [
+            range(start, min(start + chunk_size, n_samples + 1))
+            for start in range(1, n_samples + 1, chunk_size)
+        ]
 
     def generate_data(self):
         """
         Generate synthetic audio samples and save them as WebDataset shards (tar files).
+
+        Samples are rendered in chunks (see plan_chunks). Balanced plans depend on
+        the uses of earlier chunks, so with `balance_usage` a run is reproducible
+        from its seed for the same `n_samples`, `files_per_tar` and `num_processors`.
+
+        Returns:
+            dict: Corpus coverage of the run (UsageTracker.report), also written
+                to `coverage.json`
         """
         os.makedirs(self.output_dir, exist_ok=True)
-        # Parallel generation of samples with progress bar
-        sample_results = process_map(
-            self._generate_sample,
-            range(1, self.n_samples + 1),
-            max_workers=self.num_processors,
-            desc="Generating samples",
+        index = self.dataloader.speaker_index
+        self.usage = UsageTracker.create(
+            os.path.join(self.output_dir, UsageTracker.FILE_NAME),
+            int(np.max(index.rows)) + 1 if len(index.rows) else 0,
+            max_reuse=self.max_reuse,
         )
-        # Sequentially write shards
-        shard_idx = 0
-        sample_count = 0
-        tar = None
-        for key, meta_bytes, seg, stems, final_bytes in sample_results:
-            if sample_count % self.files_per_tar == 0:
-                if tar is not None:
-                    tar.close()
-                shard_path = os.path.join(self.output_dir, f"shard_{shard_idx:05d}.tar")
-                tar = tarfile.open(shard_path, "w")
-                shard_idx += 1
-                sample_count = 0
-            # add metadata JSON
-            meta_buf = io.BytesIO(meta_bytes)
-            meta_info = tarfile.TarInfo(f"{key}.json")
-            meta_info.size = len(meta_bytes)
-            tar.addfile(meta_info, meta_buf)
-            # add seg
-            for stem_filename, stem_data in seg:
-                stem_buf = io.BytesIO(stem_data)
-                stem_info = tarfile.TarInfo(stem_filename)
-                stem_info.size = len(stem_data)
-                tar.addfile(stem_info, stem_buf)
-
-            # add stems
-            for idx, (key_stem, stem_data) in enumerate(stems.items()):
-                # stem_buf = io.BytesIO()
-                # stem_audioseg.export(stem_buf, format="mp3")
-                # stem_data = stem_buf.getvalue()
-                stem_info = tarfile.TarInfo(f"{key}.stem_{idx}.mp3")
-                stem_info.size = len(stem_data)
-                tar.addfile(stem_info, io.BytesIO(stem_data))
-            # add final mix
-            final_buf = io.BytesIO(final_bytes)
-            final_info = tarfile.TarInfo(f"{key}.mp3")
-            final_info.size = len(final_bytes)
-            tar.addfile(final_info, final_buf)
-            sample_count += 1
-        if tar is not None:
-            tar.close()
\ No newline at end of file
+        chunks = self.plan_chunks(self.n_samples, self.files_per_tar, self.num_processors)
+        # Workers inherit a running resource tracker instead of starting their
+        # own, so the shared-memory blocks they create are tracked by the parent
+        resource_tracker.ensure_running()
+        try:
+            # Parallel generation of samples, written to shards as they arrive
+            with ShardWriter(
+                self.output_dir,
+                self.files_per_tar,
+                post_shard_callback=self.post_shard_callback,
+            ) as writer, ProcessPoolExecutor(
+                max_workers=self.num_processors, initializer=_init_worker, initargs=(self,)
+            ) as executor:
+                # The generator reaches every worker once; chunks only carry their indices.
+                # Balanced chunks run in waves of one chunk per worker: a wave plans
+                # against the uses of the waves before it, recorded once it is done,
+                # so the plans do not depend on worker timing
+                pending = deque(chunks)
+                wave_size = self.num_processors if self.balance_usage else len(chunks)
+                futures, placed = deque(), []
+                unwritten = deque()
+                try:
+                    with tqdm(total=self.n_samples, desc="Generating samples") as progress:
+                        while futures or pending:
+                            if not futures:
+                                wave = [pending.popleft() for _ in range(min(wave_size, len(pending)))]
+                                futures.extend(
+                                    executor.submit(_generate_chunk, chunk, (slot, len(wave)) if self.balance_usage else None)
+                                    for slot, chunk in enumerate(wave)
+                                )
+                            results, rows = futures.popleft().result()
+                            unwritten.extend(results)
+                            if rows is not None:
+                                placed.append(rows)
+                            if not futures:
+                                for rows in placed:
+                                    self.usage.record(rows)
+                                placed = []
+                            while unwritten:
+                                key, payload = unwritten[0]
+                                writer.write(key, payload)
+                                # The writer owns the payload from here on
+                                unwritten.popleft()
+                                progress.update(1)
+                except BaseException:
+                    # Payloads that will not reach the writer are released here, so
+                    # a failed sample or an interrupt leaves nothing in /dev/shm
+                    self.discard_payloads(unwritten)
+                    for future in futures:
+                        future.cancel()
+                    for future in futures:
+                        if not future.cancelled() and future.exception() is None:
+                            self.discard_payloads(future.result()[0])
+                    raise
+        finally:
+            # After the writer has drained, or discarded, every spooled payload
+            if self.renderer is not None:
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+        return self.usage.write_report(index, self.output_dir)
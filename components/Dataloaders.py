@@ -2,51 +2,284 @@
 # Date: 23/05/2025
 # Description: Dataloaders
 
-import librosa as lr
+import os
+import threading
 import numpy as np
-from datasets import load_dataset
+from typing import Optional, Sequence, Tuple
+from components.ClipStats import ClipStatsIndex
+from components.DecodeCache import decode_cache
+from components.SpeakerIndex import SpeakerIndex
+from components.FolderSpeech import FolderSpeechDataset
+from components.TarSpeech import AUDIO_EXTENSIONS, TarSpeechDataset
 
 class Dataloader:
-    def __init__(self, sound_effects_path: str, background_music_path: str, speech_samples_path: str):
-        self._load_sound_effects(sound_effects_path)
-        self._load_background_music(background_music_path)
-        self._load_speech_samples(speech_samples_path)
+    CORPORA = ("speech", "music", "sfx")
 
-        # Convert to list and print the result
-        unique_speakers = set()
-        for item in self.speech_samples["train"]["json"]:
-            unique_speakers.add(item["speaker"])
-        self.unique_speakers_list = list(unique_speakers)
+    def __init__(
+        self,
+        sound_effects_path: str,
+        background_music_path: str,
+        speech_samples_path: str,
+        stats_dir: Optional[str] = None,
+        speech_format: str = "auto",
+        index_workers: int = 8,
+        tar_index_dir: Optional[str] = None,
+        speech_audio_root: Optional[str] = None,
+    ):
+        """
+        Datasets are opened on first use, so constructing a loader (and every
+        worker that receives an unused one) costs no dataset I/O.
 
-        self.length_music = len(self.background_music["train"])
-        self.length_sfx = len(self.sound_effects["train"])
-        self.length_speech = len(self.speech_samples["train"])
+        With `speech_format` "tar" (or "auto" and a directory containing .tar
+        files) the speech corpus is read straight from its WebDataset tars through
+        a TarSpeechDataset, whose member index is kept in `tar_index_dir`
+        (default: `stats_dir`, else next to the tars) and built with
+        `index_workers` processes if missing. With "folder" (or "auto" and a
+        .json file) `speech_samples_path` is a dictionary.json of per-utterance
+        files under `speech_audio_root`, read through a FolderSpeechDataset.
+        Otherwise it is loaded with `datasets.load_dataset`.
+
+        The speaker table is read from `stats_dir`, or built once per dataset
+        fingerprint into SpeakerIndex.cache_dir and memory-mapped from there.
+        """
+        if speech_format not in ("auto", "dataset", "tar", "folder"):
+            raise ValueError(f"Unknown speech format: {speech_format}")
+        self.paths = {"speech": speech_samples_path, "music": background_music_path, "sfx": sound_effects_path}
+        self.tar_index_dir = tar_index_dir or stats_dir
+        self.speech_format = speech_format
+        self.index_workers = index_workers
+        self.speech_audio_root = speech_audio_root
+        self._datasets = {}
+        # Optional precomputed clip statistics (see ClipStatsIndex)
+        self.stats = ClipStatsIndex(stats_dir) if stats_dir is not None else None
+        # Persisted speaker table from the same directory, from the fingerprint cache otherwise
+        self._speaker_index = SpeakerIndex.open(stats_dir) if stats_dir is not None else None
+        # Guards the lazy loads against concurrent decode threads
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @property
+    def sound_effects(self):
+        return self._load("sfx")
+
+    @property
+    def background_music(self):
+        return self._load("music")
+
+    @property
+    def speech_samples(self):
+        return self._load("speech")
+
+    @property
+    def speaker_index(self) -> SpeakerIndex:
+        if self._speaker_index is None:
+            with self._lock:
+                if self._speaker_index is None:
+                    dataset = self.speech_samples["train"]
+                    fingerprint = getattr(dataset, "_fingerprint", None)
+                    self._speaker_index = (
+                        SpeakerIndex.build(dataset, SpeakerIndex.cache_dir(fingerprint))
+                        if fingerprint is not None else SpeakerIndex.from_dataset(dataset)
+                    )
+        return self._speaker_index
+
+    @property
+    def unique_speakers_list(self):
+        return self.speaker_index.table["speaker"].tolist()
+
+    @property
+    def length_music(self) -> int:
+        return len(self.background_music["train"])
+
+    @property
+    def length_sfx(self) -> int:
+        return len(self.sound_effects["train"])
+
+    @property
+    def length_speech(self) -> int:
+        return len(self.speech_samples["train"])
+
+    @staticmethod
+    def speech_audio_column(row: dict) -> str:
+        """
+        Audio column of a speech row: "mp3" in the Hugging Face datasets, the
+        member extension in tars, e.g. "flac".
+        """
+        for column in AUDIO_EXTENSIONS:
+            if column in row:
+                return column
+        raise KeyError(f"Speech row {row.get('__key__')} has no audio column")
+
+    @classmethod
+    def speech_audio(cls, row: dict) -> dict:
+        """
+        Audio of a speech row, whatever its column: `path`, `array` and `sampling_rate`.
+        """
+        return row[cls.speech_audio_column(row)]
+
+    def _decode_speech(self, index: int, start: int = 0, stop: Optional[int] = None) -> dict:
+        dataset = self.speech_samples["train"]
+        row = dataset.row(index, start, stop) if (start, stop) != (0, None) else dataset[index]
+        column = self.speech_audio_column(row)
+        row[column] = dict(row[column], array=np.asarray(row[column]["array"], dtype=np.float32))
+        return row
+
+    def get_speech(self, index: int, start: int = 0, stop: Optional[int] = None):
+        """
+        Row of an utterance at its native sample rate, through the decode cache
+        of the process; the audio array is read-only.
+
+        With `start` and `stop` the audio holds only frames [start, stop). Backends
+        that read frame ranges (FolderSpeechDataset.row) decode only those frames;
+        the others slice the decoded utterance.
+        """
+        index = int(index)
+        dataset = self.speech_samples["train"]
+        if (start, stop) != (0, None) and hasattr(dataset, "row"):
+            row = decode_cache().get_or_decode(
+                ("speech", index, None, start, stop), lambda: self._decode_speech(index, start, stop)
+            )
+        else:
+            row = decode_cache().get_or_decode(("speech", index, None), lambda: self._decode_speech(index))
+            if (start, stop) != (0, None):
+                column = self.speech_audio_column(row)
+                row = dict(row, **{column: dict(row[column], array=row[column]["array"][start:stop])})
+        return dict(row, __index__=index)
+
+    def speech_frames(self, index: int) -> Optional[Tuple[int, int]]:
+        """
+        Length in frames and sample rate of an utterance without decoding it, or
+        None if the speech backend cannot tell.
+        """
+        frames = getattr(self.speech_samples["train"], "frames", None)
+        return frames(int(index)) if frames is not None else None
 
     def get_segementsForSpeaker(self, speaker: str):
-        filtered_items = [(idx, item) for idx, item in enumerate(self.speech_samples["train"]["json"]) if item["speaker"] == speaker]
-        filtered_items = [self.speech_samples["train"][item[0]] for item in filtered_items]
-        return filtered_items
+        return [self.get_speech(row) for row in self.speaker_index.speaker_rows(speaker)]
+
+    def get_random_speakers(
+        self,
+        num_speakers: int,
+        languages: Optional[Sequence[str]] = None,
+        min_utterances: int = 0,
+        min_duration: float = 0.0,
+        weight: Optional[str] = None,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        """
+        Draw distinct speakers from the speaker table.
+
+        Args:
+            num_speakers (int): Number of speakers
+            languages (Sequence[str], optional): Allowed languages
+            min_utterances (int): Smallest number of utterances per speaker
+            min_duration (float): Smallest total speech per speaker in seconds
+            weight (str, optional): "utterances" or "duration" to prefer speakers with more speech
+            rng (np.random.Generator, optional): Random generator; the global one if not given
+
+        Returns:
+            List[dict]: Speakers with `language`, `key`, `counter`, `utterances` and `duration`
+        """
+        index = self.speaker_index
+        selected = index.sample(num_speakers, languages, min_utterances, min_duration, weight, rng=rng)
+        return [
+            {
+                'language': str(index.table["language"][pos]),
+                'key': str(index.table["speaker"][pos]),
+                'counter': 0,
+                'utterances': int(index.table["utterances"][pos]),
+                'duration': float(index.table["duration"][pos]),
+            }
+            for pos in selected
+        ]
+
+    def get_random_music_index(self, min_duration: Optional[float] = None,
+                               rng: Optional[np.random.Generator] = None) -> int:
+        rng = np.random if rng is None else rng
+        # Prefer tracks that need no looping if their durations are indexed
+        if min_duration is not None and self.stats is not None and "music" in self.stats:
+            candidates = np.flatnonzero(self.stats.table("music")["duration"] >= min_duration)
+            if len(candidates) > 0:
+                return int(rng.choice(candidates))
+        return int(rng.choice(self.length_music))
 
-    def get_random_speakers(self, num_speakers: int):
-        selected_speakers = np.random.choice(self.unique_speakers_list, size=min(num_speakers, len(self.unique_speakers_list)), replace=False)
-        return [{'language': speaker.split('_')[0], 'key': speaker, 'counter': 0} for speaker in selected_speakers]
+    def get_music(self, index: int):
+        return self.background_music["train"][index]
 
     def get_random_music(self):
-        random_index = np.random.randint(0, self.length_music)
-        return self.background_music["train"][random_index]
-    
+        return self.get_music(self.get_random_music_index())
+
+    def get_random_sound_effect_index(self, rng: Optional[np.random.Generator] = None) -> int:
+        rng = np.random if rng is None else rng
+        return int(rng.choice(self.length_sfx))
+
+    def get_sound_effect(self, index: int):
+        row = self.sound_effects["train"][index]
+        return row[list(row.keys())[0]]["array"]
+
     def get_random_sound_effect(self):
-        random_index = np.random.randint(0, self.length_sfx)
-        return self.sound_effects["train"][random_index][list(self.sound_effects["train"][random_index].keys())[0]]["array"]
+        return self.get_sound_effect(self.get_random_sound_effect_index())
     
-    def _load_sound_effects(self, dataset_path: str):
-        self.sound_effects = load_dataset(dataset_path)
+    def get_dataset(self, corpus: str):
+        return self._load(corpus)["train"]
+
+    def get_audio(self, corpus: str, index: int):
+        """
+        Decode one row of a corpus.
+
+        Returns:
+            Tuple[np.ndarray, int]: Audio array and its sample rate
+        """
+        row = self.get_dataset(corpus)[index]
+        audio = self.speech_audio(row) if corpus == "speech" else row[list(row.keys())[0]]
+        return audio["array"], audio["sampling_rate"]
+
+    def fingerprint(self, corpus: str) -> str:
+        return self.get_dataset(corpus)._fingerprint
 
-    def _load_background_music(self, dataset_path: str):
-        self.background_music = load_dataset(dataset_path)
+    @property
+    def resolved_speech_format(self) -> str:
+        """
+        Speech backend in use: "dataset", "tar" or "folder".
+        """
+        if self.speech_format != "auto":
+            return self.speech_format
+        path = self.paths["speech"]
+        if path is not None and path.endswith(".json") and os.path.isfile(path):
+            return "folder"
+        return "tar" if TarSpeechDataset.is_tar_source(path) else "dataset"
 
-    def _load_speech_samples(self, dataset_path: str):
-        self.speech_samples = load_dataset(dataset_path)
+    def _load(self, corpus: str):
+        if corpus in self._datasets:
+            return self._datasets[corpus]
+        with self._lock:
+            if corpus in self._datasets:
+                return self._datasets[corpus]
+            if corpus == "speech" and self.resolved_speech_format == "folder":
+                cache_dir = os.path.join(self.tar_index_dir, "decode_cache") if self.tar_index_dir else None
+                dataset = {"train": FolderSpeechDataset(
+                    self.paths[corpus], self.speech_audio_root, cache_dir=cache_dir
+                )}
+            elif corpus == "speech" and self.resolved_speech_format == "tar":
+                dataset = {"train": TarSpeechDataset.build(
+                    self.paths[corpus], self.tar_index_dir, num_workers=self.index_workers
+                )}
+            else:
+                from datasets import load_dataset
+                dataset = load_dataset(self.paths[corpus])
+            if corpus == "speech" and self._speaker_index is not None:
+                if self._speaker_index.fingerprint != dataset["train"]._fingerprint:
+                    raise ValueError("The speaker index does not match the speech dataset; rebuild it with `dap index`")
+            self._datasets[corpus] = dataset
+        return self._datasets[corpus]
 
 class ConversationDataloader:
     def __init__(self, path:str):
@@ -0,0 +1,163 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Memory budget of the process cache unless configured
+DEFAULT_MAX_BYTES = 512 << 20
+
+
+def _freeze(value: Any) -> int:
+    """
+    Make every array in a cached value read-only and return their total size in bytes.
+    """
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_freeze(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_freeze(item) for item in value)
+    return 0
+
+
+class DecodeCache:
+    """
+    Byte-bounded LRU cache of decoded audio, keyed by (corpus, row, target_sr).
+
+    Cached arrays are read-only; lookups are thread-safe.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            max_bytes (int): Memory budget for cached arrays; 0 disables caching
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self.hits = {}
+        self.misses = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_decode(self, key: Hashable, decode: Callable[[], Any]) -> Any:
+        """
+        Return the cached value of a key, decoding and caching it on a miss.
+
+        Args:
+            key (Hashable): (corpus, row, target_sr), plus the frame range of partial reads
+            decode (Callable[[], Any]): Produces the value on a miss
+
+        Returns:
+            Any: The cached value, with read-only arrays
+        """
+        corpus = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits[corpus] = self.hits.get(corpus, 0) + 1
+                return entry[0]
+            self.misses[corpus] = self.misses.get(corpus, 0) + 1
+        value = decode()
+        size = _freeze(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.bytes -= evicted
+                    self.evictions += 1
+        return value
+
+    def resize(self, max_bytes: int) -> None:
+        """
+        Change the memory budget, evicting entries if it shrinks.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def metrics(self) -> dict:
+        """
+        Hit rates per corpus and the memory in use.
+
+        Returns:
+            dict: `bytes`, `max_bytes`, `entries`, `evictions` and per corpus
+                `hits`, `misses` and `hit_rate`
+        """
+        with self._lock:
+            corpora = {}
+            for corpus in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits.get(corpus, 0), self.misses.get(corpus, 0)
+                corpora[corpus] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+            return {
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "corpora": corpora,
+            }
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache of small per-clip values, such as measured loudness
+    or trim offsets, bounded by its number of entries.
+    """
+    def __init__(self, max_entries: int):
+        """
+        Args:
+            max_entries (int): Entries kept before the least recently used is evicted
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# One cache per process: worker processes fill their own, like the loudness and trim caches
+_DECODE_CACHE = DecodeCache()
+
+
+def decode_cache(max_bytes: Optional[int] = None) -> DecodeCache:
+    """
+    The decode cache of this process, resized to `max_bytes` if given.
+    """
+    if max_bytes is not None and max_bytes != _DECODE_CACHE.max_bytes:
+        _DECODE_CACHE.resize(max_bytes)
+    return _DECODE_CACHE
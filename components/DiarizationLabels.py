@@ -0,0 +1,108 @@
+import numpy as np
+from typing import List
+
+
+class DiarizationLabels:
+    """
+    Frame-level speaker activity labels and RTTM computed from rendered segments.
+
+    Activity matrices are stored bit-packed along the frame axis (`np.packbits`
+    with big bit order, one padded byte row per speaker) and restored with `unpack`.
+    """
+    def __init__(self, sample_rate: int = 48000, hop: float = 0.01):
+        """
+        Initialize the label builder.
+
+        Args:
+            sample_rate (int): Sample rate the segment offsets refer to
+            hop (float): Frame hop in seconds
+        """
+        self.sample_rate = sample_rate
+        self.hop = hop
+        self.hop_samples = max(1, int(round(hop * sample_rate)))
+
+    def num_frames(self, num_samples: int) -> int:
+        """
+        Number of label frames covering `num_samples` samples.
+        """
+        return -(-num_samples // self.hop_samples)
+
+    def activity(self, segments: List[dict], speaker_ids: List[str], num_samples: int) -> np.ndarray:
+        """
+        Build the speaker activity matrix from the final sample offsets of the segments.
+
+        A frame is active for a speaker if any of the speaker's samples fall into it.
+
+        Args:
+            segments (List[dict]): Segments with `id`, `start_sample` and `end_sample`
+            speaker_ids (List[str]): Speaker ids, one row each
+            num_samples (int): Length of the rendered sample
+
+        Returns:
+            np.ndarray: (num_speakers, num_frames) uint8 matrix of 0/1 activity
+        """
+        num_frames = self.num_frames(num_samples)
+        rows = {speaker_id: row for row, speaker_id in enumerate(speaker_ids)}
+        if not segments:
+            return np.zeros((len(speaker_ids), num_frames), dtype=np.uint8)
+        speaker = np.array([rows[segment["id"]] for segment in segments], dtype=np.intp)
+        start = np.array([segment["start_sample"] for segment in segments], dtype=np.int64)
+        end = np.array([segment["end_sample"] for segment in segments], dtype=np.int64)
+        start_frame = np.minimum(start // self.hop_samples, num_frames)
+        end_frame = np.minimum(-(-end // self.hop_samples), num_frames)
+        end_frame = np.maximum(end_frame, start_frame)
+        # +1 at the first active frame, -1 after the last, then integrate
+        delta = np.zeros((len(speaker_ids), num_frames + 1), dtype=np.int32)
+        np.add.at(delta, (speaker, start_frame), 1)
+        np.add.at(delta, (speaker, end_frame), -1)
+        return (np.cumsum(delta[:, :num_frames], axis=1) > 0).astype(np.uint8)
+
+    def pack(self, activity: np.ndarray) -> bytes:
+        """
+        Pack an activity matrix into bits along the frame axis.
+
+        Args:
+            activity (np.ndarray): (num_speakers, num_frames) 0/1 matrix
+
+        Returns:
+            bytes: num_speakers rows of ceil(num_frames / 8) bytes
+        """
+        return np.packbits(activity.astype(bool), axis=1).tobytes()
+
+    @staticmethod
+    def unpack(data: bytes, num_speakers: int, num_frames: int) -> np.ndarray:
+        """
+        Restore an activity matrix written by `pack`.
+
+        Args:
+            data (bytes): Packed bits
+            num_speakers (int): Number of rows
+            num_frames (int): Number of frames
+
+        Returns:
+            np.ndarray: (num_speakers, num_frames) uint8 matrix of 0/1 activity
+        """
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(num_speakers, -1)
+        return np.unpackbits(packed, axis=1, count=num_frames)
+
+    def rttm(self, segments: List[dict], file_id: str) -> str:
+        """
+        Format the segments as RTTM speaker turns.
+
+        Args:
+            segments (List[dict]): Segments with `id`, `start_sample` and `end_sample`
+            file_id (str): Recording id written in the second column
+
+        Returns:
+            str: One SPEAKER line per non-empty segment, ordered by onset
+        """
+        lines = []
+        for segment in sorted(segments, key=lambda seg: seg["start_sample"]):
+            num_samples = segment["end_sample"] - segment["start_sample"]
+            if num_samples <= 0:
+                continue
+            lines.append(
+                f"SPEAKER {file_id} 1 {segment['start_sample'] / self.sample_rate:.3f} "
+                f"{num_samples / self.sample_rate:.3f} <NA> <NA> {segment['id']} <NA> <NA>"
+            )
+        return "".join(line + "\n" for line in lines)
@@ -0,0 +1,213 @@
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+import soundfile as sf
+from typing import List, Optional, Tuple
+
+# WAVE format tags
+_WAVE_PCM = 0x0001
+_WAVE_FLOAT = 0x0003
+_WAVE_EXTENSIBLE = 0xFFFE
+
+# Sample layouts that can be memory-mapped, by (format tag, bits per sample)
+_WAVE_DTYPES = {
+    (_WAVE_PCM, 16): np.dtype("<i2"),
+    (_WAVE_PCM, 32): np.dtype("<i4"),
+    (_WAVE_FLOAT, 32): np.dtype("<f4"),
+}
+
+
+def wav_layout(path: str) -> Optional[Tuple[int, int, int, np.dtype, int]]:
+    """
+    Locate the sample data of a WAV file from its RIFF chunks.
+
+    Args:
+        path (str): Audio file
+
+    Returns:
+        Optional[Tuple[int, int, int, np.dtype, int]]: (data offset, frames, channels,
+            sample dtype, sample rate), or None if the file is not a WAV file whose
+            samples can be memory-mapped (e.g. 24-bit PCM or compressed audio)
+    """
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                body = f.read(size)
+                tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                if tag == _WAVE_EXTENSIBLE and len(body) >= 26:
+                    tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (tag, channels, rate, bits)
+            elif chunk_id == b"data":
+                if fmt is None or (fmt[0], fmt[3]) not in _WAVE_DTYPES:
+                    return None
+                tag, channels, rate, bits = fmt
+                dtype = _WAVE_DTYPES[(tag, bits)]
+                frames = size // (dtype.itemsize * channels)
+                return f.tell(), frames, channels, dtype, rate
+            else:
+                f.seek(size, os.SEEK_CUR)
+            # Chunks are word aligned
+            if size % 2:
+                f.seek(1, os.SEEK_CUR)
+
+
+class FolderSpeechDataset:
+    """
+    Speech corpus of per-utterance audio files described by a `dictionary.json`
+    (see scripts/updateDict.py).
+
+    PCM WAV files are memory-mapped and read by frame range; other formats are
+    decoded once into `cache_dir` as float32 `.npy` files.
+    """
+    def __init__(self, dictionary_path: str, audio_root: Optional[str] = None, cache_dir: Optional[str] = None):
+        """
+        Args:
+            dictionary_path (str): dictionary.json written by updateDict.py
+            audio_root (str, optional): Directory of the audio files; the directory of
+                the dictionary if not given
+            cache_dir (str, optional): Decode cache for compressed files;
+                `.decode_cache` next to the dictionary if not given
+        """
+        with open(dictionary_path, "rb") as f:
+            raw = f.read()
+        self.audio_root = audio_root or os.path.dirname(os.path.abspath(dictionary_path))
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(dictionary_path)), ".decode_cache")
+        self._fingerprint = hashlib.sha1(raw + os.path.abspath(self.audio_root).encode("utf-8")).hexdigest()
+        self.rows = []
+        for language, speakers in json.loads(raw).items():
+            for speaker, utterances in speakers.items():
+                for utterance in utterances:
+                    self.rows.append((language, f"{language}_{speaker}", utterance))
+        self._rates = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def path(self, index: int) -> str:
+        language, _, utterance = self.rows[index]
+        path = os.path.join(self.audio_root, language, utterance["file_name"])
+        return path if os.path.exists(path) else os.path.join(self.audio_root, utterance["file_name"])
+
+    def _cache_path(self, path: str) -> str:
+        stat = os.stat(path)
+        digest = hashlib.sha1(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.npy")
+
+    def _decode_cached(self, path: str) -> np.ndarray:
+        cache_path = self._cache_path(path)
+        if not os.path.exists(cache_path):
+            try:
+                audio, _ = sf.read(path, dtype="float32", always_2d=True)
+                audio = audio.mean(axis=1, dtype=np.float32) if audio.shape[1] > 1 else audio[:, 0]
+            except RuntimeError:
+                import librosa
+                audio, _ = librosa.load(path, sr=None, mono=True)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(audio, dtype=np.float32))
+            os.replace(tmp, cache_path)
+        return np.load(cache_path, mmap_mode="r")
+
+    def read(self, index: int, start: int = 0, stop: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """
+        Read frames [start, stop) of an utterance as mono float32.
+
+        Args:
+            index (int): Row
+            start (int): First frame
+            stop (int, optional): End frame; the end of the file if not given
+
+        Returns:
+            Tuple[np.ndarray, int]: Audio and its sample rate. Read-only views of a
+                memory map for float WAV files and cached decodes.
+        """
+        path = self.path(index)
+        layout = wav_layout(path)
+        if layout is not None:
+            offset, frames, channels, dtype, rate = layout
+            if frames == 0:
+                return np.zeros(0, dtype=np.float32), rate
+            samples = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(frames, channels))[start:stop]
+            if channels > 1:
+                samples = samples.mean(axis=1, dtype=np.float32)
+            else:
+                samples = samples[:, 0]
+            if dtype.kind == "i":
+                samples = samples.astype(np.float32) / np.float32(2 ** (8 * dtype.itemsize - 1))
+            return samples, rate
+        if index not in self._rates:
+            self._rates[index] = sf.info(path).samplerate
+        return self._decode_cached(path)[start:stop], self._rates[index]
+
+    def frames(self, index: int) -> Tuple[int, int]:
+        """
+        Length in frames and sample rate of an utterance, from the WAV header or the
+        cached decode.
+        """
+        path = self.path(index)
+        layout = wav_layout(path)
+        if layout is not None:
+            return layout[1], layout[4]
+        if index not in self._rates:
+            self._rates[index] = sf.info(path).samplerate
+        return len(self._decode_cached(path)), self._rates[index]
+
+    def _meta(self, index: int) -> dict:
+        language, speaker, utterance = self.rows[index]
+        return {
+            "speaker": speaker,
+            "language": language,
+            "duration": utterance["duration"],
+            "text": utterance.get("text", ""),
+            "segment": utterance["segment"],
+        }
+
+    def row(self, index: int, start: int = 0, stop: Optional[int] = None) -> dict:
+        """
+        Row of an utterance with frames [start, stop) of its audio.
+        """
+        audio, rate = self.read(index, start, stop)
+        file_name = self.rows[index][2]["file_name"]
+        return {
+            "__key__": os.path.splitext(file_name)[0],
+            "json": self._meta(index),
+            "mp3": {"path": file_name, "array": audio, "sampling_rate": rate},
+        }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rows = [self.row(i) for i in range(*index.indices(len(self)))]
+            return {column: [row[column] for row in rows] for column in ("__key__", "json", "mp3")}
+        if index < 0:
+            index += len(self)
+        return self.row(int(index))
+
+    def select_columns(self, columns: List[str]) -> "_FolderMetadataView":
+        if list(columns) != ["json"]:
+            raise ValueError("FolderSpeechDataset only selects the json column")
+        return _FolderMetadataView(self)
+
+
+class _FolderMetadataView:
+    """
+    `json` column of a FolderSpeechDataset, served from the dictionary.
+    """
+    def __init__(self, dataset: FolderSpeechDataset):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: slice) -> dict:
+        return {"json": [self.dataset._meta(i) for i in range(*index.indices(len(self.dataset)))]}
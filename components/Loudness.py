@@ -0,0 +1,278 @@
+import numpy as np
+from typing import Hashable, List, Optional, Sequence
+
+from components.AudioTools import AudioTools
+from components.DecodeCache import LRUCache
+
+# Integrated loudness of pre-indexed clips, shared by everything in this process.
+# Keyed by (corpus, row, sample_rate) so a clip drawn again is not measured again;
+# the least recently used of at most 64k clips are forgotten.
+_LOUDNESS_CACHE = LRUCache(1 << 16)
+
+
+class LoudnessNormalizer:
+    """
+    Batched BS.1770 loudness measurement and target-LUFS gain staging.
+
+    Matches `pyloudnorm.Meter.integrated_loudness`, and a clip measures the same
+    alone or in any batch.
+    """
+    BLOCK_SIZE = 0.4
+    BLOCK_OVERLAP = 0.75
+    ABSOLUTE_GATE = -70.0
+    RELATIVE_GATE = -10.0
+    MAX_BATCH_SAMPLES = 1 << 22
+
+    def __init__(self, sample_rate: int = 48000, max_gain_db: float = 30.0, stats=None):
+        """
+        Initialize the normalizer.
+
+        Args:
+            sample_rate (int): Default sample rate of the clips
+            max_gain_db (float): Largest boost or cut applied to a clip in dB
+            stats (ClipStatsIndex, optional): Precomputed clip statistics. Clips keyed
+                (corpus, row) of an indexed corpus take their loudness from it
+                instead of being measured.
+        """
+        self.sample_rate = sample_rate
+        self.max_gain_db = max_gain_db
+        self.stats = stats
+
+    def integrated_loudness(self, clips: Sequence[np.ndarray], sample_rate: Optional[int] = None) -> np.ndarray:
+        """
+        Measure the integrated loudness of a batch of mono clips.
+
+        Args:
+            clips (Sequence[np.ndarray]): Mono clips, any lengths
+            sample_rate (int, optional): Sample rate of the clips
+
+        Returns:
+            np.ndarray: Loudness of every clip in LUFS, -inf for silent clips
+        """
+        sample_rate = sample_rate or self.sample_rate
+        if len(clips) == 0:
+            return np.zeros(0)
+        # Split the clips into runs whose padded matrix stays within the budget
+        loudness, start, longest = np.empty(len(clips)), 0, 0
+        for stop, clip in enumerate(clips):
+            longest = max(longest, len(clip))
+            if stop > start and (stop - start + 1) * longest > self.MAX_BATCH_SAMPLES:
+                loudness[start:stop] = self._measure(clips[start:stop], sample_rate)
+                start, longest = stop, len(clip)
+        loudness[start:] = self._measure(clips[start:], sample_rate)
+        return loudness
+
+    def _measure(self, clips: Sequence[np.ndarray], sample_rate: int) -> np.ndarray:
+        lengths = np.array([len(clip) for clip in clips])
+        batch = np.zeros((len(clips), max(1, lengths.max())))
+        for row, clip in enumerate(clips):
+            batch[row, :len(clip)] = clip
+        from scipy import signal
+        filtered = signal.sosfilt(AudioTools.k_weighting_sos(sample_rate), batch, axis=1)
+        energy = np.zeros((len(clips), batch.shape[1] + 1))
+        np.cumsum(np.square(filtered), axis=1, out=energy[:, 1:])
+
+        # Gating blocks, identical for all clips up to each clip's block count
+        block = self.BLOCK_SIZE * sample_rate
+        step = 1.0 - self.BLOCK_OVERLAP
+        num_blocks = np.round((lengths / sample_rate - self.BLOCK_SIZE) / (self.BLOCK_SIZE * step)).astype(int) + 1
+        num_blocks = np.maximum(num_blocks, 1)
+        j = np.arange(num_blocks.max())
+        lower = (self.BLOCK_SIZE * j * step * sample_rate).astype(int)
+        upper = (self.BLOCK_SIZE * (j * step + 1) * sample_rate).astype(int)
+        # Blocks end at the clip, not in the filter tail ringing into its padding
+        lower = np.minimum(lower[None, :], lengths[:, None])
+        upper = np.minimum(upper[None, :], lengths[:, None])
+        z = (np.take_along_axis(energy, upper, axis=1) - np.take_along_axis(energy, lower, axis=1)) / block
+        # Clips shorter than one block are a single block over their own length
+        short = lengths < block
+        z[short, 0] = energy[short, lengths[short]] / np.maximum(lengths[short], 1)
+        valid = j[None, :] < num_blocks[:, None]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            block_loudness = -0.691 + 10.0 * np.log10(z)
+            gated = valid & (block_loudness >= self.ABSOLUTE_GATE)
+            relative = -0.691 + 10.0 * np.log10(self._masked_mean(z, gated)) + self.RELATIVE_GATE
+            gated &= block_loudness > relative[:, None]
+            return -0.691 + 10.0 * np.log10(self._masked_mean(z, gated))
+
+    def cached_loudness(
+        self,
+        keys: Sequence[Optional[Hashable]],
+        clips: Sequence[np.ndarray],
+        sample_rate: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Measure a batch of clips, reusing the loudness of clips measured before.
+
+        Args:
+            keys (Sequence[Optional[Hashable]]): Cache key per clip, e.g. (corpus, row);
+                None for clips that must not be cached
+            clips (Sequence[np.ndarray]): Mono clips
+            sample_rate (int, optional): Sample rate of the clips
+
+        Returns:
+            np.ndarray: Loudness of every clip in LUFS
+        """
+        sample_rate = sample_rate or self.sample_rate
+        loudness = np.empty(len(clips))
+        missing = []
+        for idx, key in enumerate(keys):
+            cached = None if key is None else _LOUDNESS_CACHE.get((key, sample_rate))
+            if cached is None and key is not None and self.stats is not None and key[0] in self.stats:
+                # None for a range the index did not measure
+                cached = self.stats.lufs(*key)
+            if cached is None:
+                missing.append(idx)
+            else:
+                loudness[idx] = cached
+        if missing:
+            measured = self.integrated_loudness([clips[idx] for idx in missing], sample_rate)
+            for idx, value in zip(missing, measured):
+                loudness[idx] = value
+                if keys[idx] is not None:
+                    _LOUDNESS_CACHE.put((keys[idx], sample_rate), float(value))
+        return loudness
+
+    def gains(self, loudness: np.ndarray, target: np.ndarray) -> np.ndarray:
+        """
+        Linear gains that bring clips from their loudness to a target loudness.
+
+        Args:
+            loudness (np.ndarray): Measured loudness in LUFS
+            target (np.ndarray): Target loudness in LUFS
+
+        Returns:
+            np.ndarray: Linear gains; 1.0 for silent clips
+        """
+        gain_db = np.clip(np.asarray(target) - loudness, -self.max_gain_db, self.max_gain_db)
+        gain_db = np.where(np.isfinite(loudness), gain_db, 0.0)
+        return np.power(10.0, gain_db / 20.0)
+
+    def segment_loudness(self, segments: List[dict], corpus: str = "speech") -> np.ndarray:
+        """
+        Loudness of the current audio of every segment.
+
+        Segments with a dataset `row` use the cached loudness of that row, or of
+        its `trim` range if it was trimmed, plus the `gain_db` already applied to
+        them; other segments are measured.
+
+        Args:
+            segments (List[dict]): Segments with `audio` and `sampling_rate`
+            corpus (str): Corpus name used in the cache keys
+
+        Returns:
+            np.ndarray: Loudness of every segment in LUFS
+        """
+        loudness = np.empty(len(segments))
+        for sample_rate in {segment["sampling_rate"] for segment in segments}:
+            group = [idx for idx, segment in enumerate(segments) if segment["sampling_rate"] == sample_rate]
+            keys = [self._segment_key(segments[idx], corpus) for idx in group]
+            measured = self.cached_loudness(keys, [segments[idx]["audio"] for idx in group], sample_rate)
+            for idx, key, value in zip(group, keys, measured):
+                loudness[idx] = value + (segments[idx].get("gain_db", 0.0) if key is not None else 0.0)
+        return loudness
+
+    @staticmethod
+    def _segment_key(segment: dict, corpus: str) -> Optional[tuple]:
+        # A trimmed segment is not as loud as its whole row
+        if segment.get("row") is None:
+            return None
+        if "trim" in segment:
+            return (corpus, segment["row"], *segment["trim"])
+        return (corpus, segment["row"])
+
+    def segment_gains(self, segments: List[dict], speaker_targets: dict, corpus: str = "speech") -> np.ndarray:
+        """
+        Linear gains that bring every speech segment to the target loudness of its speaker.
+
+        Args:
+            segments (List[dict]): Segments with `audio`, `sampling_rate`, `id` and `row`;
+                the audio of rows measured before is not read
+            speaker_targets (dict): Target loudness in LUFS per speaker id
+            corpus (str): Corpus name used in the cache keys
+
+        Returns:
+            np.ndarray: Gain of every segment
+        """
+        loudness = self.segment_loudness(segments, corpus)
+        return self.gains(loudness, np.array([speaker_targets[segment["id"]] for segment in segments]))
+
+    def apply_gains(self, segments: List[dict], gains: np.ndarray, scale_audio: bool = True) -> List[dict]:
+        """
+        Scale segments by linear gains and add them to their `gain_db`.
+
+        Args:
+            segments (List[dict]): Segments with `audio`
+            gains (np.ndarray): Gain of every segment
+            scale_audio (bool): Replace the audio by a scaled copy; disable for
+                segments whose audio is scaled when it is rendered
+
+        Returns:
+            List[dict]: The segments
+        """
+        for segment, gain in zip(segments, gains):
+            if scale_audio:
+                segment["audio"] = segment["audio"] * np.float32(gain)
+            segment["gain_db"] = round(segment.get("gain_db", 0.0) + float(20.0 * np.log10(gain)), 3)
+        return segments
+
+    def normalize_segments(self, segments: List[dict], speaker_targets: dict, corpus: str = "speech") -> List[dict]:
+        """
+        Bring every speech segment to the target loudness of its speaker.
+
+        The segment audio is replaced by a scaled copy and the total applied gain
+        is stored in the segment as `gain_db`.
+
+        Args:
+            segments (List[dict]): Segments with `audio`, `sampling_rate`, `id` and `row`
+            speaker_targets (dict): Target loudness in LUFS per speaker id
+            corpus (str): Corpus name used in the cache keys
+
+        Returns:
+            List[dict]: The segments
+        """
+        return self.apply_gains(segments, self.segment_gains(segments, speaker_targets, corpus))
+
+    def level(self, loudness: np.ndarray, weights: Optional[np.ndarray] = None) -> float:
+        """
+        Combined loudness of several clips, averaged in the power domain.
+
+        Args:
+            loudness (np.ndarray): Loudness of each clip in LUFS
+            weights (np.ndarray, optional): Weight of each clip, e.g. its duration
+
+        Returns:
+            float: Combined loudness in LUFS, -inf if all clips are silent
+        """
+        loudness = np.asarray(loudness, dtype=np.float64)
+        weights = np.ones_like(loudness) if weights is None else np.asarray(weights, dtype=np.float64)
+        audible = np.isfinite(loudness)
+        if not audible.any() or weights[audible].sum() <= 0:
+            return -np.inf
+        power = np.power(10.0, loudness[audible] / 10.0)
+        return float(10.0 * np.log10(np.average(power, weights=weights[audible])))
+
+    def normalize(self, audio: np.ndarray, target: float, key: Optional[Hashable] = None,
+                  sample_rate: Optional[int] = None) -> np.ndarray:
+        """
+        Bring one clip to a target loudness.
+
+        Args:
+            audio (np.ndarray): Mono clip
+            target (float): Target loudness in LUFS
+            key (Hashable, optional): Cache key of the clip
+            sample_rate (int, optional): Sample rate of the clip
+
+        Returns:
+            np.ndarray: Scaled copy of the clip
+        """
+        loudness = self.cached_loudness([key], [audio], sample_rate)
+        return audio * np.float32(self.gains(loudness, np.array([target]))[0])
+
+    @staticmethod
+    def _masked_mean(z: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        count = mask.sum(axis=1)
+        # A running sum is not regrouped by the padding of shorter clips, unlike sum()
+        total = np.cumsum(np.where(mask, z, 0.0), axis=1)[:, -1]
+        return np.where(count > 0, total / np.maximum(count, 1), 0.0)
@@ -4,8 +4,13 @@ import random
 from typing import Tuple, List, Optional, Dict
 import os
 from components.Dataloaders import Dataloader
+from components.DecodeCache import decode_cache
+from components.AudioTools import AUDIO_DTYPE, AudioTools
 
 class MusicHandler:
+    # Samples of music mixed per step by mix_music_with_audio
+    MIX_BLOCK = 1 << 16
+
     def __init__(self, dataloader: Dataloader, sample_rate: int = 48000, crossfade_duration: float = 2.0):
         """
         Initialize MusicHandler with configuration parameters.
@@ -16,34 +21,42 @@ class MusicHandler:
         """
         self.sample_rate = sample_rate
         self.crossfade_duration = crossfade_duration
-        self.music_cache = {}  # Cache for loaded music files
         self.dataloader = dataloader
 
-    def load_music(self) -> Tuple[np.ndarray, int]:
+    def load_music(self, index: Optional[int] = None) -> Tuple[np.ndarray, int]:
         """
         Load and preprocess a music file.
+
+        Resampled tracks are kept in the decode cache of the process; the
+        returned array is read-only.
         
         Args:
-            music_path (str): Path to the music file
+            index (int, optional): Row of the music dataset, random if not given
             
         Returns:
             Tuple[np.ndarray, int]: Processed music and its sample rate
         """
-        # Get random music file from dataloade
-        music = self.dataloader.get_random_music()
+        if index is None:
+            index = self.dataloader.get_random_music_index()
+        index = int(index)
+        audio = decode_cache().get_or_decode(("music", index, self.sample_rate), lambda: self._decode(index))
+        return audio, self.sample_rate
+
+    def _decode(self, index: int) -> np.ndarray:
+        # Get music file from dataloader
+        music = self.dataloader.get_music(index)
 
         # Resample if necessary
         key = list(music.keys())[0]
         if music[key]["sampling_rate"] != self.sample_rate:
             audio = librosa.resample(
-                music[key]["array"],
+                np.asarray(music[key]["array"], dtype=AUDIO_DTYPE),
                 orig_sr=music[key]["sampling_rate"],
                 target_sr=self.sample_rate
             )
         else:
             audio = music[key]["array"]
-            # music["opus"]["sampling_rate"] = self.sample_rate
-        return audio,  self.sample_rate
+        return np.asarray(audio, dtype=AUDIO_DTYPE)
     
     def apply_crossfade(self, audio1: np.ndarray, audio2: np.ndarray, 
                         position: int, fade_length: int) -> np.ndarray:
@@ -65,9 +78,9 @@ class MusicHandler:
         fade_length = min(fade_length, available1, available2)
         if fade_length <= 0:
             return audio1.copy()
-        # Create fade curves
-        fade_out = np.linspace(1, 0, fade_length)
-        fade_in = np.linspace(0, 1, fade_length)
+        # Fade curves, cached per length
+        fade_in = AudioTools.ramp(fade_length)
+        fade_out = fade_in[::-1]
         
         # Apply crossfade
         result = audio1.copy()
@@ -95,43 +108,62 @@ class MusicHandler:
         """
         if len(music) >= target_length:
             return music[:target_length]
-            
-        # Calculate number of loops needed
-        num_loops = int(np.ceil(target_length / len(music)))
-        
-        # Create array of appropriate size
-        result = np.zeros(target_length)
-        
-        # Fill with music loops
-        position = 0
-        fade_length = int(self.crossfade_duration * self.sample_rate)
-        
-        for i in range(num_loops):
-            # Calculate how much of this loop to use
-            remaining = target_length - position
-            if remaining <= 0:
-                break
-                
-            # If this is the first loop, just copy
-            if i == 0:
-                copy_length = min(len(music), remaining)
-                result[position:position + copy_length] = music[:copy_length]
-            else:
-                # Apply crossfade with previous loop
-                copy_length = min(len(music), remaining)
-                result = self.apply_crossfade(
-                    result, music[:copy_length], position, fade_length
-                )
-                
-            position += copy_length
-            
-        return result
+        return self.music_block(music, 0, target_length, loop=True)
+
+    def music_block(self, music: np.ndarray, start: int, stop: int, loop: bool = True) -> np.ndarray:
+        """
+        Samples [start, stop) of a track, looped with crossfades or padded with silence.
+
+        Loop k starts `len(music) - fade` samples after loop k-1, where `fade` is
+        the crossfade duration (at most half the track): the last `fade` samples of
+        a loop fade out linearly while the first `fade` samples of the next fade in.
+        Any range of the looped track is computed from the loops overlapping it, so
+        a long conversation can be rendered block by block.
+
+        Args:
+            music (np.ndarray): Track at the target sample rate
+            start (int): First sample
+            stop (int): End sample
+            loop (bool): Loop the track; pad it with silence otherwise
+
+        Returns:
+            np.ndarray: AUDIO_DTYPE samples
+        """
+        block = np.zeros(stop - start, dtype=AUDIO_DTYPE)
+        length = len(music)
+        if length == 0 or stop <= start:
+            return block
+        if not loop:
+            if start < length:
+                block[:min(stop, length) - start] = music[start:min(stop, length)]
+            return block
+        fade = min(int(self.crossfade_duration * self.sample_rate), length // 2)
+        period = length - fade
+        fade_in = AudioTools.ramp(fade)
+        for k in range(max(0, (start - length) // period + 1), (stop - 1) // period + 1):
+            origin = k * period
+            lo, hi = max(start, origin), min(stop, origin + length)
+            if hi <= lo:
+                continue
+            part = np.array(music[lo - origin:hi - origin], dtype=AUDIO_DTYPE)
+            # Positions of the part within the loop
+            pos = np.arange(lo - origin, hi - origin)
+            if k > 0 and lo - origin < fade:
+                head = pos < fade
+                part[head] *= fade_in[pos[head]]
+            if hi - origin > period:
+                tail = pos >= period
+                part[tail] *= fade_in[::-1][pos[tail] - period]
+            block[lo - start:hi - start] += part
+        return block
     
     def mix_music_with_audio(
         self,
         audio: np.ndarray,
         music_volume: float = 0.2,
-        loop_music: bool = True
+        loop_music: bool = True,
+        music: Optional[np.ndarray] = None,
+        normalize: bool = True
     ) -> np.ndarray:
         """
         Mix background music with the main audio.
@@ -140,38 +172,35 @@ class MusicHandler:
             audio (np.ndarray): Main audio signal
             music_volume (float): Volume level for music (0.0 to 1.0)
             loop_music (bool): Whether to loop music if shorter than audio
+            music (np.ndarray, optional): Pre-loaded music at the target sample rate.
+                A random track is loaded if not given.
+            normalize (bool): Peak-normalize the result if it clips. Disable when the
+                caller limits the final mix once after all stages.
             
         Returns:
             np.ndarray: Combined audio with background music
         """
         # Load music
-        music, _ = self.load_music()
+        if music is None:
+            music, _ = self.load_music()
         
-        # Adjust music length to match audio
-        if len(music) < len(audio):
-            if loop_music:
-                music = self.loop_music(music, len(audio))
-            else:
-                pad_length = len(audio) - len(music)
-                music = np.pad(music, (0, pad_length), mode='constant')
-        else:
-            music = music[:len(audio)]
+        # Looped music covers the whole audio; otherwise the music is cut or,
+        # if shorter, only mixed into the start of the audio (silence after it)
+        loop = loop_music and len(music) < len(audio)
+        end = len(audio) if loop else min(len(music), len(audio))
 
-            
-        # Apply volume adjustment
-        music = music * music_volume
-        
-        # Mix with main audio
-        try:
-            result = audio + music
-        except Exception as e:
-            print("Error mixing audio and music. Ensure they are the same shape.")
-            print(f"Audio shape: {audio.shape}, Music shape: {music.shape}")
-            raise Exception("Audio and music shapes do not match.")
+        # Mix into a single new buffer, block by block, so neither the looped
+        # track nor the scaled music is ever held at full length
+        result = np.array(audio, dtype=AUDIO_DTYPE)
+        volume = np.asarray(music_volume, dtype=AUDIO_DTYPE)
+        for start in range(0, end, self.MIX_BLOCK):
+            stop = min(start + self.MIX_BLOCK, end)
+            block = self.music_block(music, start, stop, loop=loop)
+            block *= volume
+            result[start:stop] += block
         # Normalize to prevent clipping
-        max_val = np.max(np.abs(result))
-        if max_val > 1.0:
-            result = result / max_val
+        if normalize:
+            result = AudioTools.limit_peak(result)
             
         return result
     
@@ -179,7 +208,9 @@ class MusicHandler:
         self,
         audio: np.ndarray,
         music_volume: float = 0.2,
-        loop_music: bool = False
+        loop_music: bool = False,
+        music: Optional[np.ndarray] = None,
+        normalize: bool = True
     ) -> np.ndarray:
         """
         Add background music from a directory to the audio.
@@ -189,6 +220,8 @@ class MusicHandler:
             music_dir (str): Directory containing music files
             music_volume (float): Volume level for music (0.0 to 1.0)
             loop_music (bool): Whether to loop music if shorter than audio
+            music (np.ndarray, optional): Pre-loaded music at the target sample rate
+            normalize (bool): Peak-normalize the result if it clips
             
         Returns:
             np.ndarray: Audio with background music
@@ -198,5 +231,7 @@ class MusicHandler:
         return self.mix_music_with_audio(
             audio=audio,
             music_volume=music_volume,
-            loop_music=loop_music
+            loop_music=loop_music,
+            music=music,
+            normalize=normalize
         )
\ No newline at end of file
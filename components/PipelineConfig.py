@@ -0,0 +1,154 @@
+import os
+import copy
+import json
+from typing import Optional
+
+# Every section and key a pipeline config may contain, with its default.
+# Sections map onto the pipeline stages in the order they run on a sample.
+DEFAULT_CONFIG = {
+    "sources": {
+        "speech": None,
+        # "dataset" (datasets.load_dataset), "tar" (WebDataset tars read in place),
+        # "folder" (dictionary.json of audio files) or "auto"
+        "speech_format": "auto",
+        # Audio directory of a dictionary.json; its own directory if not set
+        "speech_audio_root": None,
+        "music": None,
+        "sfx": None,
+        "stats_dir": None,
+    },
+    "output": {
+        "dir": "output_data",
+        "n_samples": 1000,
+        "files_per_tar": 100,
+        "format": "mp3",
+        "move_shards_to": None,
+        # Render in blocks of this many seconds with constant memory; None renders in memory
+        "stream_block": None,
+        # "encode" every segment, store a "reference" to its source row, or
+        # references plus one copy per source row and shard ("utterances")
+        "segments": "encode",
+    },
+    "resources": {
+        "num_processors": 12,
+        # 0 fetches every sample on the rendering thread
+        "decode_threads": 4,
+        "prefetch": 2,
+        # Per-worker LRU cache of decoded clips; 0 disables it
+        "decode_cache_mb": 512,
+    },
+    "sample_rate": 48000,
+    "seed": None,
+    "conversation": {
+        "speakers": 3,
+        "num_segments": 10,
+        "min_gap": 1.0,
+        "trim_silence": False,
+        "languages": None,
+        "speaker_weight": None,
+        "min_length": None,
+        "max_plan_attempts": 20,
+        # Plan the least used utterances of each speaker; max_reuse also caps the uses of one utterance.
+        # Either makes the plans depend on the chunk layout (n_samples, files_per_tar, num_processors)
+        "balance_usage": False,
+        "max_reuse": None,
+    },
+    "loudness": {
+        "speech_lufs": None,
+        "speech_lufs_jitter": 3.0,
+        "music_lufs": None,
+        "effect_lufs": None,
+        "music_snr": None,
+        "effect_snr": None,
+    },
+    "reverb": {
+        "probability": 0.0,
+        "rir_dir": None,
+    },
+    "music": {
+        "volume": 0.2,
+        "crossfade_duration": 2.0,
+        # Loop tracks shorter than the conversation instead of padding them with silence
+        "loop": False,
+    },
+    "effects": {
+        "coverage": 0.3,
+        "max_length": 2.0,
+        "gain": 0.5,
+    },
+    # Ordered list of {"stage": name, ...stage arguments}, see Augmentation.STAGES
+    "augmentation": [],
+    # Order of the stages run on the summed stems, see DataGen.__init__
+    "mix_stages": ["music", "effects", "augmentation"],
+    "labels": {
+        "hop": 0.01,
+    },
+}
+
+
+def _merge(defaults: dict, overrides: dict, path: str = "") -> dict:
+    merged = copy.deepcopy(defaults)
+    for key, value in overrides.items():
+        if key not in defaults:
+            raise ValueError(f"Unknown config key: {path}{key}")
+        if isinstance(defaults[key], dict):
+            if not isinstance(value, dict):
+                raise ValueError(f"Config key {path}{key} must be a mapping")
+            merged[key] = _merge(defaults[key], value, f"{path}{key}.")
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path: Optional[str] = None, overrides: Optional[dict] = None) -> dict:
+    """
+    Load a pipeline config from JSON or YAML and fill in the defaults.
+
+    Unknown sections or keys are rejected, so a typo in an experiment config
+    fails before any sample is generated.
+
+    Args:
+        path (str, optional): .json, .yaml or .yml file; defaults only if not given
+        overrides (dict, optional): Nested values applied on top of the file
+
+    Returns:
+        dict: Complete config with every key of DEFAULT_CONFIG
+    """
+    config = {}
+    if path is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+                import yaml
+                config = yaml.safe_load(f) or {}
+            else:
+                config = json.load(f)
+    config = _merge(DEFAULT_CONFIG, config)
+    if overrides:
+        config = _merge(config, overrides)
+    for key in ("music_snr", "effect_snr"):
+        if config["loudness"][key] is not None:
+            config["loudness"][key] = tuple(config["loudness"][key])
+    return config
+
+
+def build_dataloader(config: dict, open_indexes: bool = True):
+    """
+    Create the Dataloader of the `sources` section.
+
+    Args:
+        config (dict): Pipeline config
+        open_indexes (bool): Open the speaker and clip statistics indexes of
+            `sources.stats_dir`; disable while (re)building them
+    """
+    from components.Dataloaders import Dataloader
+    sources = config["sources"]
+    return Dataloader(
+        sound_effects_path=sources["sfx"],
+        background_music_path=sources["music"],
+        speech_samples_path=sources["speech"],
+        stats_dir=sources["stats_dir"] if open_indexes else None,
+        tar_index_dir=sources["stats_dir"],
+        speech_format=sources["speech_format"],
+        index_workers=config["resources"]["num_processors"],
+        speech_audio_root=sources["speech_audio_root"],
+    )
@@ -0,0 +1,237 @@
+import os
+import numpy as np
+import soundfile as sf
+from typing import List, Optional, Tuple
+
+SPEED_OF_SOUND = 343.0
+
+
+class RoomReverb:
+    """
+    Per-speaker reverberation of speech stems before mixing.
+
+    Impulse responses come either from a directory of audio files (one room per
+    subdirectory) or from a bank of shoebox rooms simulated with the
+    image-source method. Every sample uses one room, and every speaker gets the
+    response of its own source position in that room. All stems are convolved
+    together with an overlap-add FFT convolution, and the spectra of the
+    responses are cached per FFT size.
+    """
+    # Blocks of every stem transformed together by convolve
+    FFT_BATCH = 4
+
+    def __init__(
+        self,
+        sample_rate: int = 48000,
+        ir_dir: Optional[str] = None,
+        num_rooms: int = 16,
+        positions_per_room: int = 8,
+        rt60_range: Tuple[float, float] = (0.2, 0.8),
+        room_dim_range: Tuple[Tuple[float, float, float], Tuple[float, float, float]] = ((3.0, 3.0, 2.5), (10.0, 8.0, 4.0)),
+        max_order: int = 12,
+        seed: int = 0,
+    ):
+        """
+        Initialize the reverb stage. The impulse responses are created on first use.
+
+        Args:
+            sample_rate (int): Sample rate of the stems
+            ir_dir (str, optional): Directory of impulse response files; if not given,
+                responses are simulated
+            num_rooms (int): Number of simulated rooms
+            positions_per_room (int): Number of simulated source positions per room
+            rt60_range (Tuple[float, float]): Range of reverberation times in seconds
+            room_dim_range: Smallest and largest room dimensions (x, y, z) in meters
+            max_order (int): Highest image order per axis
+            seed (int): Seed of the simulated bank, identical in every worker
+        """
+        self.sample_rate = sample_rate
+        self.ir_dir = ir_dir
+        self.num_rooms = num_rooms
+        self.positions_per_room = positions_per_room
+        self.rt60_range = rt60_range
+        self.room_dim_range = room_dim_range
+        self.max_order = max_order
+        self.seed = seed
+        self._rooms = None
+        self._spectra = {}
+
+    def __getstate__(self):
+        # Workers rebuild the bank lazily instead of receiving it through a pipe
+        state = self.__dict__.copy()
+        state["_rooms"] = None
+        state["_spectra"] = {}
+        return state
+
+    @property
+    def rooms(self) -> List[List[np.ndarray]]:
+        """
+        Impulse responses grouped by room.
+        """
+        if self._rooms is None:
+            self._rooms = self._load_rooms() if self.ir_dir is not None else self._simulate_rooms()
+        return self._rooms
+
+    def image_source_rir(self, room_dim, source, mic, rt60: float) -> np.ndarray:
+        """
+        Simulate the impulse response of a shoebox room with the image-source method.
+
+        Args:
+            room_dim: Room dimensions (x, y, z) in meters
+            source: Source position in meters
+            mic: Microphone position in meters
+            rt60 (float): Reverberation time in seconds
+
+        Returns:
+            np.ndarray: float32 impulse response of rt60 seconds with unit energy
+        """
+        room_dim = np.asarray(room_dim, dtype=np.float64)
+        volume = np.prod(room_dim)
+        surface = 2.0 * (room_dim[0] * room_dim[1] + room_dim[0] * room_dim[2] + room_dim[1] * room_dim[2])
+        # Sabine: uniform absorption for the requested reverberation time
+        absorption = min(0.99, 0.161 * volume / (surface * rt60))
+        reflection = np.sqrt(1.0 - absorption)
+        order = min(self.max_order, int(np.ceil(SPEED_OF_SOUND * rt60 / room_dim.min())))
+
+        n = np.arange(-order, order + 1)
+        q = np.array([0, 1])
+        # Image coordinates and reflection counts per axis: (axis, n, q)
+        coords = (1 - 2 * q[None, None, :]) * np.asarray(source)[:, None, None] + 2 * n[None, :, None] * room_dim[:, None, None]
+        bounces = np.abs(2 * n[:, None] - q[None, :])
+        dx = (coords[0] - mic[0]).reshape(-1)
+        dy = (coords[1] - mic[1]).reshape(-1)
+        dz = (coords[2] - mic[2]).reshape(-1)
+        bx = bounces.reshape(-1)
+        distance = np.sqrt(dx[:, None, None] ** 2 + dy[None, :, None] ** 2 + dz[None, None, :] ** 2).ravel()
+        reflections = (bx[:, None, None] + bx[None, :, None] + bx[None, None, :]).ravel()
+
+        length = int(rt60 * self.sample_rate)
+        delay = distance / SPEED_OF_SOUND * self.sample_rate
+        keep = delay < length - 1
+        delay = delay[keep]
+        gain = reflection ** reflections[keep] / (4.0 * np.pi * np.maximum(distance[keep], 0.1))
+        # Fractional delays split linearly between the two neighbouring taps
+        tap = np.floor(delay).astype(np.int64)
+        frac = delay - tap
+        rir = np.zeros(length, dtype=np.float64)
+        np.add.at(rir, tap, gain * (1.0 - frac))
+        np.add.at(rir, tap + 1, gain * frac)
+        return self._unit_energy(rir)
+
+    def apply(self, stems: np.ndarray, probability: float = 1.0,
+              rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """
+        Reverberate the speaker stems of one sample.
+
+        Args:
+            stems (np.ndarray): (num_speakers, num_samples) dry stems
+            probability (float): Probability that the sample is reverberated at all
+            rng (np.random.Generator, optional): Random generator; the global one if not given
+
+        Returns:
+            np.ndarray: Stems of the same shape; the reverb tail past the end is cut
+        """
+        rng = np.random if rng is None else rng
+        if probability <= 0.0 or rng.random() >= probability:
+            return stems
+        room = int(rng.choice(len(self.rooms)))
+        positions = rng.choice(len(self.rooms[room]), size=len(stems), replace=len(stems) > len(self.rooms[room]))
+        return self.convolve(stems, [(room, position) for position in positions])
+
+    def convolve(self, stems: np.ndarray, irs: List[Tuple[int, int]]) -> np.ndarray:
+        """
+        Convolve every stem with its own impulse response (overlap-add, all stems in one batch of blocks).
+
+        Args:
+            stems (np.ndarray): (num_speakers, num_samples) stems
+            irs (List[Tuple[int, int]]): (room, position) of the response per stem
+
+        Returns:
+            np.ndarray: float32 stems of the same shape
+        """
+        num_stems, num_samples = stems.shape
+        if num_stems == 0 or num_samples == 0:
+            return stems
+        from scipy import fft
+        ir_length = max(len(self.rooms[room][position]) for room, position in irs)
+        nfft = fft.next_fast_len(max(2 * ir_length, 1 << 14), real=True)
+        block = nfft - ir_length + 1
+        num_blocks = -(-num_samples // block)
+        # FFT_BATCH blocks of every stem are transformed in one call, so the FFT buffers
+        # stay a few blocks long; one extra block holds the tail of the last one until it is cut
+        spectrum = np.stack([self._spectrum(room, position, nfft) for room, position in irs])[:, None, :]
+        out = np.zeros((num_stems, (num_blocks + 1) * block), dtype=np.float32)
+        for first in range(0, num_blocks, self.FFT_BATCH):
+            count = min(self.FFT_BATCH, num_blocks - first)
+            start = first * block
+            chunk = stems[:, start:start + count * block]
+            if chunk.shape[1] < count * block:
+                chunk = np.pad(chunk, ((0, 0), (0, count * block - chunk.shape[1])))
+            spectra = fft.rfft(chunk.reshape(num_stems, count, block), n=nfft, axis=-1)
+            spectra *= spectrum
+            blocks = fft.irfft(spectra, n=nfft, axis=-1)
+            del spectra
+            out[:, start:start + count * block] += blocks[:, :, :block].reshape(num_stems, -1)
+            # Each block spills ir_length - 1 <= block samples into the next one
+            tails = out[:, start + block:start + (count + 1) * block].reshape(num_stems, count, block)
+            tails[:, :, :ir_length - 1] += blocks[:, :, block:block + ir_length - 1]
+        return out[:, :num_samples]
+
+    def _spectrum(self, room: int, position: int, nfft: int) -> np.ndarray:
+        key = (room, position, nfft)
+        if key not in self._spectra:
+            from scipy import fft
+            # complex64 like the spectra of the float32 blocks, so they multiply in place
+            self._spectra[key] = fft.rfft(self.rooms[room][position], n=nfft).astype(np.complex64)
+        return self._spectra[key]
+
+    def _simulate_rooms(self) -> List[List[np.ndarray]]:
+        rng = np.random.default_rng(self.seed)
+        low, high = np.asarray(self.room_dim_range[0]), np.asarray(self.room_dim_range[1])
+        rooms = []
+        for _ in range(self.num_rooms):
+            room_dim = rng.uniform(low, high)
+            rt60 = rng.uniform(*self.rt60_range)
+            # Keep sources and microphone at least 0.5 m from the walls
+            mic = rng.uniform(0.5, room_dim - 0.5)
+            rooms.append([
+                self.image_source_rir(room_dim, rng.uniform(0.5, room_dim - 0.5), mic, rt60)
+                for _ in range(self.positions_per_room)
+            ])
+        return rooms
+
+    def _load_rooms(self) -> List[List[np.ndarray]]:
+        # Every subdirectory is one room; loose files together form another room
+        rooms = []
+        loose = self._load_responses(self.ir_dir)
+        if loose:
+            rooms.append(loose)
+        for name in sorted(os.listdir(self.ir_dir)):
+            path = os.path.join(self.ir_dir, name)
+            if os.path.isdir(path):
+                responses = self._load_responses(path)
+                if responses:
+                    rooms.append(responses)
+        if not rooms:
+            raise ValueError(f"No impulse responses found in {self.ir_dir}")
+        return rooms
+
+    def _load_responses(self, directory: str) -> List[np.ndarray]:
+        import librosa
+        responses = []
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith((".wav", ".flac", ".ogg")):
+                continue
+            rir, sr = sf.read(os.path.join(directory, name), dtype="float32", always_2d=True)
+            rir = rir[:, 0]
+            if sr != self.sample_rate:
+                rir = librosa.resample(rir, orig_sr=sr, target_sr=self.sample_rate)
+            # Drop the propagation delay before the direct path
+            rir = rir[max(0, int(np.argmax(np.abs(rir))) - int(0.001 * self.sample_rate)):]
+            responses.append(self._unit_energy(rir))
+        return responses
+
+    @staticmethod
+    def _unit_energy(rir: np.ndarray) -> np.ndarray:
+        energy = np.sqrt(np.sum(np.square(rir, dtype=np.float64)))
+        return (rir / energy if energy > 0 else rir).astype(np.float32)
@@ -0,0 +1,264 @@
+import io
+import os
+import json
+import mmap
+import tarfile
+import numpy as np
+from typing import Dict, Iterator, List, Optional
+
+from components.DiarizationLabels import DiarizationLabels
+from components.ShardWriter import ShardWriter
+
+
+def scan_shard(path: str) -> Dict[str, Dict[str, list]]:
+    """
+    Build the index of a shard without a sidecar by reading its member headers.
+
+    Returns:
+        Dict[str, Dict[str, list]]: Sample key -> member name -> [data offset, size]
+    """
+    samples = {}
+    with tarfile.open(path, "r:") as tar:
+        for member in tar:
+            if member.isfile():
+                key = member.name.split(".", 1)[0]
+                samples.setdefault(key, {})[member.name] = [member.offset_data, member.size]
+    return samples
+
+
+class ShardReader:
+    """
+    Random access to the samples of one shard written by ShardWriter.
+
+    The tar is memory-mapped and members are returned as read-only views of it;
+    `close` fails while any of them is still referenced.
+    """
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        """
+        Args:
+            path (str): Shard tar
+            index_path (str, optional): Sidecar index; `shard_XXXXX.index.json` next to
+                the shard if not given, and the tar headers if that does not exist
+        """
+        self.path = path
+        if index_path is None:
+            index_path = path[:-len(".tar")] + ShardWriter.INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)["samples"]
+        else:
+            self.index = scan_shard(path)
+        self._shared = None
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        self._view = memoryview(self._map)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def keys(self) -> List[str]:
+        return list(self.index)
+
+    def member(self, key: str, suffix: str) -> memoryview:
+        """
+        Raw data of one member, e.g. `member("000042", "stem_0.pcm")`.
+
+        Args:
+            key (str): Sample key
+            suffix (str): Member name after "{key}."
+
+        Returns:
+            memoryview: Read-only view into the shard
+        """
+        members = self.index[key]
+        name = f"{key}.{suffix}"
+        if name not in members and suffix.startswith(ShardWriter.SHARED_PREFIX):
+            # Content-addressed members are stored once per shard, possibly under another key
+            offset, size = self._shared_members()[suffix]
+        else:
+            offset, size = members[name]
+        return self._view[offset:offset + size]
+
+    def _shared_members(self) -> Dict[str, list]:
+        if self._shared is None:
+            self._shared = {}
+            for members in self.index.values():
+                for name, location in members.items():
+                    suffix = name.partition(".")[2]
+                    if suffix.startswith(ShardWriter.SHARED_PREFIX):
+                        self._shared.setdefault(suffix, location)
+        return self._shared
+
+    def json(self, key: str) -> dict:
+        return json.loads(bytes(self.member(key, "json")))
+
+    def _audio_format(self, meta: dict) -> str:
+        return meta.get("audio", {}).get("format", "mp3")
+
+    def audio(self, key: str, suffix: str, meta: Optional[dict] = None) -> np.ndarray:
+        """
+        Audio member as int16 samples.
+
+        Args:
+            key (str): Sample key
+            suffix (str): Member name after "{key}." without the extension, e.g. "stem_0"
+            meta (dict, optional): Sample JSON, read if not given
+
+        Returns:
+            np.ndarray: int16 samples; a read-only view into the shard for "pcm" shards
+        """
+        meta = self.json(key) if meta is None else meta
+        ext = self._audio_format(meta)
+        return self._decode(self.member(key, f"{suffix}.{ext}" if suffix else ext), ext)
+
+    @staticmethod
+    def _decode(data: memoryview, ext: str) -> np.ndarray:
+        if ext == "pcm":
+            return np.frombuffer(data, dtype="<i2")
+        import soundfile as sf
+        audio, _ = sf.read(io.BytesIO(data), dtype="int16")
+        return audio if audio.ndim == 1 else audio[:, 0]
+
+    def segment(self, key: str, idx: int, meta: Optional[dict] = None, dataloader=None) -> np.ndarray:
+        """
+        Audio of one segment as int16 samples at its own sample rate.
+
+        Encoded segments are read from their member. Referenced segments are
+        rebuilt from their source row, cut to the `trim` offsets and scaled by
+        `gain`: from the shard's copy of the utterance if there is one, from the
+        speech dataset of `dataloader` otherwise.
+
+        Args:
+            key (str): Sample key
+            idx (int): Segment index
+            meta (dict, optional): Sample JSON, read if not given
+            dataloader (Dataloader, optional): Loader of the speech dataset the
+                sample was generated from; needed for segments without a copy
+
+        Returns:
+            np.ndarray: int16 samples
+        """
+        meta = self.json(key) if meta is None else meta
+        seg = meta["segments"][idx]
+        if "stem_path" in seg:
+            return self.audio(key, f"s_{idx}", meta)
+        if "utterance" in seg:
+            name = seg["utterance"]
+            audio = self._decode(self.member(key, name.partition(".")[2]), name.rsplit(".", 1)[1])
+            audio = audio.astype(np.float32) / np.iinfo(np.int16).max
+        else:
+            if dataloader is None:
+                raise ValueError(f"Segment {idx} of {key} is a reference to the speech dataset; pass its dataloader")
+            fingerprint = meta["speech"]["fingerprint"]
+            if dataloader.fingerprint("speech") != fingerprint:
+                raise ValueError(f"Sample {key} references speech dataset {fingerprint}, "
+                                 f"the dataloader has {dataloader.fingerprint('speech')}")
+            audio = np.asarray(dataloader.speech_audio(dataloader.get_speech(seg["row"]))["array"], dtype=np.float32)
+        if "trim" in seg:
+            audio = audio[seg["trim"][0]:seg["trim"][1]]
+        audio = audio * np.float32(seg.get("gain", 1.0))
+        return (np.clip(audio, -1.0, 1.0) * np.iinfo(np.int16).max).astype("<i2")
+
+    def segments(self, key: str, meta: Optional[dict] = None, dataloader=None) -> List[np.ndarray]:
+        meta = self.json(key) if meta is None else meta
+        return [self.segment(key, idx, meta, dataloader) for idx in range(len(meta["segments"]))]
+
+    def mix(self, key: str, meta: Optional[dict] = None) -> np.ndarray:
+        return self.audio(key, "", meta)
+
+    def stems(self, key: str, meta: Optional[dict] = None) -> List[np.ndarray]:
+        meta = self.json(key) if meta is None else meta
+        return [self.audio(key, f"stem_{idx}", meta) for idx in range(len(meta["labels"]["speakers"]))]
+
+    def activity(self, key: str, meta: Optional[dict] = None) -> np.ndarray:
+        """
+        (num_speakers, num_frames) activity matrix of a sample.
+        """
+        meta = self.json(key) if meta is None else meta
+        labels = meta["labels"]
+        return DiarizationLabels.unpack(self.member(key, "labels.bits"), len(labels["speakers"]), labels["num_frames"])
+
+    def sample(self, key: str) -> dict:
+        """
+        JSON, mix, stems and activity of a sample.
+        """
+        meta = self.json(key)
+        return {
+            "json": meta,
+            "mix": self.mix(key, meta),
+            "stems": self.stems(key, meta),
+            "activity": self.activity(key, meta),
+        }
+
+    def close(self) -> None:
+        self._view.release()
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ShardDirectoryReader:
+    """
+    Random access by key to every sample of an output directory.
+
+    The manifest and sidecar indexes are read up front; shards are memory-mapped
+    when first used.
+    """
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory (str): Output directory with manifest.json and its shards
+        """
+        self.directory = directory
+        with open(os.path.join(directory, ShardWriter.MANIFEST_NAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)["shards"]
+        self._shards = {}
+        self._locations = {}
+        for entry in self.manifest:
+            index_path = os.path.join(directory, entry["index"]) if "index" in entry else None
+            if index_path is not None and os.path.exists(index_path):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    keys = json.load(f)["samples"]
+            else:
+                keys = scan_shard(os.path.join(directory, entry["shard"]))
+            for key in keys:
+                self._locations[key] = entry["shard"]
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._locations
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._locations)
+
+    def shard(self, key: str) -> ShardReader:
+        """
+        Reader of the shard holding a sample.
+        """
+        name = self._locations[key]
+        if name not in self._shards:
+            self._shards[name] = ShardReader(os.path.join(self.directory, name))
+        return self._shards[name]
+
+    def sample(self, key: str) -> dict:
+        return self.shard(key).sample(key)
+
+    def close(self) -> None:
+        for reader in self._shards.values():
+            reader.close()
+        self._shards = {}
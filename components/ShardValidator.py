@@ -0,0 +1,442 @@
+import io
+import os
+import json
+import hashlib
+import tarfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from components.ShardWriter import ShardWriter
+
+# Bytes read per call while hashing a shard
+_READ_SIZE = 1 << 20
+
+
+class StreamingHistogram:
+    """
+    Fixed-bin histogram with running count, sum, minimum and maximum.
+
+    Memory does not depend on the number of values added, and histograms with
+    the same bins merge by adding their counts, so per-shard histograms can be
+    combined in any order. Values outside [low, high] land in the first or last bin.
+    """
+    def __init__(self, low: float, high: float, bins: int):
+        """
+        Args:
+            low (float): Lower edge of the first bin
+            high (float): Upper edge of the last bin
+            bins (int): Number of bins
+        """
+        self.edges = np.linspace(low, high, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values) -> None:
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        if len(values) == 0:
+            return
+        bins = np.clip(np.searchsorted(self.edges, values, side="right") - 1, 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: "StreamingHistogram") -> None:
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate quantile, interpolated linearly within its bin.
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = np.cumsum(self.counts)
+        b = int(np.searchsorted(cumulative, target, side="left"))
+        before = cumulative[b - 1] if b > 0 else 0
+        fraction = (target - before) / self.counts[b] if self.counts[b] else 0.0
+        value = self.edges[b] + fraction * (self.edges[b + 1] - self.edges[b])
+        return float(np.clip(value, self.min, self.max))
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 4),
+            "min": round(self.min, 4) if self.count else None,
+            "p50": round(self.quantile(0.5), 4),
+            "p95": round(self.quantile(0.95), 4),
+            "max": round(self.max, 4) if self.count else None,
+            "edges": [round(float(edge), 4) for edge in self.edges],
+            "counts": self.counts.tolist(),
+        }
+
+
+def _speech_coverage(segments: List[dict]):
+    """
+    Seconds during which at least one and at least two speakers talk.
+    """
+    if not segments:
+        return 0.0, 0.0
+    times = np.array([[seg["start"], seg["end"]] for seg in segments], dtype=np.float64)
+    boundaries = np.concatenate([times[:, 0], times[:, 1]])
+    steps = np.concatenate([np.ones(len(times)), -np.ones(len(times))])
+    # Ends before starts at the same instant, so touching turns do not overlap
+    order = np.lexsort((steps, boundaries))
+    boundaries, active = boundaries[order], np.cumsum(steps[order])
+    spans = np.diff(boundaries)
+    return float(spans[active[:-1] >= 1].sum()), float(spans[active[:-1] >= 2].sum())
+
+
+class DatasetStats:
+    """
+    Statistics of generated samples, aggregated from their JSON metadata.
+
+    Totals and histograms have a fixed size. The sets of distinct speakers,
+    music tracks and sound effects are bounded by the size of the source corpora,
+    not by the number of samples.
+    """
+    def __init__(self):
+        self.samples = 0
+        self.duration = 0.0
+        self.speech = 0.0
+        self.overlap = 0.0
+        self.effect_time = 0.0
+        self.effects = 0
+        self.samples_with_effects = 0
+        self.samples_with_music = 0
+        self.language_time = {}
+        self.speakers = set()
+        self.music_rows = set()
+        self.effect_rows = set()
+        self.histograms = {
+            "duration": StreamingHistogram(0.0, 600.0, 60),
+            "overlap_ratio": StreamingHistogram(0.0, 1.0, 20),
+            "silence_ratio": StreamingHistogram(0.0, 1.0, 20),
+            "speakers_per_sample": StreamingHistogram(0.0, 16.0, 16),
+            "effects_per_sample": StreamingHistogram(0.0, 32.0, 32),
+        }
+        self.audio_histograms = {
+            "peak_dbfs": StreamingHistogram(-60.0, 0.0, 60),
+            "rms_dbfs": StreamingHistogram(-80.0, 0.0, 80),
+            "clipped_fraction": StreamingHistogram(0.0, 0.01, 20),
+        }
+
+    def add(self, meta: dict) -> None:
+        """
+        Add one sample from its JSON metadata.
+        """
+        segments = meta.get("segments", [])
+        labels = meta.get("labels", {})
+        audio = meta.get("audio")
+        if audio is not None:
+            duration = audio["num_samples"] / audio["sample_rate"]
+        elif labels:
+            duration = labels["num_frames"] * labels["hop"]
+        else:
+            duration = max((seg["end"] for seg in segments), default=0.0)
+        speech, overlap = _speech_coverage(segments)
+        self.samples += 1
+        self.duration += duration
+        self.speech += speech
+        self.overlap += overlap
+        for seg in segments:
+            language = seg.get("language", "unknown")
+            self.language_time[language] = self.language_time.get(language, 0.0) + seg["end"] - seg["start"]
+        speakers = labels.get("speakers") or list(dict.fromkeys(seg["id"] for seg in segments))
+        self.speakers.update(speakers)
+        effects = meta.get("effects", [])
+        self.effects += len(effects)
+        self.samples_with_effects += bool(effects)
+        self.effect_time += sum(effect["duration"] for effect in effects)
+        self.effect_rows.update(effect["row"] for effect in effects)
+        if "music" in meta:
+            self.samples_with_music += 1
+            self.music_rows.add(meta["music"]["row"])
+        self.histograms["duration"].add(duration)
+        self.histograms["overlap_ratio"].add(overlap / speech if speech > 0 else 0.0)
+        self.histograms["silence_ratio"].add(max(0.0, duration - speech) / duration if duration > 0 else 0.0)
+        self.histograms["speakers_per_sample"].add(len(speakers))
+        self.histograms["effects_per_sample"].add(len(effects))
+
+    def add_audio(self, mix: np.ndarray) -> None:
+        """
+        Add level statistics of a decoded int16 mix.
+        """
+        full_scale = float(np.iinfo(np.int16).max)
+        samples = np.abs(mix.astype(np.float32)) / full_scale
+        peak = float(samples.max()) if len(samples) else 0.0
+        rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) if len(samples) else 0.0
+        self.audio_histograms["peak_dbfs"].add(20.0 * np.log10(max(peak, 1e-6)))
+        self.audio_histograms["rms_dbfs"].add(20.0 * np.log10(max(rms, 1e-8)))
+        self.audio_histograms["clipped_fraction"].add(float(np.mean(samples >= 1.0)) if len(samples) else 0.0)
+
+    def merge(self, other: "DatasetStats") -> None:
+        for name in ("samples", "duration", "speech", "overlap", "effect_time", "effects",
+                     "samples_with_effects", "samples_with_music"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for language, seconds in other.language_time.items():
+            self.language_time[language] = self.language_time.get(language, 0.0) + seconds
+        self.speakers |= other.speakers
+        self.music_rows |= other.music_rows
+        self.effect_rows |= other.effect_rows
+        for histograms, others in ((self.histograms, other.histograms), (self.audio_histograms, other.audio_histograms)):
+            for name, histogram in histograms.items():
+                histogram.merge(others[name])
+
+    def summary(self) -> dict:
+        speech_languages = sum(self.language_time.values())
+        summary = {
+            "samples": self.samples,
+            "hours": round(self.duration / 3600.0, 3),
+            "speech_hours": round(self.speech / 3600.0, 3),
+            "overlap_ratio": round(self.overlap / self.speech, 4) if self.speech else 0.0,
+            "silence_ratio": round(max(0.0, self.duration - self.speech) / self.duration, 4) if self.duration else 0.0,
+            "speakers": len(self.speakers),
+            "languages": {
+                language: round(seconds / speech_languages, 4)
+                for language, seconds in sorted(self.language_time.items(), key=lambda item: -item[1])
+            },
+            "music": {
+                "samples": self.samples_with_music,
+                "distinct_tracks": len(self.music_rows),
+            },
+            "effects": {
+                "total": self.effects,
+                "samples": self.samples_with_effects,
+                "distinct_clips": len(self.effect_rows),
+                "time_ratio": round(self.effect_time / self.duration, 4) if self.duration else 0.0,
+            },
+            "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+        }
+        if self.audio_histograms["peak_dbfs"].count:
+            summary["audio"] = {name: histogram.summary() for name, histogram in self.audio_histograms.items()}
+        return summary
+
+
+class _HashingReader:
+    """
+    Read-only file wrapper that hashes everything read through it.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self) -> None:
+        while self.read(_READ_SIZE):
+            pass
+
+
+def _expected_members(meta: dict) -> Optional[int]:
+    # json, one member per encoded segment and stem, the mix, labels.bits and rttm;
+    # utterance copies are shared within the shard and checked separately
+    if "labels" not in meta:
+        return None
+    encoded = sum("stem_path" in seg for seg in meta.get("segments", []))
+    return 1 + encoded + len(meta["labels"]["speakers"]) + 1 + 2
+
+
+def _decode_mix(data: bytes, meta: dict) -> np.ndarray:
+    audio = meta.get("audio", {})
+    if audio.get("format") == "pcm":
+        return np.frombuffer(data, dtype="<i2")
+    import soundfile as sf
+    mix, _ = sf.read(io.BytesIO(data), dtype="int16")
+    return mix if mix.ndim == 1 else mix[:, 0]
+
+
+def _check_mix(label: str, data: bytes, meta: dict, errors: List[str], stats: DatasetStats) -> None:
+    # Decode one mix, check it against its JSON and add its levels
+    try:
+        mix = _decode_mix(data, meta)
+    except Exception as e:
+        errors.append(f"{label}: mix does not decode ({e})")
+        return
+    audio = meta.get("audio")
+    if audio is not None and len(mix) != audio["num_samples"]:
+        errors.append(f"{label}: mix has {len(mix)} samples, JSON lists {audio['num_samples']}")
+    if len(mix) == 0 or not np.any(mix):
+        errors.append(f"{label}: silent mix")
+    stats.add_audio(mix)
+
+
+def validate_shard(path: str, entry: dict, check_audio: bool = False) -> tuple:
+    """
+    Stream one shard, verify it against its manifest entry and collect statistics.
+
+    The shard is read once, sequentially: every byte is hashed, member headers are
+    counted and only the JSON members (and the mixes, with `check_audio`) are parsed.
+    A mix is checked as soon as it is read, so one decoded mix is held at a time.
+
+    Args:
+        path (str): Shard tar
+        entry (dict): Manifest entry of the shard
+        check_audio (bool): Decode every mix and check its length and level
+
+    Returns:
+        Tuple[str, List[str], DatasetStats]: Shard name, problems found and statistics
+    """
+    name = entry["shard"]
+    errors = []
+    stats = DatasetStats()
+    if not os.path.exists(path):
+        return name, [f"{name}: missing"], stats
+
+    samples, members, shared = {}, 0, set()
+    with open(path, "rb") as f:
+        reader = _HashingReader(f)
+        try:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                for member in tar:
+                    members += 1
+                    key, _, suffix = member.name.partition(".")
+                    sample = samples.setdefault(key, {"members": 0, "meta": None, "mix": None, "mixed": False})
+                    if suffix.startswith(ShardWriter.SHARED_PREFIX):
+                        shared.add(suffix)
+                        continue
+                    sample["members"] += 1
+                    if suffix == "json":
+                        sample["meta"] = json.loads(tar.extractfile(member).read())
+                    elif check_audio and "." not in suffix and suffix != "rttm":
+                        data = tar.extractfile(member).read()
+                        sample["mixed"] = True
+                        if sample["meta"] is not None:
+                            _check_mix(f"{name}/{key}", data, sample["meta"], errors, stats)
+                        else:
+                            # The writer puts the JSON first; kept only for shards that do not
+                            sample["mix"] = data
+        except (tarfile.TarError, EOFError, ValueError) as e:
+            errors.append(f"{name}: unreadable after {members} members ({e})")
+        reader.drain()
+
+    if reader.size != entry["bytes"]:
+        errors.append(f"{name}: {reader.size} bytes, manifest lists {entry['bytes']}")
+    elif reader.sha256.hexdigest() != entry["sha256"]:
+        errors.append(f"{name}: checksum mismatch")
+    if len(samples) != entry["samples"]:
+        errors.append(f"{name}: {len(samples)} samples, manifest lists {entry['samples']}")
+    if members != entry["members"]:
+        errors.append(f"{name}: {members} members, manifest lists {entry['members']}")
+    if "index" in entry:
+        index_path = os.path.join(os.path.dirname(path), entry["index"])
+        if not os.path.exists(index_path):
+            errors.append(f"{name}: missing index {entry['index']}")
+        else:
+            with open(index_path, "r", encoding="utf-8") as f:
+                indexed = json.load(f)["samples"]
+            if set(indexed) != set(samples):
+                errors.append(f"{name}: index keys differ from the shard")
+
+    for key, sample in samples.items():
+        meta = sample["meta"]
+        if meta is None:
+            errors.append(f"{name}/{key}: no JSON member")
+            continue
+        expected = _expected_members(meta)
+        if expected is not None and sample["members"] != expected:
+            errors.append(f"{name}/{key}: {sample['members']} members, expected {expected}")
+        missing = [seg["utterance"] for seg in meta.get("segments", [])
+                   if "utterance" in seg and seg["utterance"].partition(".")[2] not in shared]
+        if missing:
+            errors.append(f"{name}/{key}: utterance {missing[0]} not in the shard")
+        stats.add(meta)
+        if check_audio:
+            if not sample["mixed"]:
+                errors.append(f"{name}/{key}: no mix member")
+            elif sample["mix"] is not None:
+                _check_mix(f"{name}/{key}", sample["mix"], meta, errors, stats)
+                sample["mix"] = None
+    return name, errors, stats
+
+
+def _validate_task(task: tuple) -> tuple:
+    return validate_shard(*task)
+
+
+def validate_directory(
+    directory: str,
+    shard_dir: Optional[str] = None,
+    num_workers: int = 8,
+    check_audio: bool = False,
+) -> dict:
+    """
+    Verify every shard of an output directory against its manifest, in parallel.
+
+    Args:
+        directory (str): Output directory with manifest.json
+        shard_dir (str, optional): Directory holding the shards if they were moved
+        num_workers (int): Number of shards validated at once
+        check_audio (bool): Also decode and check every mix
+
+    Returns:
+        dict: `shards`, `errors` (list of problems, empty if the data is complete)
+            and `stats` (DatasetStats.summary)
+    """
+    from tqdm import tqdm
+    shard_dir = shard_dir or directory
+    with open(os.path.join(directory, ShardWriter.MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)["shards"]
+    errors = []
+    listed = {entry["shard"] for entry in manifest}
+    for leftover in sorted(os.listdir(shard_dir)):
+        if leftover.endswith(".tar") and leftover not in listed:
+            errors.append(f"{leftover}: not in the manifest")
+        elif leftover.endswith(".tmp"):
+            errors.append(f"{leftover}: unfinished write")
+
+    stats = DatasetStats()
+    tasks = [(os.path.join(shard_dir, entry["shard"]), entry, check_audio) for entry in manifest]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(_validate_task, tasks, chunksize=max(1, len(tasks) // (num_workers * 8)))
+        for _, shard_errors, shard_stats in tqdm(results, total=len(tasks), desc="Validating shards"):
+            errors.extend(shard_errors)
+            stats.merge(shard_stats)
+    return {"shards": len(manifest), "errors": errors, "stats": stats.summary()}
+
+
+def format_report(report: dict) -> str:
+    """
+    Human-readable summary of a `validate_directory` report.
+    """
+    stats = report["stats"]
+    lines = [
+        f"shards:        {report['shards']}",
+        f"samples:       {stats['samples']}",
+        f"hours:         {stats['hours']:.2f} ({stats['speech_hours']:.2f} speech)",
+        f"overlap ratio: {stats['overlap_ratio']:.3f} of speech",
+        f"silence ratio: {stats['silence_ratio']:.3f}",
+        f"speakers:      {stats['speakers']}",
+        "languages:     " + ", ".join(f"{language} {share:.1%}" for language, share in stats["languages"].items()),
+        f"music:         {stats['music']['samples']} samples, {stats['music']['distinct_tracks']} tracks",
+        f"effects:       {stats['effects']['total']} in {stats['effects']['samples']} samples, "
+        f"{stats['effects']['distinct_clips']} clips, {stats['effects']['time_ratio']:.1%} of the time",
+    ]
+    for name, histogram in stats["histograms"].items():
+        lines.append(f"{name + ':':<21}p50 {histogram['p50']}  p95 {histogram['p95']}  max {histogram['max']}")
+    for name, histogram in stats.get("audio", {}).items():
+        lines.append(f"{name + ':':<21}p50 {histogram['p50']}  p95 {histogram['p95']}  max {histogram['max']}")
+    if report["errors"]:
+        lines.append(f"{len(report['errors'])} problems:")
+        lines.extend(f"  {error}" for error in report["errors"])
+    else:
+        lines.append("all shards match the manifest")
+    return "\n".join(lines)
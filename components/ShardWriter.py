@@ -0,0 +1,278 @@
+import os
+import json
+import queue
+import shutil
+import hashlib
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
+
+from components.SharedPayload import MemoryViewReader, SharedPayload, SpooledPayload
+
+# (shard_path, manifest_entry) -> None
+PostShardCallback = Callable[[str, dict], None]
+
+
+class _HashingWriter:
+    """
+    File wrapper that computes the SHA-256 and size of everything written through it.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def tell(self) -> int:
+        return self.size
+
+
+def move_shard_to(directory: str) -> PostShardCallback:
+    """
+    Build a post-shard callback that moves every finished shard into another directory.
+
+    Args:
+        directory (str): Destination directory, created if missing
+
+    Returns:
+        PostShardCallback: Callback for ShardWriter
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    def _move(shard_path: str, entry: dict) -> None:
+        # The sidecar index travels with its shard
+        index_path = os.path.join(os.path.dirname(shard_path), entry["index"])
+        shutil.move(index_path, os.path.join(directory, entry["index"]))
+        shutil.move(shard_path, os.path.join(directory, os.path.basename(shard_path)))
+
+    return _move
+
+
+class ShardWriter:
+    """
+    Writes WebDataset shards (tar files) on a background thread.
+
+    Every shard gets a sidecar `shard_XXXXX.index.json` of member offsets, and
+    `close` writes `manifest.json` with the size and SHA-256 of every shard.
+    Members named `{key}.cas_<digest>.<ext>` (SHARED_PREFIX) are stored once per shard.
+    """
+    MANIFEST_NAME = "manifest.json"
+    INDEX_SUFFIX = ".index.json"
+    SHARED_PREFIX = "cas_"
+    COPY_BUFSIZE = 1 << 20
+
+    def __init__(
+        self,
+        output_dir: str,
+        files_per_tar: int,
+        post_shard_callback: Optional[PostShardCallback] = None,
+        max_pending: int = 64,
+    ):
+        """
+        Initialize the writer and start its background thread.
+
+        Args:
+            output_dir (str): Directory the shards are written to
+            files_per_tar (int): Number of samples per shard
+            post_shard_callback (PostShardCallback, optional): Called with the shard
+                path and its manifest entry after the shard has been renamed
+            max_pending (int): Maximum number of queued samples before `write` blocks
+        """
+        self.output_dir = output_dir
+        self.files_per_tar = files_per_tar
+        self.post_shard_callback = post_shard_callback
+        self.manifest = []
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._callback_pool = ThreadPoolExecutor(max_workers=1)
+        self._callback_futures = []
+        self._thread = threading.Thread(target=self._run, name="ShardWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, key: str, members: Union[List[Tuple[str, bytes]], SharedPayload, SpooledPayload]) -> None:
+        """
+        Queue one sample for writing.
+
+        Args:
+            key (str): Sample key
+            members (Union[List[Tuple[str, bytes]], SharedPayload, SpooledPayload]): (member name, data)
+                pairs of the sample, or a shared-memory or spooled payload holding them
+        """
+        if self._error is not None:
+            raise RuntimeError("Shard writer failed") from self._error
+        self._queue.put((key, members))
+
+    def close(self) -> List[dict]:
+        """
+        Flush the remaining samples, wait for the callbacks and write the manifest.
+
+        Returns:
+            List[dict]: Manifest entries of all written shards
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._callback_pool.shutdown(wait=True)
+        if self._error is not None:
+            raise RuntimeError("Shard writer failed") from self._error
+        for future in self._callback_futures:
+            future.result()
+        self._write_manifest()
+        return self.manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Stop the writer without masking the original exception
+            self._queue.put(None)
+            self._thread.join()
+            self._callback_pool.shutdown(wait=True)
+        return False
+
+    def _run(self) -> None:
+        shard = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                key, members = item
+                if shard is None:
+                    shard = self._open_shard(len(self.manifest))
+                self._add_sample(shard, key, members)
+                if shard["samples"] == self.files_per_tar:
+                    self._finish_shard(shard)
+                    shard = None
+            if shard is not None:
+                self._finish_shard(shard)
+        except Exception as e:
+            self._error = e
+            if shard is not None:
+                self._abort_shard(shard)
+            # Keep draining until close() so producers never deadlock
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if isinstance(item[1], (SharedPayload, SpooledPayload)):
+                    item[1].discard()
+
+    def _open_shard(self, shard_idx: int) -> dict:
+        name = f"shard_{shard_idx:05d}.tar"
+        path = os.path.join(self.output_dir, name)
+        fileobj = open(path + ".tmp", "wb")
+        hashing = _HashingWriter(fileobj)
+        tar = tarfile.open(fileobj=hashing, mode="w", copybufsize=self.COPY_BUFSIZE)
+        return {"name": name, "path": path, "file": fileobj, "hashing": hashing, "tar": tar,
+                "samples": 0, "members": 0, "index": {}, "shared": {}}
+
+    def _add_sample(self, shard: dict, key: str, members: Union[List[Tuple[str, bytes]], SharedPayload, SpooledPayload]) -> None:
+        if isinstance(members, (SharedPayload, SpooledPayload)):
+            with members.open() as views:
+                offsets, written = self._add_members(shard, views)
+        else:
+            offsets, written = self._add_members(shard, [(name, memoryview(data)) for name, data in members])
+        shard["index"][key] = offsets
+        shard["samples"] += 1
+        shard["members"] += written
+
+    def _add_members(self, shard: dict, members: List[Tuple[str, memoryview]]) -> Tuple[dict, int]:
+        """
+        Append members to a shard, skipping content-addressed members it already holds.
+
+        Returns:
+            Tuple[dict, int]: Member name -> [data offset, size] in the tar, and the
+                number of members written
+        """
+        tar = shard["tar"]
+        offsets, written = {}, 0
+        for name, view in members:
+            suffix = name.partition(".")[2]
+            shared = suffix.startswith(self.SHARED_PREFIX)
+            if shared and suffix in shard["shared"]:
+                offsets[name] = shard["shared"][suffix]
+                continue
+            info = tarfile.TarInfo(name)
+            info.size = view.nbytes
+            tar.addfile(info, MemoryViewReader(view))
+            # The data ends the member, before padding to the next block; long
+            # names add extended headers in front, so count back from the end
+            blocks = -(-view.nbytes // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            offsets[name] = [tar.offset - blocks, view.nbytes]
+            written += 1
+            if shared:
+                shard["shared"][suffix] = offsets[name]
+        return offsets, written
+
+    def _finish_shard(self, shard: dict) -> None:
+        shard["tar"].close()
+        fileobj = shard["file"]
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+        fileobj.close()
+        index_name = shard["name"][:-len(".tar")] + self.INDEX_SUFFIX
+        index_path = os.path.join(self.output_dir, index_name)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"shard": shard["name"], "samples": shard["index"]}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + ".tmp", index_path)
+        os.replace(shard["path"] + ".tmp", shard["path"])
+        self._fsync_dir()
+        entry = {
+            "shard": shard["name"],
+            "index": index_name,
+            "samples": shard["samples"],
+            "members": shard["members"],
+            "bytes": shard["hashing"].size,
+            "sha256": shard["hashing"].sha256.hexdigest(),
+        }
+        self.manifest.append(entry)
+        if self.post_shard_callback is not None:
+            self._callback_futures.append(
+                self._callback_pool.submit(self.post_shard_callback, shard["path"], entry)
+            )
+
+    def _abort_shard(self, shard: dict) -> None:
+        # Remove the partial shard and index of a failed write
+        try:
+            shard["file"].close()
+        except OSError:
+            pass
+        index_path = os.path.join(self.output_dir, shard["name"][:-len(".tar")] + self.INDEX_SUFFIX)
+        for path in (shard["path"] + ".tmp", index_path + ".tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _fsync_dir(self) -> None:
+        # Persist the rename itself; not supported on every platform
+        try:
+            fd = os.open(self.output_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _write_manifest(self) -> None:
+        path = os.path.join(self.output_dir, self.MANIFEST_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"shards": self.manifest}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,166 @@
+import io
+import os
+import mmap
+import shutil
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Iterator, List, Tuple
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Read-only file object over a memoryview. `read` returns memoryview slices, so
+    `tarfile.addfile` streams the data into the archive without copying it.
+    """
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> memoryview:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        chunk = self._view[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class SharedPayload:
+    """
+    Tar members of one sample stored in a multiprocessing shared-memory block.
+
+    A worker packs its encoded outputs into a pre-sized block and only the block
+    name and member offsets are pickled back to the parent. The parent maps the
+    block, streams the members into the shard from memoryviews and unlinks it,
+    or discards payloads it will not write.
+    """
+    def __init__(self, shm_name: str, members: List[Tuple[str, int, int]]):
+        """
+        Args:
+            shm_name (str): Name of the shared-memory block
+            members (List[Tuple[str, int, int]]): (member name, offset, size) triples
+        """
+        self.shm_name = shm_name
+        self.members = members
+
+    @classmethod
+    def pack(cls, members: List[Tuple[str, bytes]]) -> "SharedPayload":
+        """
+        Copy tar members into a new shared-memory block.
+
+        Args:
+            members (List[Tuple[str, bytes]]): (member name, data) pairs
+
+        Returns:
+            SharedPayload: Handle that can be sent to another process
+        """
+        total = sum(len(data) for _, data in members)
+        # The block stays registered with the resource tracker, which worker
+        # processes share with the parent: `open` and `discard` unregister it when
+        # they unlink it, and a block that never gets there (a failed worker, an
+        # interrupted run) is still unlinked when the parent exits
+        shm = shared_memory.SharedMemory(create=True, size=max(1, total))
+        layout = []
+        offset = 0
+        try:
+            for name, data in members:
+                size = len(data)
+                shm.buf[offset:offset + size] = data
+                layout.append((name, offset, size))
+                offset += size
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        shm.close()
+        return cls(shm.name, layout)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    @contextmanager
+    def open(self) -> Iterator[List[Tuple[str, memoryview]]]:
+        """
+        Map the block and yield (member name, memoryview) pairs. The block is
+        unlinked on exit, so the payload can only be opened once.
+        """
+        shm = shared_memory.SharedMemory(name=self.shm_name)
+        buf = shm.buf
+        views = [(name, buf[offset:offset + size]) for name, offset, size in self.members]
+        try:
+            yield views
+        finally:
+            for _, view in views:
+                view.release()
+            del views, buf
+            shm.close()
+            shm.unlink()
+
+    def discard(self) -> None:
+        """
+        Unlink the block without reading it.
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=self.shm_name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+class SpooledPayload:
+    """
+    Tar members of one sample written to files in a spool directory.
+
+    Used for samples rendered block by block, whose outputs are too long to hold
+    in memory: only the directory and member file names are pickled back to the
+    parent, which memory-maps the files, streams them into the shard and removes
+    the directory.
+    """
+    def __init__(self, directory: str, members: List[Tuple[str, str]]):
+        """
+        Args:
+            directory (str): Spool directory of the sample
+            members (List[Tuple[str, str]]): (member name, file name in `directory`) pairs
+        """
+        self.directory = directory
+        self.members = members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    @contextmanager
+    def open(self) -> Iterator[List[Tuple[str, memoryview]]]:
+        """
+        Map the member files and yield (member name, memoryview) pairs. The spool
+        directory is removed on exit, so the payload can only be opened once.
+        """
+        maps, views = [], []
+        try:
+            for name, file_name in self.members:
+                with open(os.path.join(self.directory, file_name), "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+                if size:
+                    maps.append(data)
+                views.append((name, memoryview(data)))
+            yield views
+        finally:
+            for _, view in views:
+                view.release()
+            del views
+            for data in maps:
+                data.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def discard(self) -> None:
+        """
+        Remove the spool directory without reading it.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,218 @@
+import os
+import json
+import numpy as np
+from typing import Optional, Sequence
+
+# One record per speaker, sorted by speaker id. The utterances of speaker i are
+# the dataset rows rows[start:stop] of the row table, with durations durations[start:stop].
+SPEAKER_DTYPE = np.dtype([
+    ("speaker", "U64"),
+    ("language", "U8"),
+    ("utterances", "<i4"),
+    ("duration", "<f4"),
+    ("start", "<i8"),
+    ("stop", "<i8"),
+])
+
+# Rows of the speech JSON column read per batch while building
+_BUILD_BATCH_ROWS = 10000
+
+# Indexes of datasets without a stats_dir are kept under $DAP_CACHE_DIR/speakers/<fingerprint>
+CACHE_DIR = os.environ.get("DAP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dap"))
+
+
+class SpeakerIndex:
+    """
+    Speaker table of the speech corpus: id, language, utterance count, total
+    duration and the range of the speaker's dataset rows.
+
+    Persisted as `speakers.npy` (SPEAKER_DTYPE), `speaker_rows.npy` (dataset
+    rows grouped by speaker) and `speaker_durations.npy` (their durations) next
+    to `speakers.json`, which records the dataset fingerprint. The tables are
+    opened memory-mapped, so opening the index does not touch the dataset.
+    """
+    META_NAME = "speakers.json"
+    TABLE_NAME = "speakers.npy"
+    ROWS_NAME = "speaker_rows.npy"
+    DURATIONS_NAME = "speaker_durations.npy"
+
+    def __init__(self, table: np.ndarray, rows: np.ndarray, durations: np.ndarray, fingerprint: Optional[str] = None):
+        """
+        Args:
+            table (np.ndarray): Speaker records of SPEAKER_DTYPE, sorted by speaker
+            rows (np.ndarray): Dataset rows grouped by speaker
+            durations (np.ndarray): Duration in seconds of every entry of `rows`
+            fingerprint (str, optional): Fingerprint of the dataset the index was built from
+        """
+        self.table = table
+        self.rows = rows
+        self.durations = durations
+        self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    @classmethod
+    def open(cls, directory: str) -> Optional["SpeakerIndex"]:
+        """
+        Open a persisted index, or return None if the directory has none.
+        """
+        meta_path = os.path.join(directory, cls.META_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(directory, cls.TABLE_NAME), mmap_mode="r"),
+            np.load(os.path.join(directory, cls.ROWS_NAME), mmap_mode="r"),
+            np.load(os.path.join(directory, cls.DURATIONS_NAME), mmap_mode="r"),
+            meta["fingerprint"],
+        )
+
+    @classmethod
+    def from_dataset(cls, dataset) -> "SpeakerIndex":
+        """
+        Scan the JSON column of a speech dataset once and build the index in memory.
+
+        Args:
+            dataset: Speech split with a `json` column holding `speaker` and `duration`
+
+        Returns:
+            SpeakerIndex: The index
+        """
+        speakers, languages, durations = [], {}, []
+        column = dataset.select_columns(["json"]) if hasattr(dataset, "select_columns") else dataset
+        for start in range(0, len(column), _BUILD_BATCH_ROWS):
+            for item in column[start:start + _BUILD_BATCH_ROWS]["json"]:
+                speaker = item["speaker"]
+                speakers.append(speaker)
+                durations.append(item.get("duration", 0.0))
+                if speaker not in languages:
+                    languages[speaker] = str(item.get("language") or speaker.split("_")[0]).upper()
+        ids, inverse, counts = np.unique(np.array(speakers, dtype=str), return_inverse=True, return_counts=True)
+        rows = np.argsort(inverse, kind="stable").astype(np.int64)
+        durations = np.asarray(durations, dtype=np.float32)
+        table = np.zeros(len(ids), dtype=SPEAKER_DTYPE)
+        table["speaker"] = ids
+        table["language"] = [languages[speaker] for speaker in ids]
+        table["utterances"] = counts
+        table["duration"] = np.bincount(inverse, weights=durations.astype(np.float64), minlength=len(ids))
+        table["stop"] = np.cumsum(counts)
+        table["start"] = table["stop"] - counts
+        return cls(table, rows, durations[rows], getattr(dataset, "_fingerprint", None))
+
+    @staticmethod
+    def cache_dir(fingerprint: str) -> str:
+        """
+        Default index directory of a dataset fingerprint.
+        """
+        return os.path.join(CACHE_DIR, "speakers", fingerprint)
+
+    @classmethod
+    def build(cls, dataset, directory: str, force: bool = False) -> "SpeakerIndex":
+        """
+        Open the persisted index of a dataset, building it if it is missing or stale.
+
+        Args:
+            dataset: Speech split with a `json` column
+            directory (str): Index directory
+            force (bool): Rebuild even if the fingerprint is unchanged
+
+        Returns:
+            SpeakerIndex: The opened index
+        """
+        existing = cls.open(directory)
+        if existing is not None and not force and existing.fingerprint == dataset._fingerprint:
+            return existing
+        index = cls.from_dataset(dataset)
+        os.makedirs(directory, exist_ok=True)
+        # Per-process temporary names: workers without a shared index may build it at the same time
+        tmp = f".{os.getpid()}.tmp"
+        for name, array in ((cls.TABLE_NAME, index.table), (cls.ROWS_NAME, index.rows), (cls.DURATIONS_NAME, index.durations)):
+            path = os.path.join(directory, name)
+            with open(path + tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(path + tmp, path)
+        meta_path = os.path.join(directory, cls.META_NAME)
+        with open(meta_path + tmp, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": index.fingerprint, "speakers": len(index), "rows": len(index.rows)}, f, indent=2)
+        os.replace(meta_path + tmp, meta_path)
+        return cls.open(directory)
+
+    def find(self, speaker: str) -> int:
+        """
+        Position of a speaker id in the table.
+        """
+        pos = int(np.searchsorted(self.table["speaker"], speaker))
+        if pos >= len(self.table) or self.table["speaker"][pos] != speaker:
+            raise KeyError(speaker)
+        return pos
+
+    def speaker_rows(self, speaker: str) -> np.ndarray:
+        """
+        Dataset rows of a speaker's utterances, in dataset order.
+        """
+        record = self.table[self.find(speaker)]
+        return self.rows[record["start"]:record["stop"]]
+
+    def speaker_durations(self, speaker: str) -> np.ndarray:
+        """
+        Durations in seconds of a speaker's utterances, aligned with `speaker_rows`.
+        """
+        record = self.table[self.find(speaker)]
+        return self.durations[record["start"]:record["stop"]]
+
+    def candidates(
+        self,
+        languages: Optional[Sequence[str]] = None,
+        min_utterances: int = 0,
+        min_duration: float = 0.0,
+    ) -> np.ndarray:
+        """
+        Table positions of the speakers that pass all filters.
+
+        Args:
+            languages (Sequence[str], optional): Allowed languages
+            min_utterances (int): Smallest number of utterances
+            min_duration (float): Smallest total duration in seconds
+
+        Returns:
+            np.ndarray: Positions into the table
+        """
+        mask = (self.table["utterances"] >= min_utterances) & (self.table["duration"] >= min_duration)
+        if languages:
+            mask &= np.isin(self.table["language"], [language.upper() for language in languages])
+        return np.flatnonzero(mask)
+
+    def sample(
+        self,
+        num_speakers: int,
+        languages: Optional[Sequence[str]] = None,
+        min_utterances: int = 0,
+        min_duration: float = 0.0,
+        weight: Optional[str] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        """
+        Draw distinct speakers, optionally filtered and weighted.
+
+        Args:
+            num_speakers (int): Number of speakers; fewer if fewer qualify
+            languages (Sequence[str], optional): Allowed languages
+            min_utterances (int): Smallest number of utterances
+            min_duration (float): Smallest total duration in seconds
+            weight (str, optional): "utterances" or "duration" to sample proportionally,
+                uniform if not given
+            rng (np.random.Generator, optional): Random generator; the global one if not given
+
+        Returns:
+            np.ndarray: Positions into the table
+        """
+        rng = np.random if rng is None else rng
+        candidates = self.candidates(languages, min_utterances, min_duration)
+        p = None
+        if weight is not None:
+            p = np.asarray(self.table[weight][candidates], dtype=np.float64)
+            candidates, p = candidates[p > 0], p[p > 0]
+            p = p / p.sum()
+        return rng.choice(candidates, size=min(num_speakers, len(candidates)), replace=False, p=p)
@@ -0,0 +1,152 @@
+import numpy as np
+import soundfile as sf
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# (start sample, length in samples, stem index or None for the mix only, load).
+# `load` returns the float32 audio of the clip at the output sample rate.
+ScheduledClip = Tuple[int, int, Optional[int], Callable[[], np.ndarray]]
+
+# soundfile (format, subtype) of every compressed output format
+_SOUNDFILE_FORMATS = {
+    "flac": ("FLAC", "PCM_16"),
+    "mp3": ("MP3", "MPEG_LAYER_III"),
+}
+
+
+def pcm16(audio: np.ndarray) -> np.ndarray:
+    """
+    Convert a float signal to little-endian int16, clipping it to [-1, 1].
+    """
+    return (np.clip(audio, -1.0, 1.0) * np.iinfo(np.int16).max).astype("<i2")
+
+
+class StreamEncoder:
+    """
+    Encodes a mono float signal into a file block by block.
+
+    "pcm" writes raw little-endian int16; "flac" and "mp3" go through libsndfile,
+    which needs version 1.1 or later for mp3 (see `supports`).
+    """
+    def __init__(self, path: str, output_format: str, sample_rate: int):
+        """
+        Args:
+            path (str): Output file
+            output_format (str): "pcm", "flac" or "mp3"
+            sample_rate (int): Sample rate of the signal
+        """
+        self.output_format = output_format
+        if output_format == "pcm":
+            self._file = open(path, "wb")
+        else:
+            container, subtype = _SOUNDFILE_FORMATS[output_format]
+            self._file = sf.SoundFile(path, "w", samplerate=sample_rate, channels=1, format=container, subtype=subtype)
+
+    @staticmethod
+    def supports(output_format: str) -> bool:
+        if output_format == "pcm":
+            return True
+        return output_format in _SOUNDFILE_FORMATS and _SOUNDFILE_FORMATS[output_format][0] in sf.available_formats()
+
+    def write(self, block: np.ndarray) -> None:
+        if len(block) == 0:
+            return
+        if self.output_format == "pcm":
+            self._file.write(pcm16(block).tobytes())
+        else:
+            self._file.write(pcm16(block))
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class StreamingRenderer:
+    """
+    Renders the stems and mix of a conversation in fixed-size blocks.
+
+    Speech and effects are scheduled as clips by sample offset. A clip is loaded
+    when the first block it overlaps is rendered and released after the last
+    one, so only the clips sounding in the current block are held, together with
+    one (num_stems, block_size) stem buffer and one mix buffer. Every block is
+    summed like the in-memory render: stems per speaker, the mix as the sum of
+    the stems, then the background (music), then the mix-only clips.
+    """
+    def __init__(self, block_size: int = 1 << 16):
+        """
+        Args:
+            block_size (int): Samples per block
+        """
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        self.block_size = block_size
+
+    def render(
+        self,
+        clips: List[ScheduledClip],
+        num_stems: int,
+        length: int,
+        background: Optional[Callable[[int, int], np.ndarray]] = None,
+    ) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Render the blocks of a conversation.
+
+        Every clip is loaded exactly once, including clips that fall outside
+        `length` and so never sound; a clip longer than its scheduled length is
+        cut, a shorter one ends early.
+
+        Args:
+            clips (List[ScheduledClip]): (start, length, stem, load) of every clip,
+                summed in list order within a block
+            num_stems (int): Number of stems
+            length (int): Length of the conversation in samples
+            background (Callable[[int, int], np.ndarray], optional): Returns samples
+                [start, stop) of a bed added to the mix, e.g. looped music
+
+        Returns:
+            Iterator[Tuple[int, np.ndarray, np.ndarray]]: (start sample, stems
+                (num_stems, n), mix (n,)) per block. The arrays are reused by the
+                next block, so consume them before advancing.
+        """
+        order = sorted(range(len(clips)), key=lambda idx: clips[idx][0])
+        stems = np.zeros((num_stems, self.block_size), dtype=np.float32)
+        mix = np.zeros(self.block_size, dtype=np.float32)
+        active = {}
+        pending = 0
+        for start in range(0, length, self.block_size):
+            stop = min(start + self.block_size, length)
+            n = stop - start
+            while pending < len(order) and clips[order[pending]][0] < stop:
+                idx = order[pending]
+                active[idx] = np.asarray(clips[idx][3](), dtype=np.float32)
+                pending += 1
+            stems[:, :n] = 0.0
+            for idx in sorted(active):
+                clip_start, clip_length, stem, _ = clips[idx]
+                if stem is not None:
+                    self._add(stems[stem, :n], start, stop, clip_start, clip_length, active[idx])
+            np.sum(stems[:, :n], axis=0, out=mix[:n])
+            if background is not None:
+                mix[:n] += background(start, stop)
+            for idx in sorted(active):
+                clip_start, clip_length, stem, _ = clips[idx]
+                if stem is None:
+                    self._add(mix[:n], start, stop, clip_start, clip_length, active[idx])
+            for idx in [idx for idx in active if clips[idx][0] + clips[idx][1] <= stop]:
+                del active[idx]
+            yield start, stems[:, :n], mix[:n]
+        # Clips past the end still have their side effects, e.g. writing a segment member
+        for idx in order[pending:]:
+            clips[idx][3]()
+
+    @staticmethod
+    def _add(out: np.ndarray, start: int, stop: int, clip_start: int, clip_length: int, audio: np.ndarray) -> None:
+        lo = max(start, clip_start)
+        hi = min(stop, clip_start + min(clip_length, len(audio)))
+        if hi > lo:
+            out[lo - start:hi - start] += audio[lo - clip_start:hi - clip_start]
@@ -0,0 +1,287 @@
+import io
+import os
+import json
+import glob
+import hashlib
+import threading
+import numpy as np
+import soundfile as sf
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
+from tqdm import tqdm
+
+# One record per utterance, in tar order and member order within each tar.
+# Offsets point at the member data, so reading an utterance is one positioned
+# read per member. `build` widens the key field to the longest key of the tars.
+TAR_MEMBER_DTYPE = np.dtype([
+    ("key", "S64"),
+    ("tar", "<i4"),
+    ("audio_offset", "<i8"),
+    ("audio_size", "<i8"),
+    ("json_offset", "<i8"),
+    ("json_size", "<i8"),
+    ("format", "S8"),
+    ("speaker", "<i4"),
+    ("language", "S8"),
+    ("duration", "<f4"),
+])
+
+AUDIO_EXTENSIONS = ("mp3", "flac", "wav", "ogg", "opus")
+
+
+def _split_member(name: str):
+    # WebDataset convention: the key is the path up to the first dot of the file name
+    directory, base = os.path.split(name)
+    stem, _, ext = base.partition(".")
+    return os.path.join(directory, stem) if directory else stem, ext.lower()
+
+
+def _scan_tar(tar_id: int, path: str) -> tuple:
+    """
+    Read the member headers of one tar in a single sequential pass.
+
+    Only the small JSON members are read; audio members are skipped by seeking
+    over their data.
+
+    Returns:
+        Tuple[int, List[tuple], int]: Tar id, one (key, audio_offset, audio_size,
+            json_offset, json_size, format, meta) tuple per utterance, and the
+            number of incomplete samples that were skipped
+    """
+    import tarfile
+    audio, meta = {}, {}
+    order = []
+    with tarfile.open(path, "r:") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, ext = _split_member(member.name)
+            if ext == "json":
+                meta[key] = (member.offset_data, member.size, json.loads(tar.extractfile(member).read()))
+            elif ext in AUDIO_EXTENSIONS:
+                audio[key] = (member.offset_data, member.size, ext)
+            else:
+                continue
+            if key not in audio or key not in meta:
+                order.append(key)
+    records = [
+        (key, audio[key][0], audio[key][1], meta[key][0], meta[key][1], audio[key][2], meta[key][2])
+        for key in order if key in audio and key in meta
+    ]
+    return tar_id, records, len(order) - len(records)
+
+
+class TarSpeechDataset:
+    """
+    Speech corpus read straight from WebDataset tar shards, such as the Emilia release.
+
+    `build` indexes the byte offset and size of every member once; rows are then
+    read with positioned reads from the original tars.
+    """
+    META_NAME = "tar_index.json"
+    TABLE_NAME = "tar_members.npy"
+    SPEAKERS_NAME = "tar_speakers.npy"
+
+    def __init__(self, root: str, index_dir: str, tars: List[str], table: np.ndarray, speakers: np.ndarray, fingerprint: str):
+        """
+        Args:
+            root (str): Directory holding the tars
+            index_dir (str): Directory of the persisted index
+            tars (List[str]): Tar paths relative to `root`, indexed by the `tar` field
+            table (np.ndarray): Member records of TAR_MEMBER_DTYPE
+            speakers (np.ndarray): Speaker ids, indexed by the `speaker` field
+            fingerprint (str): Fingerprint of the tars
+        """
+        self.root = root
+        self.index_dir = index_dir
+        self.tars = tars
+        self.table = table
+        self.speakers = speakers
+        self._fingerprint = fingerprint
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    @staticmethod
+    def find_tars(root: str) -> List[str]:
+        """
+        Tar files below a directory, relative to it and sorted.
+        """
+        return sorted(os.path.relpath(path, root) for path in glob.glob(os.path.join(root, "**", "*.tar"), recursive=True))
+
+    @classmethod
+    def is_tar_source(cls, root: Optional[str]) -> bool:
+        return root is not None and os.path.isdir(root) and bool(cls.find_tars(root))
+
+    @staticmethod
+    def fingerprint_tars(root: str, tars: List[str]) -> str:
+        digest = hashlib.sha1()
+        for tar in tars:
+            stat = os.stat(os.path.join(root, tar))
+            digest.update(f"{tar}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    @classmethod
+    def open(cls, root: str, index_dir: Optional[str] = None) -> Optional["TarSpeechDataset"]:
+        """
+        Open the persisted index of a tar directory, or return None if there is none.
+        """
+        index_dir = index_dir or root
+        meta_path = os.path.join(index_dir, cls.META_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            root,
+            index_dir,
+            meta["tars"],
+            np.load(os.path.join(index_dir, cls.TABLE_NAME), mmap_mode="r"),
+            np.load(os.path.join(index_dir, cls.SPEAKERS_NAME)),
+            meta["fingerprint"],
+        )
+
+    @classmethod
+    def build(cls, root: str, index_dir: Optional[str] = None, num_workers: int = 8, force: bool = False) -> "TarSpeechDataset":
+        """
+        Open the index of a tar directory, building it if it is missing or stale.
+
+        Args:
+            root (str): Directory holding the tars, searched recursively
+            index_dir (str, optional): Index directory; `root` if not given
+            num_workers (int): Number of tars indexed in parallel
+            force (bool): Rebuild even if the tars did not change
+
+        Returns:
+            TarSpeechDataset: The opened dataset
+        """
+        index_dir = index_dir or root
+        tars = cls.find_tars(root)
+        fingerprint = cls.fingerprint_tars(root, tars)
+        existing = cls.open(root, index_dir)
+        if existing is not None and not force and existing._fingerprint == fingerprint:
+            return existing
+
+        scanned, skipped = [None] * len(tars), 0
+        with ProcessPoolExecutor(max_workers=max(1, min(num_workers, len(tars)))) as executor:
+            futures = [executor.submit(_scan_tar, tar_id, os.path.join(root, tar)) for tar_id, tar in enumerate(tars)]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Indexing tars"):
+                tar_id, records, incomplete = future.result()
+                scanned[tar_id] = records
+                skipped += incomplete
+        if skipped:
+            print(f"Skipped {skipped} samples without both an audio and a JSON member")
+
+        speaker_ids = [str(meta.get("speaker", "")) for records in scanned for *_, meta in records]
+        speakers, speaker_codes = np.unique(np.array(speaker_ids, dtype=str), return_inverse=True)
+        # Fixed-width keys would silently truncate longer ones into collisions
+        key_size = max((len(record[0].encode("utf-8")) for records in scanned for record in records), default=1)
+        dtype = np.dtype([("key", f"S{max(key_size, TAR_MEMBER_DTYPE['key'].itemsize)}")] + TAR_MEMBER_DTYPE.descr[1:])
+        table = np.zeros(len(speaker_ids), dtype=dtype)
+        pos = 0
+        for tar_id, records in enumerate(scanned):
+            for key, audio_offset, audio_size, json_offset, json_size, ext, meta in records:
+                speaker = speaker_ids[pos]
+                table[pos] = (
+                    key.encode("utf-8"), tar_id, audio_offset, audio_size, json_offset, json_size, ext.encode("ascii"),
+                    speaker_codes[pos], str(meta.get("language") or speaker.split("_")[0]).upper().encode("utf-8"),
+                    meta.get("duration", 0.0),
+                )
+                pos += 1
+
+        os.makedirs(index_dir, exist_ok=True)
+        for name, array in ((cls.TABLE_NAME, table), (cls.SPEAKERS_NAME, speakers)):
+            path = os.path.join(index_dir, name)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        meta_path = os.path.join(index_dir, cls.META_NAME)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "tars": tars, "rows": len(table), "speakers": len(speakers)}, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+        return cls.open(root, index_dir)
+
+    def _read(self, tar_id: int, offset: int, size: int) -> bytes:
+        # Positioned reads share one descriptor per tar between decode threads
+        fd = self._files.get(tar_id)
+        if fd is None:
+            with self._lock:
+                fd = self._files.get(tar_id)
+                if fd is None:
+                    fd = self._files[tar_id] = os.open(os.path.join(self.root, self.tars[tar_id]), os.O_RDONLY)
+        return os.pread(fd, int(size), int(offset))
+
+    def _row(self, index: int) -> dict:
+        record = self.table[index]
+        key = record["key"].decode("utf-8")
+        ext = record["format"].decode("ascii")
+        tar_id = int(record["tar"])
+        audio, sr = sf.read(io.BytesIO(self._read(tar_id, record["audio_offset"], record["audio_size"])), dtype="float32")
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        return {
+            "__key__": key,
+            "__url__": os.path.join(self.root, self.tars[tar_id]),
+            "json": json.loads(self._read(tar_id, record["json_offset"], record["json_size"])),
+            ext: {"path": f"{key}.{ext}", "array": audio, "sampling_rate": sr},
+        }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rows = [self._row(i) for i in range(*index.indices(len(self)))]
+            return {column: [row.get(column) for row in rows] for column in (rows[0] if rows else {})}
+        if index < 0:
+            index += len(self)
+        return self._row(int(index))
+
+    def select_columns(self, columns: List[str]) -> "_TarMetadataView":
+        if list(columns) != ["json"]:
+            raise ValueError("TarSpeechDataset only selects the indexed json column")
+        return _TarMetadataView(self)
+
+    def close(self) -> None:
+        with self._lock:
+            for fd in self._files.values():
+                os.close(fd)
+            self._files = {}
+
+    def __getstate__(self):
+        # Descriptors are per process; the table is re-mapped on unpickling
+        state = self.__dict__.copy()
+        state["_files"] = {}
+        state["_lock"] = None
+        state["table"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self.table is None:
+            self.table = TarSpeechDataset.open(self.root, self.index_dir).table
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class _TarMetadataView:
+    """
+    `json` column of a TarSpeechDataset served from the member table.
+    """
+    def __init__(self, dataset: TarSpeechDataset):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: slice) -> dict:
+        records = self.dataset.table[index]
+        speakers = self.dataset.speakers[records["speaker"]]
+        return {"json": [
+            {"speaker": str(speaker), "language": language.decode("utf-8"), "duration": float(duration)}
+            for speaker, language, duration in zip(speakers, records["language"], records["duration"])
+        ]}
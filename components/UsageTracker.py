@@ -0,0 +1,259 @@
+import os
+import json
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; increments are then only locked within a process
+    fcntl = None
+
+# Uses per utterance saturate at the top of the counter type
+USAGE_DTYPE = np.uint16
+
+
+class UsageTracker:
+    """
+    Number of times every utterance of the speech corpus was placed, kept in a
+    memory-mapped `.npy` file shared by all worker processes of a run.
+
+    A `share` of the tracker plans one of several chunks that run at the same
+    time: it keeps its placements to itself, so its plans depend only on the
+    counts of the file when the chunks started.
+    """
+    FILE_NAME = "usage.npy"
+    REPORT_NAME = "coverage.json"
+
+    def __init__(self, path: str, max_reuse: Optional[int] = None):
+        """
+        Open the counters of an existing usage file.
+
+        Args:
+            path (str): `.npy` file written by `create`
+            max_reuse (int, optional): Uses after which an utterance is no longer planned
+        """
+        if max_reuse is not None and max_reuse < 1:
+            raise ValueError("max_reuse must be at least 1")
+        self.path = path
+        self.max_reuse = max_reuse
+        self._counts = None
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+        # Slot and number of slots of a share, and the uses it placed
+        self._slot = None
+        self._num_slots = None
+        self._placed = None
+
+    @classmethod
+    def create(cls, path: str, num_rows: int, max_reuse: Optional[int] = None) -> "UsageTracker":
+        """
+        Create a usage file with every count at zero, replacing an existing one.
+
+        Args:
+            path (str): `.npy` file
+            num_rows (int): Number of rows of the speech dataset
+            max_reuse (int, optional): Uses after which an utterance is no longer planned
+
+        Returns:
+            UsageTracker: Tracker of the new file
+        """
+        counts = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=USAGE_DTYPE, shape=(num_rows,))
+        counts.flush()
+        del counts
+        os.replace(path + ".tmp", path)
+        return cls(path, max_reuse)
+
+    def __getstate__(self):
+        # Workers reopen the file instead of receiving a copy of the counts
+        state = self.__dict__.copy()
+        state["_counts"] = None
+        state["_lock"] = None
+        state["_depth"] = 0
+        state["_lock_file"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Uses per dataset row, memory-mapped; do not modify, use `record`.
+        """
+        if self._counts is None:
+            self._counts = np.load(self.path, mmap_mode="r+")
+        return self._counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def share(self, slot: int, num_slots: int) -> "UsageTracker":
+        """
+        Tracker of one of `num_slots` chunks planned against the current counts.
+
+        The share sees the counts of the file plus its own uses; `record` keeps
+        them in `placed` instead of writing the file, which the caller does once
+        every chunk is planned. The uses left to an utterance under `max_reuse`
+        are dealt over the slots, so together the shares never exceed it.
+
+        Args:
+            slot (int): Slot of the chunk, from 0
+            num_slots (int): Number of chunks sharing the counts
+
+        Returns:
+            UsageTracker: Tracker of the slot
+        """
+        if not 0 <= slot < num_slots:
+            raise ValueError(f"slot must be in [0, {num_slots}), got {slot}")
+        share = UsageTracker(self.path, self.max_reuse)
+        share._slot, share._num_slots = slot, num_slots
+        share._placed = np.zeros(len(self), dtype=USAGE_DTYPE)
+        return share
+
+    @property
+    def placed(self) -> np.ndarray:
+        """
+        Dataset row of every use recorded by a share, for `record` on the shared tracker.
+        """
+        if self._placed is None:
+            raise ValueError("Only a share keeps its placed uses")
+        return np.repeat(np.arange(len(self._placed), dtype=np.int64), self._placed)
+
+    def uses(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Uses of the given dataset rows.
+        """
+        uses = np.asarray(self.counts[rows])
+        if self._placed is not None:
+            uses = uses.astype(np.int64) + self._placed[rows]
+        return uses
+
+    def available(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Mask of the given dataset rows that may still be placed under `max_reuse`.
+        """
+        if self.max_reuse is None:
+            return np.ones(len(rows), dtype=bool)
+        if self._placed is None:
+            return self.uses(rows) < self.max_reuse
+        left = np.maximum(self.max_reuse - np.asarray(self.counts[rows], dtype=np.int64), 0)
+        quota = left // self._num_slots + (self._slot < left % self._num_slots)
+        return self._placed[rows] < quota
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the usage file exclusively, against other threads and processes; re-entrant.
+        A share, which does not write the file, only locks out other threads.
+        """
+        with self._lock:
+            self._depth += 1
+            try:
+                if self._depth == 1 and fcntl is not None and self._placed is None:
+                    self._lock_file = open(self.path, "rb")
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                yield self
+            finally:
+                if self._depth == 1 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+                self._depth -= 1
+
+    def record(self, rows: Sequence[int]) -> None:
+        """
+        Count one use of every given dataset row; a share only adds it to `placed`.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        if self._placed is not None:
+            with self._lock:
+                self._increment(self._placed, rows)
+            return
+        with self.locked():
+            self._increment(self.counts, rows)
+
+    @staticmethod
+    def _increment(counts: np.ndarray, rows: np.ndarray) -> None:
+        rows, added = np.unique(rows, return_counts=True)
+        top = np.iinfo(USAGE_DTYPE).max
+        counts[rows] = np.minimum(counts[rows].astype(np.int64) + added, top)
+
+    def report(self, index) -> dict:
+        """
+        Corpus coverage of the recorded uses.
+
+        Args:
+            index (SpeakerIndex): Speaker table of the speech corpus
+
+        Returns:
+            dict: `utterances`, `used_utterances`, `coverage` (share of utterances
+                used), `hours`, `used_hours`, `duration_coverage`, `speakers`,
+                `used_speakers`, `placements`, `max_uses`, `max_reuse`, `uses`
+                (number of utterances per use count) and per language
+                `languages` with the same utterance and duration figures
+        """
+        # Grouped by speaker like the index, so durations and languages line up
+        counts = np.asarray(self.counts)[np.asarray(index.rows)].astype(np.int64)
+        durations = np.asarray(index.durations, dtype=np.float64)
+        used = counts > 0
+        table = index.table
+        languages = np.repeat(table["language"], table["utterances"])
+        speaker_used = np.add.reduceat(used, table["start"]) > 0 if len(table) else np.zeros(0, dtype=bool)
+
+        def summary(mask):
+            total, covered = float(durations[mask].sum()), float(durations[mask & used].sum())
+            return {
+                "utterances": int(mask.sum()),
+                "used_utterances": int((mask & used).sum()),
+                "coverage": float((mask & used).sum() / max(mask.sum(), 1)),
+                "hours": total / 3600,
+                "used_hours": covered / 3600,
+                "duration_coverage": covered / total if total > 0 else 0.0,
+            }
+
+        histogram = np.bincount(counts) if len(counts) else np.zeros(1, dtype=np.int64)
+        return {
+            **summary(np.ones(len(counts), dtype=bool)),
+            "speakers": len(table),
+            "used_speakers": int(speaker_used.sum()),
+            "placements": int(counts.sum()),
+            "max_uses": int(counts.max()) if len(counts) else 0,
+            "max_reuse": self.max_reuse,
+            "uses": {str(uses): int(n) for uses, n in enumerate(histogram) if n},
+            "languages": {str(language): summary(languages == language) for language in np.unique(languages)},
+        }
+
+    def write_report(self, index, directory: str) -> dict:
+        """
+        Write `report` as `coverage.json` into a directory.
+
+        Returns:
+            dict: The report
+        """
+        report = self.report(index)
+        path = os.path.join(directory, self.REPORT_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return report
+
+
+def format_coverage(report: dict) -> str:
+    """
+    Human-readable summary of a `UsageTracker.report`.
+    """
+    lines = [
+        f"utterances: {report['used_utterances']} of {report['utterances']} used ({report['coverage']:.1%}), "
+        f"{report['placements']} placements, at most {report['max_uses']} per utterance",
+        f"speech:     {report['used_hours']:.2f} of {report['hours']:.2f} hours ({report['duration_coverage']:.1%})",
+        f"speakers:   {report['used_speakers']} of {report['speakers']}",
+    ]
+    for language, summary in report["languages"].items():
+        lines.append(f"  {language:<8} {summary['coverage']:6.1%} of utterances, {summary['duration_coverage']:6.1%} of speech")
+    return "\n".join(lines)
@@ -0,0 +1,237 @@
+"""
+`dap` command line interface.
+
+Only the standard library is imported at module level; every subcommand
+imports the components it needs, so `dap --help` and light subcommands start
+without loading numpy codecs, scipy or the datasets library.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+
+def _add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--config", default=None, help="Pipeline config (JSON or YAML)")
+    parser.add_argument("--n_samples", type=int, default=None, help="Override output.n_samples")
+    parser.add_argument("--output_dir", default=None, help="Override output.dir")
+    parser.add_argument("--num_processors", type=int, default=None, help="Override resources.num_processors")
+    parser.add_argument("--seed", type=int, default=None, help="Override seed")
+
+
+def _load_config(args) -> dict:
+    from components.PipelineConfig import load_config
+    overrides = {}
+    if args.n_samples is not None:
+        overrides.setdefault("output", {})["n_samples"] = args.n_samples
+    if args.output_dir is not None:
+        overrides.setdefault("output", {})["dir"] = args.output_dir
+    if args.num_processors is not None:
+        overrides.setdefault("resources", {})["num_processors"] = args.num_processors
+    if args.seed is not None:
+        overrides["seed"] = args.seed
+    return load_config(args.config, overrides)
+
+
+def index(args) -> None:
+    """
+    Build the speaker table and the clip statistics index of the configured sources,
+    and the member index of speech tars read in place.
+    """
+    from components.ClipStats import ClipStatsIndex
+    from components.PipelineConfig import build_dataloader
+    from components.SpeakerIndex import SpeakerIndex
+    config = _load_config(args)
+    stats_dir = args.stats_dir or config["sources"]["stats_dir"]
+    if stats_dir is None:
+        raise SystemExit("dap index: set sources.stats_dir in the config or pass --stats_dir")
+    config["sources"]["stats_dir"] = stats_dir
+    dataloader = build_dataloader(config, open_indexes=False)
+    speakers = SpeakerIndex.build(dataloader.get_dataset("speech"), stats_dir, force=args.force)
+    print(f"speakers: {len(speakers)} speakers, {len(speakers.rows)} utterances")
+    built = ClipStatsIndex.build(
+        dataloader,
+        stats_dir,
+        corpora=args.corpora,
+        num_workers=config["resources"]["num_processors"],
+        chunk_size=args.chunk_size,
+        top_db=args.top_db,
+        force=args.force,
+    )
+    for corpus in args.corpora:
+        print(f"{corpus}: {built.meta[corpus]['rows']} rows")
+
+
+def plan(args) -> None:
+    """
+    Print the resolved config and how the samples are split into tasks and shards.
+    """
+    from components.DataGen import DataGen
+    config = _load_config(args)
+    output, resources = config["output"], config["resources"]
+    chunks = DataGen.plan_chunks(output["n_samples"], output["files_per_tar"], resources["num_processors"])
+    print(json.dumps(config, indent=2))
+    print(f"samples: {output['n_samples']}")
+    print(f"shards:  {-(-output['n_samples'] // output['files_per_tar'])} of up to {output['files_per_tar']} samples")
+    print(f"tasks:   {len(chunks)} of up to {len(chunks[0]) if chunks else 0} samples on {resources['num_processors']} workers")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        print(f"Resolved config written to {args.save}")
+
+
+def render(args) -> None:
+    """
+    Generate the configured dataset.
+    """
+    from components.DataGen import DataGen
+    from components.PipelineConfig import build_dataloader
+    from components.ShardWriter import move_shard_to
+    from components.UsageTracker import format_coverage
+    config = _load_config(args)
+    move_shards_to = config["output"]["move_shards_to"]
+    generator = DataGen.from_config(
+        config,
+        build_dataloader(config),
+        post_shard_callback=move_shard_to(move_shards_to) if move_shards_to else None,
+    )
+    coverage = generator.generate_data()
+    print("Corpus coverage:")
+    print(format_coverage(coverage))
+
+
+def inspect(args) -> None:
+    """
+    Summarize an output directory (manifest) or list the samples of one shard.
+    """
+    path = args.path
+    if os.path.isdir(path):
+        from components.ShardWriter import ShardWriter
+        with open(os.path.join(path, ShardWriter.MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        shards = manifest["shards"]
+        print(f"{len(shards)} shards, {sum(s['samples'] for s in shards)} samples, "
+              f"{sum(s['bytes'] for s in shards) / 1e6:.1f} MB")
+        for shard in shards:
+            print(f"  {shard['shard']}  {shard['samples']:>6} samples  {shard['bytes'] / 1e6:>9.1f} MB  {shard['sha256'][:12]}")
+        from components.UsageTracker import UsageTracker, format_coverage
+        coverage_path = os.path.join(path, UsageTracker.REPORT_NAME)
+        if os.path.exists(coverage_path):
+            with open(coverage_path, "r", encoding="utf-8") as f:
+                print(format_coverage(json.load(f)))
+        return
+    from components.ShardReader import ShardReader
+    with ShardReader(path) as reader:
+        if args.key is None:
+            for key, members in reader.index.items():
+                print(f"{key}  {len(members):>3} members  {sum(size for _, size in members.values()) / 1e3:>10.1f} kB")
+            return
+        if args.key not in reader:
+            raise SystemExit(f"dap inspect: no sample {args.key} in {path}")
+        for name, (offset, size) in reader.index[args.key].items():
+            print(f"{name}  {size} bytes at {offset}")
+        if f"{args.key}.json" in reader.index[args.key]:
+            print(json.dumps(reader.json(args.key), indent=2, ensure_ascii=False))
+
+
+def validate(args) -> None:
+    """
+    Verify the shards of an output directory against the manifest and summarize them.
+    """
+    from components.ShardValidator import format_report, validate_directory
+    report = validate_directory(args.path, args.shard_dir, num_workers=args.num_processors, check_audio=args.audio)
+    print(format_report(report))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Report written to {args.report}")
+    if report["errors"]:
+        raise SystemExit(1)
+
+
+def bench(args) -> None:
+    """
+    Render samples in this process and report decode and render time per sample.
+    """
+    from components.DataGen import DataGen
+    from components.DecodeCache import decode_cache
+    from components.PipelineConfig import build_dataloader
+    config = _load_config(args)
+    start = time.perf_counter()
+    generator = DataGen.from_config(config, build_dataloader(config))
+    decode_cache(generator.decode_cache_bytes)
+    setup = time.perf_counter() - start
+    fetch_times, render_times = [], []
+    for i in range(1, args.samples + 1):
+        start = time.perf_counter()
+        if generator.renderer is not None:
+            fetched = generator._fetch_stream_sample(i)
+            fetch_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            generator._stream_sample(i, fetched)[1].discard()
+        else:
+            fetched = generator._fetch_sample(i)
+            fetch_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            generator._render_sample(i, fetched)
+        render_times.append(time.perf_counter() - start)
+    total = sum(fetch_times) + sum(render_times)
+    print(f"setup:  {setup * 1e3:.0f} ms")
+    print(f"decode: {1e3 * sum(fetch_times) / len(fetch_times):.0f} ms/sample")
+    print(f"render: {1e3 * sum(render_times) / len(render_times):.0f} ms/sample")
+    print(f"total:  {args.samples / total:.2f} samples/s on one process")
+    metrics = decode_cache().metrics()
+    print(f"cache:  {metrics['bytes'] / 1e6:.0f} of {metrics['max_bytes'] / 1e6:.0f} MB, "
+          f"{metrics['entries']} clips, {metrics['evictions']} evictions")
+    for corpus, counts in metrics["corpora"].items():
+        print(f"  {corpus:<6} {counts['hit_rate']:6.1%} hits ({counts['hits']} of {counts['hits'] + counts['misses']})")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="dap", description="Synthetic speaker diarization data pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("index", help="Build the speaker table, clip statistics and tar indexes")
+    _add_config_arguments(sub)
+    sub.add_argument("--stats_dir", default=None, help="Override sources.stats_dir")
+    sub.add_argument("--corpora", nargs="+", default=["speech", "music", "sfx"],
+                     choices=["speech", "music", "sfx"], help="Corpora to index")
+    sub.add_argument("--chunk_size", type=int, default=256, help="Number of rows per task")
+    sub.add_argument("--top_db", type=float, default=30.0, help="Silence threshold below the loudest frame in dB")
+    sub.add_argument("--force", action="store_true", help="Rebuild tables even if the datasets did not change")
+    sub.set_defaults(func=index)
+
+    sub = subparsers.add_parser("plan", help="Show the resolved config and work split")
+    _add_config_arguments(sub)
+    sub.add_argument("--save", default=None, help="Write the resolved config to this file")
+    sub.set_defaults(func=plan)
+
+    sub = subparsers.add_parser("render", help="Generate the dataset")
+    _add_config_arguments(sub)
+    sub.set_defaults(func=render)
+
+    sub = subparsers.add_parser("inspect", help="Summarize an output directory or a shard")
+    sub.add_argument("path", help="Output directory with manifest.json, or a shard tar")
+    sub.add_argument("--key", default=None, help="Show the members and metadata of one sample")
+    sub.set_defaults(func=inspect)
+
+    sub = subparsers.add_parser("validate", help="Check shards against the manifest and report dataset statistics")
+    sub.add_argument("path", help="Output directory with manifest.json")
+    sub.add_argument("--shard_dir", default=None, help="Directory holding the shards if they were moved")
+    sub.add_argument("--num_processors", type=int, default=8, help="Number of shards validated in parallel")
+    sub.add_argument("--audio", action="store_true", help="Also decode every mix and check its length and level")
+    sub.add_argument("--report", default=None, help="Write the full report with histograms to this JSON file")
+    sub.set_defaults(func=validate)
+
+    sub = subparsers.add_parser("bench", help="Time decoding and rendering in one process")
+    _add_config_arguments(sub)
+    sub.add_argument("--samples", type=int, default=8, help="Number of samples to render")
+    sub.set_defaults(func=bench)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
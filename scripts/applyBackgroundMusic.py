@@ -1,52 +1,47 @@
 import os
+import argparse
 import librosa
 import soundfile as sf
-import numpy as np
-import librosa
-import random
-from typing import Tuple, List, Optional, Dict
-import os
 from components.MusicHandler import MusicHandler
+from components.PipelineConfig import build_dataloader, load_config
 
 def main():
-    # Configuration
-    SAMPLE_RATE = 48000
-    CROSSFADE_DURATION = 2.0  # seconds
-    MUSIC_VOLUME = 0.8  # 80% of original volume
-    
-    # Paths
-    input_audio_path = "samples/output/output_with_effects.wav"
-    music_dir = "music"
-    output_dir = "samples/output"
+    parser = argparse.ArgumentParser(description="Add background music to an audio file.")
+    parser.add_argument("--config", default="config.json", help="Pipeline config (JSON or YAML)")
+    parser.add_argument("--input", default="samples/output/output_with_effects.wav", help="Input audio file")
+    parser.add_argument("--output", default="samples/output/output_with_music.wav", help="Output audio file")
+    args = parser.parse_args()
+    config = load_config(args.config)
+    sample_rate = config["sample_rate"]
+    music = config["music"]
     
     # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
     
     # Initialize music handler
     music_handler = MusicHandler(
-        sample_rate=SAMPLE_RATE,
-        crossfade_duration=CROSSFADE_DURATION
+        build_dataloader(config),
+        sample_rate=sample_rate,
+        crossfade_duration=music["crossfade_duration"]
     )
     
     # Load input audio
     print("Loading input audio...")
-    audio, sr = librosa.load(input_audio_path, sr=SAMPLE_RATE)
+    audio, sr = librosa.load(args.input, sr=sample_rate)
     
     # Add background music
     print("Adding background music...")
     processed_audio = music_handler.add_background_music(
         audio=audio,
-        music_dir=music_dir,
-        music_volume=MUSIC_VOLUME,
+        music_volume=music["volume"],
         loop_music=True
     )
     
     # Save processed audio
-    output_path = os.path.join(output_dir, "output_with_music.wav")
-    print(f"Saving processed audio to {output_path}...")
-    sf.write(output_path, processed_audio, SAMPLE_RATE)
+    print(f"Saving processed audio to {args.output}...")
+    sf.write(args.output, processed_audio, sample_rate)
     
     print("Done!")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -1,53 +1,48 @@
 import os
+import argparse
 import librosa
 import soundfile as sf
-import numpy as np
-import librosa
-import random
-from typing import Tuple, List, Optional
-import os
 from components.AudioEffects import AudioEffects
+from components.PipelineConfig import build_dataloader, load_config
 
 def main():
-    # Configuration
-    SAMPLE_RATE = 48000
-    MAX_SOUND_EFFECT_LENGTH = 2.0  # seconds
-    COVERAGE = 0.3  # 30% chance of adding sound effect at each position
-    MIN_GAP = 1.0  # minimum gap between sound effects in seconds
-    
-    # Paths
-    input_audio_path = "samples/output/output.wav"
-    sound_effects_dir = "soundEffects"
-    output_dir = "samples/output"
+    parser = argparse.ArgumentParser(description="Add sound effects to an audio file.")
+    parser.add_argument("--config", default="config.json", help="Pipeline config (JSON or YAML)")
+    parser.add_argument("--input", default="samples/output/output.wav", help="Input audio file")
+    parser.add_argument("--output", default="samples/output/output_with_effects.wav", help="Output audio file")
+    args = parser.parse_args()
+    config = load_config(args.config)
+    sample_rate = config["sample_rate"]
+    effects = config["effects"]
     
     # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
     
     # Initialize audio effects processor
     audio_effects = AudioEffects(
-        sample_rate=SAMPLE_RATE,
-        max_sound_effect_length=MAX_SOUND_EFFECT_LENGTH
+        dataloader=build_dataloader(config),
+        sample_rate=sample_rate,
+        max_sound_effect_length=effects["max_length"],
+        effect_gain=effects["gain"]
     )
     
     # Load input audio
     print("Loading input audio...")
-    audio, sr = librosa.load(input_audio_path, sr=SAMPLE_RATE)
+    audio, sr = librosa.load(args.input, sr=sample_rate)
     
     # Apply sound effects
     print("Applying sound effects...")
     processed_audio = audio_effects.apply_sound_effects(
         audio=audio,
-        sound_effects_dir=sound_effects_dir,
-        coverage=COVERAGE,
-        min_gap=MIN_GAP
+        coverage=effects["coverage"],
+        min_gap=config["conversation"]["min_gap"]
     )
     
     # Save processed audio
-    output_path = os.path.join(output_dir, "output_with_effects.wav")
-    print(f"Saving processed audio to {output_path}...")
-    sf.write(output_path, processed_audio, SAMPLE_RATE)
+    print(f"Saving processed audio to {args.output}...")
+    sf.write(args.output, processed_audio, sample_rate)
     
     print("Done!")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -0,0 +1,92 @@
+import argparse
+from components.ClipStats import ClipStatsIndex
+from components.Dataloaders import Dataloader
+from components.SpeakerIndex import SpeakerIndex
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the speaker table and duration, level, loudness and silence statistics for every clip."
+    )
+    parser.add_argument(
+        "--sound_effects_path",
+        default="/Users/constantinpinkl/Downloads/Emilia/sfxSound",
+        help="Path to sound effects directory"
+    )
+    parser.add_argument(
+        "--background_music_path",
+        default="/Users/constantinpinkl/Downloads/Emilia/mtgJamendo",
+        help="Path to background music directory"
+    )
+    parser.add_argument(
+        "--speech_samples_path",
+        default="/Users/constantinpinkl/Downloads/Emilia/Emilia",
+        help="Path to speech samples directory"
+    )
+    parser.add_argument(
+        "--speech_format",
+        default="auto",
+        choices=["auto", "dataset", "tar", "folder"],
+        help="Read speech with datasets.load_dataset, straight from WebDataset tars, or from a dictionary.json "
+             "of audio files (auto: by the path)"
+    )
+    parser.add_argument(
+        "--stats_dir",
+        default="clip_stats",
+        help="Directory to write the statistics index to"
+    )
+    parser.add_argument(
+        "--corpora",
+        nargs="+",
+        default=list(Dataloader.CORPORA),
+        choices=list(Dataloader.CORPORA),
+        help="Corpora to index"
+    )
+    parser.add_argument(
+        "--num_processors",
+        type=int,
+        default=12,
+        help="Number of processors to use for parallel processing"
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=256,
+        help="Number of rows per task"
+    )
+    parser.add_argument(
+        "--top_db",
+        type=float,
+        default=30.0,
+        help="Silence threshold below the loudest frame in dB"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild tables even if the datasets did not change"
+    )
+    args = parser.parse_args()
+
+    dataloader = Dataloader(
+        sound_effects_path=args.sound_effects_path,
+        background_music_path=args.background_music_path,
+        speech_samples_path=args.speech_samples_path,
+        speech_format=args.speech_format,
+        index_workers=args.num_processors,
+        tar_index_dir=args.stats_dir,
+    )
+    speakers = SpeakerIndex.build(dataloader.get_dataset("speech"), args.stats_dir, force=args.force)
+    print(f"speakers: {len(speakers)} speakers, {len(speakers.rows)} utterances")
+    index = ClipStatsIndex.build(
+        dataloader,
+        args.stats_dir,
+        corpora=args.corpora,
+        num_workers=args.num_processors,
+        chunk_size=args.chunk_size,
+        top_db=args.top_db,
+        force=args.force,
+    )
+    for corpus in args.corpora:
+        print(f"{corpus}: {index.meta[corpus]['rows']} rows")
+
+if __name__ == "__main__":
+    main()
@@ -4,25 +4,26 @@ import numpy as np
 from pydub import AudioSegment
 import os
 from components.AudioConversation import AudioConversation
+from components.Dataloaders import Dataloader
 
 if __name__ == "__main__":
-    # Load dictionary
-    with open('/Users/constantinpinkl/University/Research/SpeakerDiarization/Datasets/DataAugmentationPipeline/scripts/dictionary.json', 'r', encoding='utf-8') as f:
-        segmentDict = json.load(f)
-        
+    # Speech files listed in the dictionary written by updateDict.py
+    data_path = '/Users/constantinpinkl/University/Research/SpeakerDiarization/Datasets/DataAugmentationPipeline/scripts/dictionary.json'
+    audio_root = "/Users/constantinpinkl/University/Research/SpeakerDiarization/Datasets/DataAugmentationPipeline/speech"
+    data = Dataloader(None, None, data_path, speech_format="folder", speech_audio_root=audio_root)
+
     # Get all languages
-    languages = list(segmentDict.keys())
+    languages = sorted(set(data.speaker_index.table["language"].tolist()))
     print("All Language: ", languages)
-    conversation = AudioConversation()
-
-    print("Selected Languages: ", conversation.LANGUAGES)
 
     # Extract inputs to variables
     num_speakers = 3
     num_segments = 10
     output_dir = "/Users/constantinpinkl/University/Research/SpeakerDiarization/Datasets/DataAugmentationPipeline/samples/output2"
-    audio_root = "/Users/constantinpinkl/University/Research/SpeakerDiarization/Datasets/DataAugmentationPipeline/speech"
     gap_mean = 0
     gap_std = 0.75
 
-    conversation.augmentAudio(segmentDict, num_speakers, num_segments, output_dir, audio_root, gap_mean, gap_std)
\ No newline at end of file
+    conversation = AudioConversation(data, num_speakers)
+    print("Selected Languages: ", conversation.LANGUAGES)
+
+    conversation.augmentAudio(num_segments, output_dir, gap_mean, gap_std)
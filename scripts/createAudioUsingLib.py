@@ -3,29 +3,28 @@ import random
 import numpy as np
 from pydub import AudioSegment
 import os
+import sys
 from components.AudioConversation import AudioConversation
 from components.AudioEffects import AudioEffects
-from components.Dataloaders import Dataloader
 from components.MusicHandler import MusicHandler
+from components.PipelineConfig import build_dataloader, load_config
 import librosa
 import soundfile as sf
 
 if __name__ == "__main__":
-    dataloader = Dataloader(
-        sound_effects_path="/Users/constantinpinkl/Downloads/Emilia/sfxSound",
-        background_music_path="/Users/constantinpinkl/Downloads/Emilia/mtgJamendo",
-        speech_samples_path="/Users/constantinpinkl/Downloads/Emilia/Emilia"
-    )
+    # Pipeline config path as the only argument
+    config = load_config(sys.argv[1] if len(sys.argv) > 1 else "config.json")
+    dataloader = build_dataloader(config)
 
-    SAMPLE_RATE = 48000
-    MAX_SOUND_EFFECT_LENGTH = 2.0 
-    COVERAGE = 0.3  # 30% chance of adding sound effect at each position
-    MIN_GAP = 1.0 
+    SAMPLE_RATE = config["sample_rate"]
+    MAX_SOUND_EFFECT_LENGTH = config["effects"]["max_length"]
+    COVERAGE = config["effects"]["coverage"]
+    MIN_GAP = config["conversation"]["min_gap"]
     print("########################")
     print("Init Dataloader")
-    audio_conversation = AudioConversation(dataloader)
+    audio_conversation = AudioConversation(dataloader, config["conversation"]["speakers"], sample_rate=SAMPLE_RATE)
     print("########################")
-    speakers = dataloader.get_random_speakers(2)
+    speakers = dataloader.get_random_speakers(config["conversation"]["speakers"])
     print(speakers)
 
     # Get segments for speaker
@@ -36,7 +35,7 @@ if __name__ == "__main__":
 
     # Arrage Segments
     print("Arranging Segments")
-    segments = audio_conversation.arrangeSegments(speakers, 10)
+    segments = audio_conversation.arrangeSegments(speakers, config["conversation"]["num_segments"])
     print("Arranged Segments: ", len(segments))
     # Apply Gaussian Gap
     segments = audio_conversation.applyGaussianGap(segments, 0, 0.75)  # Mean, Std
@@ -65,10 +64,10 @@ if __name__ == "__main__":
     print(f"Segments saved to {os.path.join(output_dir, 'segments.json')}")
 
     # Add background music
-    music_handler = MusicHandler(dataloader)
+    music_handler = MusicHandler(dataloader, sample_rate=SAMPLE_RATE, crossfade_duration=config["music"]["crossfade_duration"])
     # load the audio
-    audio, sr = librosa.load("output_segments/output.wav", sr=48000)
-    audio = music_handler.add_background_music(audio)
+    audio, sr = librosa.load("output_segments/output.wav", sr=SAMPLE_RATE)
+    audio = music_handler.add_background_music(audio, music_volume=config["music"]["volume"])
     # print(len(audio))
     # Save the audio 
     sf.write("output_segments/output_with_music.wav", audio, sr)
@@ -78,7 +77,8 @@ if __name__ == "__main__":
     audio_effects = AudioEffects(
         dataloader=dataloader,
         sample_rate=SAMPLE_RATE,
-        max_sound_effect_length=MAX_SOUND_EFFECT_LENGTH
+        max_sound_effect_length=MAX_SOUND_EFFECT_LENGTH,
+        effect_gain=config["effects"]["gain"]
     )
     print("Applying sound effects...")
     processed_audio = audio_effects.apply_sound_effects(
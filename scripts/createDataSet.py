@@ -1,11 +1,104 @@
 import argparse
 from components.DataGen import DataGen
-from components.Dataloaders import Dataloader
+from components.PipelineConfig import build_dataloader, load_config
+from components.ShardWriter import move_shard_to
+from components.UsageTracker import format_coverage
+
+# Pipeline config key of every option; see components/PipelineConfig.py
+OPTION_KEYS = {
+    "sound_effects_path": ("sources", "sfx"),
+    "background_music_path": ("sources", "music"),
+    "speech_samples_path": ("sources", "speech"),
+    "speech_format": ("sources", "speech_format"),
+    "speech_audio_root": ("sources", "speech_audio_root"),
+    "stats_dir": ("sources", "stats_dir"),
+    "n_samples": ("output", "n_samples"),
+    "files_per_tar": ("output", "files_per_tar"),
+    "output_dir": ("output", "dir"),
+    "move_shards_to": ("output", "move_shards_to"),
+    "output_format": ("output", "format"),
+    "stream_block": ("output", "stream_block"),
+    "segments": ("output", "segments"),
+    "num_processors": ("resources", "num_processors"),
+    "decode_threads": ("resources", "decode_threads"),
+    "prefetch": ("resources", "prefetch"),
+    "decode_cache_mb": ("resources", "decode_cache_mb"),
+    "sample_rate": ("sample_rate",),
+    "seed": ("seed",),
+    "num_speakers": ("conversation", "speakers"),
+    "num_segments": ("conversation", "num_segments"),
+    "languages": ("conversation", "languages"),
+    "speaker_weight": ("conversation", "speaker_weight"),
+    "min_conversation_length": ("conversation", "min_length"),
+    "min_gap": ("conversation", "min_gap"),
+    "trim_silence": ("conversation", "trim_silence"),
+    "balance_usage": ("conversation", "balance_usage"),
+    "max_reuse": ("conversation", "max_reuse"),
+    "speech_lufs": ("loudness", "speech_lufs"),
+    "speech_lufs_jitter": ("loudness", "speech_lufs_jitter"),
+    "music_lufs": ("loudness", "music_lufs"),
+    "effect_lufs": ("loudness", "effect_lufs"),
+    "music_snr": ("loudness", "music_snr"),
+    "effect_snr": ("loudness", "effect_snr"),
+    "reverb_probability": ("reverb", "probability"),
+    "rir_dir": ("reverb", "rir_dir"),
+    "coverage": ("effects", "coverage"),
+    "max_sound_effect_length": ("effects", "max_length"),
+    "effect_gain": ("effects", "gain"),
+    "label_hop": ("labels", "hop"),
+    "mix_stages": ("mix_stages",),
+}
+AUGMENTATION_OPTIONS = ("noise_probability", "noise_snr", "bandpass_probability", "codec_probability")
+
+
+def given_options(parser, argv=None) -> set:
+    """
+    Names of the options given on the command line, whatever their value.
+    """
+    # Options that are not given keep the placeholder instead of their default
+    unset = object()
+    names = (*OPTION_KEYS, *AUGMENTATION_OPTIONS)
+    args = parser.parse_args(argv, argparse.Namespace(**{name: unset for name in names}))
+    return {name for name in names if getattr(args, name) is not unset}
+
+
+def config_overrides(parser, args, argv=None) -> dict:
+    """
+    Turn command line options into pipeline config overrides. Without --config
+    every option applies; with --config only options given on the command line
+    override the file, also when they are set to their default.
+    """
+    explicit = given_options(parser, argv) if args.config is not None else None
+
+    def given(name):
+        return explicit is None or name in explicit
+
+    overrides = {}
+    for name, path in OPTION_KEYS.items():
+        if not given(name):
+            continue
+        section = overrides
+        for key in path[:-1]:
+            section = section.setdefault(key, {})
+        section[path[-1]] = getattr(args, name)
+    if any(given(name) for name in AUGMENTATION_OPTIONS):
+        overrides["augmentation"] = [
+            {"stage": "noise", "probability": args.noise_probability, "snr_range": args.noise_snr},
+            {"stage": "bandpass", "probability": args.bandpass_probability},
+            {"stage": "codec", "probability": args.codec_probability},
+        ]
+    return overrides
+
 
 def main():
     parser = argparse.ArgumentParser(
         description="Generate augmented data for speaker diarization."
     )
+    parser.add_argument(
+        "--config",
+        default=None,
+        help="Pipeline config (JSON or YAML); options given on the command line override it"
+    )
     parser.add_argument(
         "--sound_effects_path",
         default="/Users/constantinpinkl/Downloads/Emilia/sfxSound",
@@ -21,6 +114,23 @@ def main():
         default="/Users/constantinpinkl/Downloads/Emilia/Emilia",
         help="Path to speech samples directory"
     )
+    parser.add_argument(
+        "--speech_format",
+        default="auto",
+        choices=["auto", "dataset", "tar", "folder"],
+        help="Read speech with datasets.load_dataset, straight from WebDataset tars, or from a dictionary.json "
+             "of audio files (auto: by the path)"
+    )
+    parser.add_argument(
+        "--speech_audio_root",
+        default=None,
+        help="Audio directory of a dictionary.json speech source (default: its directory)"
+    )
+    parser.add_argument(
+        "--stats_dir",
+        default=None,
+        help="Clip statistics index written by buildClipStats.py"
+    )
     parser.add_argument(
         "--n_samples",
         type=int,
@@ -40,11 +150,60 @@ def main():
         default=12,
         help="Number of processors to use for parallel processing"
     )
+    parser.add_argument(
+        "--decode_threads",
+        type=int,
+        default=4,
+        help="Number of decode threads per worker process; 0 decodes on the rendering thread"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of upcoming samples each worker decodes ahead"
+    )
+    parser.add_argument(
+        "--decode_cache_mb",
+        type=float,
+        default=512,
+        help="Memory budget of each worker's cache of decoded clips in MB (0 disables it)"
+    )
     parser.add_argument(
         "--output_dir",
         default="output_data",
         help="Directory to save generated data"
     )
+    parser.add_argument(
+        "--move_shards_to",
+        default=None,
+        help="Move every finished shard into this directory"
+    )
+    parser.add_argument(
+        "--output_format",
+        default="mp3",
+        choices=["mp3", "flac", "pcm"],
+        help="Audio format of the mix, stems and segments"
+    )
+    parser.add_argument(
+        "--stream_block",
+        type=float,
+        default=None,
+        help="Render samples in blocks of this many seconds, spooling the outputs to disk, "
+             "so memory does not grow with the conversation length"
+    )
+    parser.add_argument(
+        "--segments",
+        default="encode",
+        choices=["encode", "reference", "utterances"],
+        help="Encode every segment, or store references to the source rows "
+             "(with one copy of every source utterance per shard for \"utterances\")"
+    )
+    parser.add_argument(
+        "--label_hop",
+        type=float,
+        default=0.01,
+        help="Frame hop of the speaker activity labels in seconds"
+    )
     parser.add_argument(
         "--sample_rate",
         type=int,
@@ -76,6 +235,124 @@ def main():
         help="Gain applied to sound effects"
     )
 
+    parser.add_argument(
+        "--speech_lufs",
+        type=float,
+        default=None,
+        help="Target loudness of each speaker in LUFS (disabled if not set)"
+    )
+    parser.add_argument(
+        "--speech_lufs_jitter",
+        type=float,
+        default=3.0,
+        help="Per-speaker spread of the speech loudness target in LU"
+    )
+    parser.add_argument(
+        "--music_lufs",
+        type=float,
+        default=None,
+        help="Target loudness of the background music in LUFS (disabled if not set)"
+    )
+    parser.add_argument(
+        "--effect_lufs",
+        type=float,
+        default=None,
+        help="Target loudness of sound effects in LUFS (disabled if not set)"
+    )
+
+    parser.add_argument(
+        "--music_snr",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("LOW", "HIGH"),
+        help="Range of speech-to-music ratios in dB (overrides --music_lufs)"
+    )
+    parser.add_argument(
+        "--effect_snr",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("LOW", "HIGH"),
+        help="Range of speech-to-effect ratios in dB (overrides --effect_lufs)"
+    )
+
+    parser.add_argument(
+        "--trim_silence",
+        action="store_true",
+        help="Cut leading and trailing silence from every utterance"
+    )
+    parser.add_argument(
+        "--balance_usage",
+        action="store_true",
+        help="Plan the least used utterances of each speaker, for even corpus coverage; plans then also depend on --num_processors and --files_per_tar"
+    )
+    parser.add_argument(
+        "--max_reuse",
+        type=int,
+        default=None,
+        help="Place every utterance at most this many times (implies --balance_usage)"
+    )
+
+    parser.add_argument(
+        "--reverb_probability",
+        type=float,
+        default=0.0,
+        help="Share of samples whose speaker stems are reverberated"
+    )
+
+    parser.add_argument(
+        "--rir_dir",
+        type=str,
+        default=None,
+        help="Directory of room impulse responses, one room per subdirectory (default: simulated rooms)"
+    )
+
+    parser.add_argument(
+        "--noise_probability",
+        type=float,
+        default=0.0,
+        help="Share of samples mixed with stationary noise"
+    )
+
+    parser.add_argument(
+        "--noise_snr",
+        type=float,
+        nargs=2,
+        default=[5.0, 30.0],
+        metavar=("LOW", "HIGH"),
+        help="Range of noise SNRs in dB"
+    )
+
+    parser.add_argument(
+        "--bandpass_probability",
+        type=float,
+        default=0.0,
+        help="Share of samples band-limited to a telephony or loudspeaker band"
+    )
+
+    parser.add_argument(
+        "--codec_probability",
+        type=float,
+        default=0.0,
+        help="Share of samples degraded by a mu-law or GSM-style codec"
+    )
+
+    parser.add_argument(
+        "--mix_stages",
+        nargs=3,
+        default=list(DataGen.MIX_STAGES),
+        choices=DataGen.MIX_STAGES,
+        help="Order of the stages run on the summed stems, e.g. augmentation music effects"
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of every random draw; each sample gets its own generators derived from it"
+    )
+
     parser.add_argument(
         "--num_speakers",
         type=int,
@@ -83,6 +360,27 @@ def main():
         help="Number of speakers to use in the conversation"
     )
 
+    parser.add_argument(
+        "--languages",
+        nargs="+",
+        default=None,
+        help="Only draw speakers of these languages, e.g. DE EN"
+    )
+
+    parser.add_argument(
+        "--speaker_weight",
+        default=None,
+        choices=["utterances", "duration"],
+        help="Draw speakers proportionally to their number of utterances or speech duration"
+    )
+
+    parser.add_argument(
+        "--min_conversation_length",
+        type=float,
+        default=None,
+        help="Redraw speakers until the planned speech is at least this many seconds"
+    )
+
     parser.add_argument(
         "--num_segments",
         type=int,
@@ -92,33 +390,25 @@ def main():
 
     args = parser.parse_args()
 
+    config = load_config(args.config, config_overrides(parser, args))
+
     print("########################")
     print("Init Dataloader")
     print("########################")
-    dataloader = Dataloader(
-        sound_effects_path=args.sound_effects_path,
-        background_music_path=args.background_music_path,
-        speech_samples_path=args.speech_samples_path
-    )
+    dataloader = build_dataloader(config)
 
     print("Init DataGenerator")
     print("########################")
-    generator = DataGen(
-        dataloader=dataloader,
-        n_samples=args.n_samples,
-        files_per_tar=args.files_per_tar,
-        output_dir=args.output_dir,
-        sample_rate=args.sample_rate,
-        max_sound_effect_length=args.max_sound_effect_length,
-        coverage=args.coverage,
-        min_gap=args.min_gap,
-        effect_gain=args.effect_gain,
-        speakers=args.num_speakers,
-        num_processors=args.num_processors,
-        num_segments=args.num_segments,
+    move_shards_to = config["output"]["move_shards_to"]
+    generator = DataGen.from_config(
+        config,
+        dataloader,
+        post_shard_callback=move_shard_to(move_shards_to) if move_shards_to else None,
     )
     print("Starting data generation...")
-    generator.generate_data()
+    coverage = generator.generate_data()
+    print("Corpus coverage:")
+    print(format_coverage(coverage))
     print("#########################")
     print("Data generation completed!")
     print("#########################")
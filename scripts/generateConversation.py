@@ -6,6 +6,7 @@ import json
 from components.AudioEffects import AudioEffects
 from components.MusicHandler import MusicHandler
 from components.AudioConversation import AudioConversation
+from components.Dataloaders import Dataloader
 import numpy as np
 
 from components.Segments2Image import SpeakerVisualization
@@ -57,11 +58,10 @@ def main():
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
 
-    with open(args.data_path, 'r', encoding='utf-8') as f:
-        segmentDict = json.load(f)
-    
-    conversation = AudioConversation()
-    segments = conversation.augmentAudio(segmentDict, args.num_speakers, args.num_segments, args.output_dir, args.audio_root, args.gap_mean, args.gap_std)
+    # Speech files listed in the dictionary written by updateDict.py
+    data = Dataloader(None, None, args.data_path, speech_format="folder", speech_audio_root=args.audio_root)
+    conversation = AudioConversation(data, args.num_speakers, sample_rate=args.sample_rate)
+    segments = conversation.augmentAudio(args.num_segments, args.output_dir, args.gap_mean, args.gap_std)
 
     # Load input audio
     print(f"Loading input audio from {args.output_dir}/output.wav...")
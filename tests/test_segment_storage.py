@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import pytest
+
+datasets = pytest.importorskip("datasets")
+
+from components.DataGen import DataGen
+from components.Dataloaders import Dataloader
+from components.PipelineConfig import load_config
+from components.ShardReader import ShardDirectoryReader, scan_shard
+from components.ShardWriter import ShardWriter
+
+
+class _AsFloat32:
+    # Decoded datasets hold float32 arrays; from_list stores lists
+    def __init__(self, column):
+        self.column = column
+
+    def __call__(self, batch):
+        for audio in batch.get(self.column, []):
+            audio["array"] = np.asarray(audio["array"], dtype=np.float32)
+        return batch
+
+
+def _dataloader(num_speakers=4, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for s in range(num_speakers):
+        speaker = f"{'DE' if s % 2 else 'EN'}_B{s:05d}"
+        for k in range(2):
+            # Speech between silences, so trimming cuts into every utterance
+            speech = rng.uniform(-0.3, 0.3, int(rng.uniform(0.5, 1.5) * 16000))
+            audio = np.concatenate([np.zeros(3200), speech, np.zeros(1600)])
+            rows.append({
+                "json": {"speaker": speaker, "duration": len(audio) / 16000, "text": f"t{k}"},
+                "flac": {"path": f"{speaker}_{k}.flac", "array": audio.tolist(), "sampling_rate": 16000},
+            })
+    speech = datasets.Dataset.from_list(rows).with_transform(_AsFloat32("flac"))
+    music = datasets.Dataset.from_list([
+        {"opus": {"array": rng.uniform(-0.3, 0.3, 16000 * 3).tolist(), "sampling_rate": 16000}}
+        for _ in range(2)
+    ]).with_transform(_AsFloat32("opus"))
+    sfx = datasets.Dataset.from_list([
+        {"wav": {"array": rng.uniform(-0.3, 0.3, 8000).tolist(), "sampling_rate": 16000}}
+        for _ in range(2)
+    ]).with_transform(_AsFloat32("wav"))
+    dataloader = Dataloader("sfx", "music", "speech")
+    dataloader._datasets = {"speech": {"train": speech}, "music": {"train": music}, "sfx": {"train": sfx}}
+    return dataloader
+
+
+def _generate(directory, segments, dataloader):
+    config = load_config(None, {
+        "output": {"dir": str(directory), "format": "pcm", "n_samples": 4, "files_per_tar": 2,
+                   "segments": segments},
+        "sample_rate": 16000,
+        "resources": {"num_processors": 1},
+        "seed": 5,
+        "conversation": {"speakers": 2, "num_segments": 5, "trim_silence": True},
+        "loudness": {"speech_lufs": -23.0},
+    })
+    DataGen.from_config(config, dataloader).generate_data()
+    return ShardDirectoryReader(str(directory))
+
+
+@pytest.fixture
+def dataloader(tmp_path, monkeypatch):
+    monkeypatch.setattr("components.SpeakerIndex.CACHE_DIR", str(tmp_path / "cache"))
+    return _dataloader()
+
+
+def test_referenced_segments_match_encoded_ones(tmp_path, dataloader):
+    encoded = _generate(tmp_path / "encode", "encode", dataloader)
+    referenced = _generate(tmp_path / "reference", "reference", dataloader)
+    assert sorted(encoded) == sorted(referenced)
+    for key in encoded:
+        expected_meta, meta = encoded.shard(key).json(key), referenced.shard(key).json(key)
+        reader = referenced.shard(key)
+        assert all("stem_path" not in seg and "trim" in seg for seg in meta["segments"])
+        for idx, seg in enumerate(meta["segments"]):
+            assert seg["row"] == expected_meta["segments"][idx]["row"]
+            expected = encoded.shard(key).segment(key, idx, expected_meta)
+            actual = reader.segment(key, idx, meta, dataloader=dataloader)
+            assert len(actual) == seg["trim"][1] - seg["trim"][0] == len(expected)
+            assert np.abs(actual.astype(np.int32) - expected).max() <= 1
+        with pytest.raises(ValueError):
+            reader.segment(key, 0, meta)
+
+
+def test_utterance_copies_are_stored_once_per_shard(tmp_path, dataloader):
+    encoded = _generate(tmp_path / "encode", "encode", dataloader)
+    copied = _generate(tmp_path / "utterances", "utterances", dataloader)
+    referenced = {}
+    for key in copied:
+        reader = copied.shard(key)
+        meta = reader.json(key)
+        for idx, seg in enumerate(meta["segments"]):
+            name = seg["utterance"]
+            assert name.partition(".")[2].startswith(ShardWriter.SHARED_PREFIX)
+            referenced.setdefault(os.path.basename(reader.path), set()).add(name.partition(".")[2])
+            # Rebuilt from the copy in the shard, without the speech dataset
+            expected = encoded.shard(key).segment(key, idx)
+            actual = reader.segment(key, idx, meta)
+            assert len(actual) == len(expected)
+            # The copy is quantized to 16 bits before the gain
+            assert np.abs(actual.astype(np.int32) - expected).max() <= 2
+    for shard, suffixes in referenced.items():
+        stored = [name.partition(".")[2] for members in scan_shard(str(tmp_path / "utterances" / shard)).values()
+                  for name in members if name.partition(".")[2].startswith(ShardWriter.SHARED_PREFIX)]
+        assert sorted(stored) == sorted(suffixes)
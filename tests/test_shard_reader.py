@@ -0,0 +1,84 @@
+import json
+import os
+
+import numpy as np
+
+from components.ShardReader import ShardDirectoryReader, ShardReader, scan_shard
+from components.ShardWriter import ShardWriter
+
+
+def _sample(key, seed):
+    rng = np.random.default_rng(seed)
+    stem = rng.integers(-2000, 2000, 480, dtype=np.int16)
+    mix = rng.integers(-2000, 2000, 480, dtype=np.int16)
+    meta = {"key": key, "audio": {"format": "pcm", "num_samples": 480}}
+    return meta, stem, mix, [
+        (f"{key}.json", json.dumps(meta).encode("utf-8")),
+        (f"{key}.stem_0.pcm", stem.astype("<i2").tobytes()),
+        (f"{key}.pcm", mix.astype("<i2").tobytes()),
+        # Same content, and name, in every sample: stored once per shard
+        (f"{key}.cas_0123abcd.pcm", np.arange(64, dtype="<i2").tobytes()),
+    ]
+
+
+def _write(directory, num_samples, files_per_tar):
+    samples = {}
+    with ShardWriter(str(directory), files_per_tar) as writer:
+        for i in range(num_samples):
+            key = f"{i:06d}"
+            meta, stem, mix, members = _sample(key, i)
+            samples[key] = meta, stem, mix
+            writer.write(key, members)
+    return samples
+
+
+def test_reader_reads_members_through_the_sidecar_index(tmp_path):
+    samples = _write(tmp_path, 5, 3)
+    with open(tmp_path / ShardWriter.MANIFEST_NAME, "r", encoding="utf-8") as f:
+        manifest = json.load(f)["shards"]
+    assert [entry["samples"] for entry in manifest] == [3, 2]
+    # Four members for the first sample of a shard, three for the others
+    assert [entry["members"] for entry in manifest] == [10, 7]
+
+    path = str(tmp_path / manifest[0]["shard"])
+    assert os.path.exists(str(tmp_path / manifest[0]["index"]))
+    with ShardReader(path) as reader:
+        # The sidecar lists the offsets of the tar headers, plus the shared
+        # members each sample refers to without storing them
+        scanned = scan_shard(path)
+        for key, members in reader.index.items():
+            assert {name: location for name, location in members.items() if name in scanned[key]} == scanned[key]
+        assert reader.keys() == ["000000", "000001", "000002"]
+        for key in reader:
+            meta, stem, mix = samples[key]
+            assert reader.json(key) == meta
+            np.testing.assert_array_equal(reader.audio(key, "stem_0"), stem)
+            np.testing.assert_array_equal(reader.mix(key), mix)
+            assert bytes(reader.member(key, "stem_0.pcm")) == stem.astype("<i2").tobytes()
+            np.testing.assert_array_equal(
+                np.frombuffer(reader.member(key, "cas_0123abcd.pcm"), dtype="<i2"), np.arange(64)
+            )
+        # Every sample resolves its shared member to the single stored copy
+        locations = {tuple(reader.index[key][f"{key}.cas_0123abcd.pcm"]) for key in reader}
+        assert len(locations) == 1
+
+
+def test_reader_scans_shards_without_an_index(tmp_path):
+    samples = _write(tmp_path, 2, 2)
+    os.remove(str(tmp_path / ("shard_00000" + ShardWriter.INDEX_SUFFIX)))
+    with ShardReader(str(tmp_path / "shard_00000.tar")) as reader:
+        for key in ("000000", "000001"):
+            np.testing.assert_array_equal(reader.audio(key, "stem_0"), samples[key][1])
+
+
+def test_directory_reader_finds_the_shard_of_every_key(tmp_path):
+    samples = _write(tmp_path, 5, 2)
+    reader = ShardDirectoryReader(str(tmp_path))
+    try:
+        assert sorted(reader) == sorted(samples)
+        for key, (meta, _, mix) in samples.items():
+            shard = reader.shard(key)
+            assert shard.json(key) == meta
+            np.testing.assert_array_equal(shard.mix(key), mix)
+    finally:
+        reader.close()
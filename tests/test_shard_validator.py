@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+
+from components.ShardValidator import format_report, validate_directory
+from components.ShardWriter import ShardWriter
+
+
+def _write(directory, num_samples=4, files_per_tar=2, silent=()):
+    rng = np.random.default_rng(0)
+    with ShardWriter(str(directory), files_per_tar) as writer:
+        for i in range(num_samples):
+            key = f"{i:06d}"
+            mix = np.zeros(800, dtype="<i2") if i in silent else rng.integers(-3000, 3000, 800, dtype="<i2")
+            meta = {
+                "audio": {"format": "pcm", "sample_rate": 8000, "num_samples": len(mix)},
+                "segments": [
+                    {"id": "EN_A", "language": "EN", "start": 0.0, "end": 0.06},
+                    {"id": "DE_B", "language": "DE", "start": 0.05, "end": 0.1},
+                ],
+            }
+            writer.write(key, [(f"{key}.json", json.dumps(meta).encode("utf-8")), (f"{key}.pcm", mix.tobytes())])
+
+
+def _member_offset(directory, shard, name):
+    with open(str(directory / (shard + ShardWriter.INDEX_SUFFIX)), "r", encoding="utf-8") as f:
+        samples = json.load(f)["samples"]
+    return samples[name.split(".", 1)[0]][name][0]
+
+
+def test_complete_directory_has_no_errors(tmp_path):
+    _write(tmp_path)
+    report = validate_directory(str(tmp_path), num_workers=2, check_audio=True)
+    assert report["shards"] == 2
+    assert report["errors"] == []
+    assert report["stats"]["samples"] == 4
+    assert report["stats"]["speakers"] == 2
+    assert "all shards match the manifest" in format_report(report)
+
+
+def test_corrupt_shard_fails_its_checksum(tmp_path):
+    _write(tmp_path)
+    offset = _member_offset(tmp_path, "shard_00001", "000003.pcm")
+    with open(str(tmp_path / "shard_00001.tar"), "r+b") as f:
+        f.seek(offset + 100)
+        data = f.read(16)
+        f.seek(offset + 100)
+        f.write(bytes(b ^ 0xFF for b in data))
+    errors = validate_directory(str(tmp_path), num_workers=2)["errors"]
+    assert errors == ["shard_00001.tar: checksum mismatch"]
+
+
+def test_truncated_shard_and_leftovers_are_reported(tmp_path):
+    _write(tmp_path)
+    path = tmp_path / "shard_00000.tar"
+    size = path.stat().st_size
+    with open(str(path), "r+b") as f:
+        f.truncate(size // 2)
+    (tmp_path / "shard_00002.tar.tmp").write_bytes(b"")
+    errors = validate_directory(str(tmp_path), num_workers=2)["errors"]
+    assert "shard_00002.tar.tmp: unfinished write" in errors
+    assert f"shard_00000.tar: {size // 2} bytes, manifest lists {size}" in errors
+    # The samples behind the cut are missing from the shard
+    assert any(error.startswith("shard_00000.tar: unreadable") or "samples, manifest lists 2" in error
+               for error in errors)
+    assert not any(error.startswith("shard_00001") for error in errors)
+
+
+def test_check_audio_reports_silent_mixes(tmp_path):
+    _write(tmp_path, silent=(2,))
+    assert validate_directory(str(tmp_path), num_workers=2)["errors"] == []
+    errors = validate_directory(str(tmp_path), num_workers=2, check_audio=True)["errors"]
+    assert errors == ["shard_00001.tar/000002: silent mix"]
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+datasets = pytest.importorskip("datasets")
+
+from components.DataGen import DataGen
+from components.Dataloaders import Dataloader
+from components.PipelineConfig import load_config
+from components.ShardReader import ShardDirectoryReader
+
+
+class _AsFloat32:
+    # Decoded datasets hold float32 arrays; from_list stores lists
+    def __init__(self, column):
+        self.column = column
+
+    def __call__(self, batch):
+        for audio in batch.get(self.column, []):
+            audio["array"] = np.asarray(audio["array"], dtype=np.float32)
+        return batch
+
+
+def _dataloader(num_speakers=12, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for s in range(num_speakers):
+        speaker = f"{'DE' if s % 2 else 'EN'}_B{s:05d}"
+        for k in range(1 + s % 4):
+            duration = float(rng.uniform(0.5, 2.0))
+            rows.append({
+                "json": {"speaker": speaker, "duration": duration, "text": f"t{k}"},
+                "mp3": {
+                    "path": f"{speaker}_{k}.mp3",
+                    "array": rng.uniform(-0.3, 0.3, int(duration * 24000)).tolist(),
+                    "sampling_rate": 24000,
+                },
+            })
+    speech = datasets.Dataset.from_list(rows).with_transform(_AsFloat32("mp3"))
+    music = datasets.Dataset.from_list([
+        {"opus": {"array": rng.uniform(-0.3, 0.3, 48000 * 3).tolist(), "sampling_rate": 48000}}
+        for _ in range(3)
+    ]).with_transform(_AsFloat32("opus"))
+    sfx = datasets.Dataset.from_list([
+        {"wav": {"array": rng.uniform(-0.3, 0.3, 24000).tolist(), "sampling_rate": 48000}}
+        for _ in range(3)
+    ]).with_transform(_AsFloat32("wav"))
+    dataloader = Dataloader("sfx", "music", "speech")
+    dataloader._datasets = {"speech": {"train": speech}, "music": {"train": music}, "sfx": {"train": sfx}}
+    return dataloader
+
+
+def _generate(directory, stream_block):
+    config = load_config(None, {
+        "output": {"dir": str(directory), "format": "pcm", "n_samples": 6, "files_per_tar": 3,
+                   "stream_block": stream_block},
+        "resources": {"num_processors": 2},
+        "seed": 11,
+        "conversation": {"speakers": 3, "num_segments": 8, "trim_silence": True},
+        "loudness": {"speech_lufs": -23.0, "music_snr": [5.0, 15.0], "effect_snr": [5.0, 10.0]},
+        "music": {"loop": True},
+    })
+    DataGen.from_config(config, _dataloader()).generate_data()
+    return ShardDirectoryReader(str(directory))
+
+
+def test_streamed_samples_match_in_memory_render(tmp_path, monkeypatch):
+    monkeypatch.setattr("components.SpeakerIndex.CACHE_DIR", str(tmp_path / "cache"))
+    # Default decode_threads and prefetch: decodes of several samples overlap the mixing
+    memory = _generate(tmp_path / "memory", None)
+    streamed = _generate(tmp_path / "streamed", 0.25)
+    assert sorted(memory) == sorted(streamed)
+    for key in memory:
+        expected, actual = memory.sample(key), streamed.sample(key)
+        assert actual["json"] == expected["json"]
+        for a, b in zip(actual["stems"], expected["stems"]):
+            np.testing.assert_array_equal(a, b)
+        # The streamed mix is limited from a float32 spool
+        assert np.abs(actual["mix"].astype(np.int32) - expected["mix"]).max() <= 1
+        np.testing.assert_array_equal(actual["activity"], expected["activity"])
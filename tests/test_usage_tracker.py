@@ -0,0 +1,74 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from components.SpeakerIndex import SpeakerIndex
+from components.UsageTracker import UsageTracker, format_coverage
+
+
+class _JsonColumn(list):
+    # Slices like the json column of a speech dataset
+    def __getitem__(self, index):
+        return {"json": list.__getitem__(self, index)}
+
+
+def _speaker_index():
+    # Rows 0-2 are EN_A (1 s each), rows 3-4 DE_B (2 s each), row 5 DE_C (4 s)
+    rows = [{"speaker": "EN_A", "duration": 1.0}] * 3 + [{"speaker": "DE_B", "duration": 2.0}] * 2
+    return SpeakerIndex.from_dataset(_JsonColumn(rows + [{"speaker": "DE_C", "duration": 4.0}]))
+
+
+def test_record_counts_every_use(tmp_path):
+    usage = UsageTracker.create(str(tmp_path / UsageTracker.FILE_NAME), 6)
+    usage.record([0, 3, 3])
+    usage.record([])
+    usage.record(np.array([3]))
+    np.testing.assert_array_equal(usage.counts, [1, 0, 0, 3, 0, 0])
+    # Workers reopen the same file
+    reopened = UsageTracker(usage.path)
+    np.testing.assert_array_equal(reopened.uses(np.array([0, 3, 5])), [1, 3, 0])
+
+
+def test_report_covers_utterances_speakers_and_languages(tmp_path):
+    usage = UsageTracker.create(str(tmp_path / UsageTracker.FILE_NAME), 6, max_reuse=3)
+    usage.record([0, 1, 3, 3, 3])
+    report = usage.write_report(_speaker_index(), str(tmp_path))
+    assert report["utterances"] == 6
+    assert report["used_utterances"] == 3
+    assert report["coverage"] == pytest.approx(0.5)
+    assert report["hours"] == pytest.approx(11.0 / 3600)
+    assert report["used_hours"] == pytest.approx(4.0 / 3600)
+    assert report["speakers"] == 3
+    assert report["used_speakers"] == 2
+    assert report["placements"] == 5
+    assert report["max_uses"] == 3
+    assert report["max_reuse"] == 3
+    assert report["uses"] == {"0": 3, "1": 2, "3": 1}
+    assert report["languages"]["EN"]["coverage"] == pytest.approx(2 / 3)
+    assert report["languages"]["DE"]["duration_coverage"] == pytest.approx(2.0 / 8.0)
+    with open(os.path.join(str(tmp_path), UsageTracker.REPORT_NAME), "r", encoding="utf-8") as f:
+        assert json.load(f) == report
+    assert "3 of 6 used" in format_coverage(report)
+
+
+def test_shares_keep_their_uses_and_split_the_reuse_cap(tmp_path):
+    usage = UsageTracker.create(str(tmp_path / UsageTracker.FILE_NAME), 4, max_reuse=3)
+    usage.record([0, 1, 1, 1])
+    rows = np.arange(4)
+    shares = [usage.share(slot, 2) for slot in range(2)]
+    # 2, 0, 3 and 3 uses are left, dealt over the two slots
+    np.testing.assert_array_equal(shares[0].available(rows), [True, False, True, True])
+    np.testing.assert_array_equal(shares[1].available(rows), [True, False, True, True])
+    shares[0].record([2, 2])
+    shares[1].record([0, 2])
+    np.testing.assert_array_equal(shares[0].uses(rows), [1, 3, 2, 0])
+    np.testing.assert_array_equal(shares[0].available(rows), [True, False, False, True])
+    np.testing.assert_array_equal(shares[1].available(rows), [False, False, False, True])
+    # Nothing reaches the file until the shared tracker records the placements
+    np.testing.assert_array_equal(usage.counts, [1, 3, 0, 0])
+    for share in shares:
+        usage.record(share.placed)
+    np.testing.assert_array_equal(usage.counts, [2, 3, 3, 0])
+    assert usage.counts.max() <= usage.max_reuse